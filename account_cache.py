@@ -0,0 +1,180 @@
+# account_cache.py — кэш состояния аккаунта для проверки перед сделкой без сетевого запроса
+#
+# Позиции / открытые ордера / алго-ордера по инструментам лежат в AccountState
+# (private_stream). Приватный стрим присылает только изменения после подписки
+# (позиции и ордера Bybit, ордера OKX — без начального снимка), поэтому он держит
+# данные актуальными лишь поверх снимка REST, снятого не раньше подключения; без
+# стрима полный снимок REST снимается раз в ACCOUNT_REFRESH_SEC.
+# Вебхук спрашивает busy(inst): ответ из памяти, либо None, если данные старше
+# ACCOUNT_MAX_AGE_SEC — тогда вызывающий делает живой запрос, как раньше.
+#
+# REST-снимок делает один процесс на хост — держатель аренды shared_state
+# (account:<venue>); он же кладёт снимок в shared_state, остальные воркеры gunicorn
+# берут его оттуда без сети. Иначе N воркеров опрашивали бы позиции и ордера
+# обеих площадок каждые 2 с и выбирали лимит OKX /account/positions (10 за 2 с).
+# При живом стриме воркер сверяется со снимком держателя раз в ACCOUNT_RECONCILE_SEC;
+# после (пере)подключения своего стрима, пока у держателя нет снимка новее, снимает
+# базовый снимок сам — один запрос на подключение.
+
+import os, json, time, logging, threading
+
+import jsonlog, metrics, rate_limit, shared_state
+from private_stream import account_state
+
+ACCOUNT_CACHE_ENABLED = os.getenv("ACCOUNT_CACHE_ENABLED", "true").lower() == "true"
+ACCOUNT_REFRESH_SEC = float(os.getenv("ACCOUNT_REFRESH_SEC", "2"))
+ACCOUNT_MAX_AGE_SEC = float(os.getenv("ACCOUNT_MAX_AGE_SEC", "5"))
+# при живом стриме REST-снимок — только сверка на случай пропущенных событий
+ACCOUNT_RECONCILE_SEC = float(os.getenv("ACCOUNT_RECONCILE_SEC", "60"))
+# после своей заявки инструмент считается занятым, пока снимок/стрим её не увидят
+ACCOUNT_PENDING_SEC = float(os.getenv("ACCOUNT_PENDING_SEC", "15"))
+
+_caches = {}
+_store = shared_state.default()
+
+class AccountCache:
+    """
+    snapshot() -> {"positions": {inst: size}, "orders": {inst: {id: o}}, "algo_orders": {inst: {id: o}}}
+    или None при ошибке. Вызывается только из фонового потока.
+    """
+
+    def __init__(self, venue: str, snapshot, state=None, interval: float = None, max_age: float = None):
+        self.venue = venue
+        self.snapshot = snapshot
+        self.state = state or account_state
+        self.interval = ACCOUNT_REFRESH_SEC if interval is None else interval
+        self.max_age = ACCOUNT_MAX_AGE_SEC if max_age is None else max_age
+        self.snapshot_at = 0.0        # начало последнего удачного REST-снимка
+        self.stats = {"hits": 0, "stale": 0, "refreshes": 0, "refresh_errors": 0, "shared_loads": 0}
+        self._pending = {}            # inst -> время нашей заявки
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        _caches[venue] = self
+
+    # =============== ПУБЛИЧНОЕ API ===============
+    def stream_live(self) -> bool:
+        return bool(self.state.connected.get(self.venue))
+
+    def stream_fresh(self) -> bool:
+        """Стрим подключён и есть базовый снимок, снятый не раньше подключения."""
+        at = self.state.connected_at.get(self.venue)
+        return self.stream_live() and at is not None and self.snapshot_at >= at
+
+    def age(self) -> float:
+        """Возраст данных в секундах; 0 — стрим подключён поверх базового снимка и шлёт изменения."""
+        if self.stream_fresh():
+            return 0.0
+        if not self.snapshot_at:
+            return float("inf")
+        return time.time() - self.snapshot_at
+
+    def busy(self, inst: str):
+        """(есть позиция, есть ордера, есть алго-ордера) из памяти; None — кэш устарел, нужен живой запрос."""
+        if not ACCOUNT_CACHE_ENABLED:
+            return None
+        self.start()
+        if self.age() > self.max_age:
+            self.stats["stale"] += 1
+            return None
+        self.stats["hits"] += 1
+        with self._lock:
+            mark = self._pending.get(inst)
+            if mark is not None and (time.time() - mark > ACCOUNT_PENDING_SEC or self.snapshot_at > mark):
+                self._pending.pop(inst, None)
+                mark = None
+        return (
+            mark is not None or self.state.position_size(self.venue, inst) > 0,
+            self.state.has_orders(self.venue, inst),
+            self.state.has_algo_orders(self.venue, inst),
+        )
+
+    def mark_busy(self, inst: str):
+        """Своя заявка отправлена — до следующего снимка/события считаем инструмент занятым."""
+        with self._lock:
+            self._pending[inst] = time.time()
+        self._wakeup.set()  # быстрее подтянуть свежий снимок
+
+    def refresh(self, publish: bool = False) -> bool:
+        started = time.time()
+        try:
+            snap = self.snapshot()
+        except Exception as e:
+            snap = None
+            jsonlog.event(f"⚠️ account cache {self.venue}: snapshot failed: {e}", logging.WARNING)
+        if snap is None:
+            self.stats["refresh_errors"] += 1
+            return False
+        self.state.replace(self.venue, snap.get("positions") or {}, snap.get("orders") or {}, snap.get("algo_orders") or {})
+        self.snapshot_at = started
+        self.stats["refreshes"] += 1
+        if publish:
+            try:
+                _store.put(self._shared_key(), json.dumps({"at": started, **snap}, default=str),
+                           ttl=2 * max(self.max_age, ACCOUNT_RECONCILE_SEC))
+            except Exception as e:
+                jsonlog.event(f"⚠️ account cache {self.venue}: publish failed: {e}", logging.WARNING)
+        return True
+
+    def load_shared(self) -> bool:
+        """Снимок держателя аренды из shared_state, если он новее своего."""
+        try:
+            raw = _store.get(self._shared_key())
+            snap = json.loads(raw) if raw else None
+        except Exception as e:
+            jsonlog.event(f"⚠️ account cache {self.venue}: shared snapshot unreadable: {e}", logging.WARNING)
+            return False
+        if not snap or snap["at"] <= self.snapshot_at:
+            return False
+        self.state.replace(self.venue, snap.get("positions") or {}, snap.get("orders") or {}, snap.get("algo_orders") or {})
+        self.snapshot_at = snap["at"]
+        self.stats["shared_loads"] += 1
+        return True
+
+    def _shared_key(self) -> str:
+        return f"account_snapshot:{self.venue}"
+
+    def status(self) -> dict:
+        return {"venue": self.venue, "age_sec": round(self.age(), 3) if self.snapshot_at else None,
+                "stream": self.stream_live(), "stream_fresh": self.stream_fresh(), "max_age_sec": self.max_age, **self.stats}
+
+    # =============== ФОН ===============
+    def start(self):
+        """Один поток-обновитель на процесс (после fork gunicorn — новый)."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._pending.clear()
+        threading.Thread(target=self._loop, name=f"account-cache-{self.venue}", daemon=True).start()
+
+    def _loop(self):
+        rate_limit.mark_background()
+        lease = shared_state.Lease(_store, f"account:{self.venue}", self.interval * 3 + 1)
+        last_rest = last_shared = 0.0
+        kicked = False
+        while True:
+            now = time.time()
+            if lease.held():
+                due = ACCOUNT_RECONCILE_SEC if self.stream_fresh() else self.interval
+                if kicked or now - last_rest >= due:
+                    last_rest = now
+                    self.refresh(publish=True)
+            else:
+                if not self.stream_fresh() or now - last_shared >= ACCOUNT_RECONCILE_SEC:
+                    last_shared = now
+                    self.load_shared()
+                if self.stream_live() and not self.stream_fresh() and now - last_rest >= self.interval:
+                    last_rest = now  # у держателя нет снимка новее нашего подключения
+                    self.refresh()
+            # просыпаемся каждые interval: продлить аренду / подхватить её, если держатель умер
+            kicked = self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+def _ages() -> dict:
+    return {(v,): (c.age() if c.age() != float("inf") else -1) for v, c in _caches.items()}
+
+metrics.Gauge("account_cache_age_seconds", "Age of cached account state (-1 = never loaded)", _ages, ("venue",))
@@ -1,9 +1,16 @@
 # app.py — минимизированный сервер автотрейда (только SCALP)
 
-import os, time, json, threading, csv, hmac, hashlib, html as _html, re, math, requests, base64
-from datetime import datetime, timedelta, timezone
-from collections import deque
-from flask import Flask, request, jsonify
+import os, time, json, threading, hmac, hashlib, html as _html, re, math, base64, logging
+from datetime import datetime, timezone
+from flask import Flask, request, jsonify, g
+
+import clock_sync, idempotency, ingest, instruments, jsonlog, leverage, metrics, pretrade, rate_limit, resilience, shared_state, telegram_outbox, trade_journal, tracing
+from account_cache import AccountCache
+from log_writer import BufferedCsvWriter
+from trading_schedule import TradingSchedule
+from position_watcher import PositionWatcher
+from private_stream import BybitPrivateStream, OkxPrivateStream
+from http_clients import http_get, http_post
 
 # =============== 🔧 НАСТРОЙКИ ===============
 DEBUG = False
@@ -35,12 +42,20 @@ SCALP_ENABLED = os.getenv("SCALP_ENABLED", "true").lower() == "true"
 MAX_RISK_USDT = float(os.getenv("MAX_RISK_USDT", "1"))
 LEVERAGE = float(os.getenv("LEVERAGE", "20"))
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# attached — вход + TP/SL одним /v5/order/create; legacy — market, пауза, limit TP, stop SL
+BYBIT_EXEC_MODE = os.getenv("BYBIT_EXEC_MODE", "attached").lower()
+BYBIT_EXEC_FALLBACK = os.getenv("BYBIT_EXEC_FALLBACK", "true").lower() == "true"
+# приватные WebSocket-стримы: закрытия видны сразу, REST-опрос остаётся страховкой
+BYBIT_WS_ENABLED = os.getenv("BYBIT_WS_ENABLED", "false").lower() == "true"
+OKX_WS_ENABLED = os.getenv("OKX_WS_ENABLED", "false").lower() == "true"
 
 # OKX (для объединённого single-service деплоя)
 OKX_API_KEY = os.getenv("OKX_API_KEY", "")
 OKX_API_SECRET = os.getenv("OKX_API_SECRET", "")
 OKX_PASSPHRASE = os.getenv("OKX_PASSPHRASE", "")
 OKX_BASE_URL = os.getenv("OKX_BASE_URL", "https://www.okx.com")
+# orders-algo-pending требует ordType; conditional и oco можно перечислить через запятую
+OKX_ALGO_ORD_TYPES = "conditional,oco"
 WEBHOOK_SECRET_OKX = os.getenv("WEBHOOK_SECRET_OKX", "")
 TRADE_ENABLED_OKX = os.getenv("TRADE_ENABLED_OKX", "false").lower() == "true"
 MAX_RISK_USDT_OKX = float(os.getenv("MAX_RISK_USDT_OKX", "1"))
@@ -58,51 +73,54 @@ RR_RATIO    = 2.4     # TP = SL * 2.4
 MAX_SL_STREAK = 3
 PAUSE_MINUTES = 30
 
-loss_streak = {}
-loss_streak_reset_time = {}
-trade_global_cooldown_until = 0
-okx_trade_global_cooldown_until = 0
+GLOBAL_COOLDOWN_SEC = 180
+DUPLICATE_WINDOW_SEC = 5
+
+# кулдауны, локи инструментов, дедуп и серии SL — общие для воркеров gunicorn (STATE_BACKEND)
+STATE = shared_state.default()
 
 LOG_FILE = "/tmp/signals_log.csv"
 
 app = Flask(__name__)
+idempotency.init_app(app)
 
 def parse_days(env_value: str) -> set:
     try:
         return {int(x) for x in env_value.split(",") if x.strip().isdigit()}
     except Exception:
         return set()
-BYBIT_LONG_DAYS  = parse_days(BYBIT_LONG_DAYS_ENV)
-BYBIT_SHORT_DAYS = parse_days(BYBIT_SHORT_DAYS_ENV)
 
 def parse_symbols(env_value: str) -> set:
     return {s.strip().upper() for s in env_value.split(",") if s.strip()}
 BYBIT_LONG_SYMBOLS  = parse_symbols(os.getenv("BYBIT_LONG_SYMBOLS", ""))
 BYBIT_SHORT_SYMBOLS = parse_symbols(os.getenv("BYBIT_SHORT_SYMBOLS", ""))
 
-def parse_hours(env_value: str) -> list[tuple[int, int]]:
-    ranges = []
-    for part in env_value.split(","):
-        part = part.strip()
-        if "-" not in part:
-            continue
-        try:
-            start, end = part.split("-", 1)
-            start_h = int(start)
-            end_h = int(end)
-            if 0 <= start_h <= 24 and 0 <= end_h <= 24 and start_h != end_h:
-                ranges.append((start_h, end_h))
-        except Exception:
-            continue
-    return ranges
-
-BYBIT_LONG_HOURS  = parse_hours(BYBIT_LONG_HOURS_ENV)
-BYBIT_SHORT_HOURS = parse_hours(BYBIT_SHORT_HOURS_ENV)
+# скомпилированное расписание: (venue, direction) → таблица минут недели в TRADING_TZ
+# (env TRADING_TZ читает trading_schedule: IANA, с DST; Etc/GMT-2 = прежний UTC+2)
+TRADING_SCHEDULE = (
+    TradingSchedule()
+    .add(("bybit", "UP"), BYBIT_LONG_DAYS_ENV, BYBIT_LONG_HOURS_ENV, symbols=BYBIT_LONG_SYMBOLS)
+    .add(("bybit", "DOWN"), BYBIT_SHORT_DAYS_ENV, BYBIT_SHORT_HOURS_ENV, symbols=BYBIT_SHORT_SYMBOLS)
+    # OKX: пустой список дней = без ограничений по дням (как раньше)
+    .add(("okx", "UP"), OKX_LONG_DAYS_ENV, OKX_LONG_HOURS_ENV, empty_days_allow=True)
+    .add(("okx", "DOWN"), OKX_SHORT_DAYS_ENV, OKX_SHORT_HOURS_ENV, empty_days_allow=True)
+)
 
 # =============== 🔐 BYBIT SIGN ===============
+# время подписи — по часам биржи (clock_sync), recv_window — по измеренному джиттеру
+BYBIT_CLOCK = clock_sync.ExchangeClock(
+    "bybit", lambda: BYBIT_BASE_URL.rstrip("/") + "/v5/market/time", clock_sync.bybit_server_ms)
+BYBIT_RETCODE_TIMESTAMP = 10002  # timestamp вне recv_window
+BYBIT_RETCODES_UNKNOWN = (10000, 10016)  # таймаут / внутренняя ошибка сервера: ордер мог пройти
+
+def bybit_rejected(resp: dict) -> bool:
+    """Ордер точно не принят биржей (retCode != 0); пустой ответ или таймаут — исход неизвестен."""
+    code = resp.get("retCode")
+    return code is not None and code != 0 and code not in BYBIT_RETCODES_UNKNOWN
+
 def _bybit_sign(payload: dict, method: str = "POST", query_string: str = ""):
-    ts = str(int(time.time() * 1000))
-    recv_window = "5000"
+    ts = str(BYBIT_CLOCK.now_ms())
+    recv_window = str(BYBIT_CLOCK.recv_window_ms())
     if method.upper() == "POST":
         body = json.dumps(payload or {}, separators=(",", ":"))
         pre_sign = ts + BYBIT_API_KEY + recv_window + body
@@ -127,64 +145,59 @@ def md_escape(text: str) -> str:
 
 def send_telegram(text: str):
     if not TELEGRAM_TOKEN or not CHAT_ID:
-        print("⚠️ Telegram credentials missing.")
+        jsonlog.event("⚠️ Telegram credentials missing.", logging.WARNING)
         return
     safe_text = md_escape(text)
-    try:
-        requests.get(
-            f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage",
-            params={"chat_id": CHAT_ID, "text": safe_text, "parse_mode": "MarkdownV2"},
-            timeout=8,
-        )
-    except Exception as e:
-        print("❌ Telegram error:", e)
+    # не блокирует: отправка, склейка и лимиты — в фоне (telegram_outbox)
+    telegram_outbox.send_message(TELEGRAM_TOKEN, CHAT_ID, safe_text, parse_mode="MarkdownV2")
 
 def send_telegram_document(filepath: str, caption: str = ""):
     if not os.path.exists(filepath): return False
-    try:
-        with open(filepath, "rb") as f:
-            files = {"document": (os.path.basename(filepath), f)}
-            data = {"chat_id": CHAT_ID, "caption": caption[:1024]}
-            r = requests.post(
-                f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendDocument",
-                data=data, files=files, timeout=20)
-        print("✅ Sent CSV to Telegram" if r.status_code == 200 else f"❌ {r.text}")
-        return True
-    except Exception as e:
-        print("❌ Telegram sendDocument exception:", e)
-        return False
+    return telegram_outbox.send_document(TELEGRAM_TOKEN, CHAT_ID, filepath, caption)
 
 # =============== 📜 ЛОГИРОВАНИЕ ===============
-log_lock = threading.Lock()
-def log_signal(ticker, direction, tf, sig_type, entry=None, stop=None, target=None):
+# пишет фоновый поток пачками (log_writer); вебхук только ставит строку в очередь
+signals_log = BufferedCsvWriter(LOG_FILE, ["time_utc","ticker","direction","tf","type","entry","stop","target"])
+log_lock = signals_log.lock  # держится только на время записи пачки в файл
+metrics.Gauge("signals_log_queue_depth", "Rows waiting in the CSV log writer", signals_log.depth)
+
+def log_signal(ticker, direction, tf, sig_type, entry=None, stop=None, target=None, link=None):
     row = [datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"), ticker, direction, tf, sig_type, entry or "", stop or "", target or ""]
     try:
-        with log_lock:
-            create_header = not os.path.exists(LOG_FILE)
-            with open(LOG_FILE, "a", newline="", encoding="utf-8") as f:
-                w = csv.writer(f)
-                if create_header:
-                    w.writerow(["time_utc","ticker","direction","tf","type","entry","stop","target"])
-                w.writerow(row)
-        print(f"📝 Logged {sig_type} {ticker} {direction} {tf}")
+        signals_log.write(row)
+        if entry and stop and target:
+            # реальная сделка — в журнал (там же потом исход TP/SL)
+            trade_journal.record_trade(row[0], ticker, direction, tf, sig_type, entry, stop, target, link=link)
+        jsonlog.event("signal_logged", logging.DEBUG, type=sig_type, ticker=ticker, direction=direction, tf=tf)
     except Exception as e:
-        print("❌ Log error:", e)
+        jsonlog.event(f"❌ Log error: {e}", logging.ERROR)
 
 # =============== 💰 BYBIT ORDER HELPERS ===============
 def bybit_post(path: str, payload: dict) -> dict:
+    """Подписанный POST с политикой повторов resilience (ордер не повторяется)."""
     url = BYBIT_BASE_URL.rstrip("/") + path
-    headers, body = _bybit_sign(payload)
-    r = requests.post(url, headers=headers, data=body, timeout=10)
-    try:
-        if DEBUG:
-            print(f"\n📡 Bybit POST {path}\nPayload: {payload}\nResponse: {r.status_code} {r.text[:500]}\n", flush=True)
-        j = r.json()
-    except Exception:
-        return {"http": r.status_code, "text": r.text}
+
+    def send():
+        for attempt in (0, 1):
+            rate_limit.acquire("bybit", path)  # до подписи: ожидание не съедает recv_window
+            headers, body = _bybit_sign(payload)
+            r = http_post("bybit", url, headers=headers, data=body, limit=False)
+            try:
+                if DEBUG:
+                    jsonlog.event("bybit_post", logging.DEBUG, path=path, payload=payload, status=r.status_code, response=r.text[:500])
+                j = r.json()
+            except Exception:
+                return {"http": r.status_code, "text": r.text}
+            # запрос, отвергнутый по времени, биржа не исполняла — повтор безопасен
+            if attempt == 0 and j.get("retCode") == BYBIT_RETCODE_TIMESTAMP and BYBIT_CLOCK.resync():
+                continue
+            return j
+
+    j = resilience.call("bybit", "POST", path, send)
     if j.get("retCode", 0) != 0:
-        print("❌ Bybit error:", j)
+        jsonlog.event(f"❌ Bybit error: {j}", logging.ERROR)
     elif DEBUG:
-        print(f"✅ Bybit OK: {path}")       
+        jsonlog.event(f"✅ Bybit OK: {path}", logging.DEBUG)
     return j
 
 def _decimals_from_step(step_str: str) -> int:
@@ -195,9 +208,7 @@ def _decimals_from_step(step_str: str) -> int:
 
 def normalize_qty(symbol: str, qty: float) -> float:
     try:
-        r = requests.get(f"{BYBIT_BASE_URL}/v5/market/instruments-info", params={"category": "linear", "symbol": symbol}, timeout=5).json()
-        info = (((r or {}).get("result") or {}).get("list") or [])[0]
-        lot_info = info.get("lotSizeFilter", {}) or {}
+        lot_info = instruments.bybit_instrument(symbol)
         step_str = lot_info.get("qtyStep", "0.001")
         min_qty_str = lot_info.get("minOrderQty", step_str)
         step = float(step_str); min_qty = float(min_qty_str)
@@ -218,15 +229,16 @@ def calc_qty_from_risk(entry, stop, risk_usdt, symbol):
     raw_qty = risk_usdt / risk_per_unit
     return normalize_qty(symbol, raw_qty)
 
-def set_leverage(symbol, leverage):
+def set_leverage(symbol, leverage) -> bool:
+    """True — плечо на бирже теперь равно нужному (110043: уже было таким)."""
     try:
         payload = {"category":"linear","symbol":symbol,"buyLeverage":str(leverage),"sellLeverage":str(leverage)}
-        headers, body = _bybit_sign(payload)
-        url = BYBIT_BASE_URL.rstrip("/") + "/v5/position/set-leverage"
-        r = requests.post(url, headers=headers, data=body, timeout=5)
-        print("✅ Leverage set", r.json())
+        j = bybit_post("/v5/position/set-leverage", payload)
+        jsonlog.event(f"✅ Leverage set {j}")
+        return j.get("retCode") in (0, 110043)
     except Exception as e:
-        print("❌ Leverage set exception:", e)
+        jsonlog.event(f"❌ Leverage set exception: {e}", logging.ERROR)
+        return False
 
 # =============== 🧠 PARSE PAYLOAD ===============
 def parse_payload(req):
@@ -240,131 +252,74 @@ def parse_payload(req):
         "entry":data.get("entry"),
     }
 
-def hour_allowed(hour: int, ranges: list[tuple[int,int]]) -> bool:
-    for start, end in ranges:
-        if start < end:
-            if start <= hour < end:
-                return True
-        else:
-            # на случай диапазона через полночь, типа 22-2
-            if hour >= start or hour < end:
-                return True
-    return False
-
 def log_block(reason: str, ticker: str, direction: str, payload: dict):
-    entry = payload.get("entry")
-
-    print(
-        f"🚫 BYBIT BLOCKED | {reason} | {ticker} {direction} | entry={entry}",
-        flush=True
-    )
-
+    jsonlog.event("bybit_blocked", reason=reason, ticker=ticker, direction=direction, entry=payload.get("entry"))
     log_signal(ticker, direction, payload.get("tf"), reason)
 
 
 # =============== 🔔 ВЕБХУК: ТОЛЬКО SCALP ===============
 @app.route("/webhook", methods=["POST"])
 def webhook():
-    global trade_global_cooldown_until   # ← ЭТОТ ПАРЕНЬ ДОЛЖЕН БЫТЬ ВОТ ТУТ
-
     if WEBHOOK_SECRET and request.args.get("key", "") != WEBHOOK_SECRET:
         return "forbidden", 403
 
-    # === Расширенное логирование ===
-    try:
-        raw_body = request.get_data(as_text=True)
-        raw_json = request.get_json(silent=True)
-        print("\n================= WEBHOOK RECEIVED =================", flush=True)
-        print("RAW BODY:", raw_body, flush=True)
-        print("PARSED JSON:", raw_json, flush=True)
-        print("ARGS:", dict(request.args), flush=True)
-        print("HEADERS:", {k:v for k,v in request.headers.items()}, flush=True)
-    except Exception as e:
-        print("❌ Error reading request:", e, flush=True)
-
+    sw = metrics.Stopwatch("webhook")
     payload = parse_payload(request)
+
+    # === Логирование: полный дамп — по выборке LOG_SAMPLE или в verbose ===
+    jsonlog.log_request("webhook", request, payload)
+    sw.lap("parse")
+
+    # повторная доставка того же алерта (ретрай TradingView, рестарт) — до любой работы
+    if idempotency.claim("webhook", request.get_json(silent=True) or request.get_data(), payload["tf"]) is None:
+        return jsonify({"status": "duplicate_delivery"}), 200
+
+    # INGEST_ASYNC: 202 сразу, сделка — в пуле (по очереди на символ)
+    if ingest.INGEST_ASYNC:
+        return ingest.accept("webhook", payload["ticker"], payload, handle_webhook)
+    return handle_webhook(payload, sw)
+
+def handle_webhook(payload: dict, sw):
     typ, ticker, direction, entry = payload["type"], payload["ticker"], payload["direction"], payload["entry"]
-    print("PARSED PAYLOAD:", payload, flush=True)
 
     if typ != "SCALP" or not SCALP_ENABLED:
         log_block("NOT_SCALP", ticker, direction, payload)
         return jsonify({"status": "ignored"}), 200
 
-    # === FILTER: DAY OF WEEK + DIRECTION ===
-    now_local = datetime.now(timezone.utc) + timedelta(hours=2)
-    weekday = now_local.weekday()  # 0=Mon ... 6=Sun
-    hour = now_local.hour          # 0..23
-
-    if direction == "UP":
-        if weekday not in BYBIT_LONG_DAYS:
-            log_block("BLOCKED_DAY", ticker, direction, payload)
-            return jsonify({"status": "blocked_day"}), 200
-    
-    elif direction == "DOWN":
-        if weekday not in BYBIT_SHORT_DAYS:
-            log_block("BLOCKED_DAY", ticker, direction, payload)
-            return jsonify({"status": "blocked_day"}), 200
-
-    # === FILTER: HOURS (UTC+2) ===
-
-    if direction == "UP":
-        if not hour_allowed(hour, BYBIT_LONG_HOURS):
-            log_block("BLOCKED_HOUR", ticker, direction, payload)
-            return jsonify({"status": "blocked_hour"}), 200
-    
-    elif direction == "DOWN":
-        if not hour_allowed(hour, BYBIT_SHORT_HOURS):
-            log_block("BLOCKED_HOUR", ticker, direction, payload)
-            return jsonify({"status": "blocked_hour"}), 200
-
-    # === FILTER: SYMBOL + DIRECTION ===
-    if direction == "UP":
-        if ticker not in BYBIT_LONG_SYMBOLS:
+    # === FILTER: DAY / MINUTE-OF-WEEK / SYMBOL (TRADING_TZ), один lookup ===
+    if direction in ("UP", "DOWN"):
+        key = ("bybit", direction)
+        blocked = TRADING_SCHEDULE.check(key)
+        if blocked:
+            log_block(blocked.upper(), ticker, direction, payload)
+            return jsonify({"status": blocked}), 200
+        if not TRADING_SCHEDULE.symbol_allowed(key, ticker):
             log_block("BLOCKED_SYMBOL", ticker, direction, payload)
             return jsonify({"status": "blocked_symbol"}), 200
+    sw.lap("filters")
 
-    elif direction == "DOWN":
-        if ticker not in BYBIT_SHORT_SYMBOLS:
-            log_block("BLOCKED_SYMBOL", ticker, direction, payload)
-            return jsonify({"status": "blocked_symbol"}), 200
+    # === Площадка деградировала (circuit breaker): отказ сразу, без ожидания таймаутов ===
+    if resilience.is_open("bybit"):
+        log_block("VENUE_UNAVAILABLE", ticker, direction, payload)
+        return jsonify({"status": "venue_unavailable"}), 503
 
     # === CHECK GLOBAL 3-MIN COOLDOWN ===
-    now = time.time()
-
-    if now < trade_global_cooldown_until:
-        remaining = int(trade_global_cooldown_until - now)
-        log_block(f"GLOBAL_COOLDOWN_{remaining}s", ticker, direction, payload)
+    remaining = STATE.ttl("bybit:cooldown")
+    if remaining > 0:
+        log_block(f"GLOBAL_COOLDOWN_{int(remaining)}s", ticker, direction, payload)
         return jsonify({"status": "blocked"}), 200
 
-    # === Мгновенная защита от дублей (5 секунд) ===
-    global last_signal_lock
-    if 'last_signal_lock' not in globals():
-        last_signal_lock = {}
-
-    key = f"{ticker}_{direction}"
-    now = time.time()
-    cooldown = 5  # сек
-
-    if key in last_signal_lock and (now - last_signal_lock[key]) < cooldown:
-        print(f"🚫 {ticker} {direction}: дубликат в пределах {cooldown}с, пропускаю")
+    # === Мгновенная защита от дублей (5 секунд): ключ занимает ровно один воркер ===
+    if not STATE.claim(f"bybit:dedup:{ticker}_{direction}", DUPLICATE_WINDOW_SEC):
+        jsonlog.event(f"🚫 {ticker} {direction}: дубликат в пределах {DUPLICATE_WINDOW_SEC}с, пропускаю", logging.WARNING)
         return jsonify({"status": "duplicate_ignored"}), 200
-
-    last_signal_lock[key] = now  # регистрируем сигнал мгновенно
-
-    # === Проверка открытой позиции ===
-    try:
-        resp = requests.get(f"{BYBIT_BASE_URL}/v5/position/list", params={"category": "linear", "symbol": ticker}, timeout=5)
-        j = resp.json()
-        pos_list = ((j.get("result") or {}).get("list") or [])
-        open_size = sum(abs(float(p.get("size", 0))) for p in pos_list if p.get("symbol") == ticker)
-        if open_size > 0:
-            print(f"⏸ {ticker}: позиция уже открыта, сигнал пропущен.")
-            return jsonify({"status": "skipped_open_position"}), 200
-    except Exception as e:
-        print(f"⚠️ Ошибка проверки позиции {ticker}: {e}")
+    sw.lap("dedup")
 
     if not TRADE_ENABLED:
-        print(f"🚫 TRADE_DISABLED: {ticker}")
+        if bybit_has_position(ticker):
+            jsonlog.event(f"⏸ {ticker}: позиция уже открыта, сигнал пропущен.")
+            return jsonify({"status": "skipped_open_position"}), 200
+        jsonlog.event(f"🚫 TRADE_DISABLED: {ticker}", logging.WARNING)
         return jsonify({"status": "trade_disabled"}), 200
 
     # === Обычная логика входа (только базовые SL/TP) ===
@@ -394,49 +349,161 @@ def webhook():
             f"Entry={entry_f:.6f} Stop={stop_f:.6f} Target={target_f:.6f} "
             f"(SL={sl_pct}%, TP={tp_pct}%)"
         )
-        print(msg)
-
-        set_leverage(ticker, LEVERAGE)
+        jsonlog.event(msg)
 
+        # Проверка позиции, плечо и размер (инструмент) — параллельно; открытая позиция отменяет остальное
+        plan = pretrade.Plan("webhook")
+        plan.veto_if("position_check", "skipped_open_position", bybit_has_position, ticker)
+        plan.add("leverage", bybit_leverage.ensure, ticker, LEVERAGE)
         # Риск всё ещё считается как раньше, только по нашему фиксированному стопу
-        qty = calc_qty_from_risk(entry_f, stop_f, MAX_RISK_USDT * 0.5, ticker)
+        plan.add("sizing", calc_qty_from_risk, entry_f, stop_f, MAX_RISK_USDT * 0.5, ticker)
+        try:
+            qty = plan.run()["sizing"]
+        except pretrade.Abort as a:
+            if a.status != "skipped_open_position":
+                raise
+            jsonlog.event(f"⏸ {ticker}: позиция уже открыта, сигнал пропущен.")
+            return jsonify({"status": a.status}), 200
+        sw.lap("pretrade")
         if qty <= 0:
-            print("⚠️ Qty <= 0 — торговля пропущена")
+            jsonlog.event("⚠️ Qty <= 0 — торговля пропущена", logging.WARNING)
             return jsonify({"status": "skipped"}), 200
 
-        ok = place_order_market_with_limit_tp_sl(ticker, side, qty, target_f, stop_f)
-        if not ok:
-            print("🚫 Trade failed at MARKET stage — no Telegram")
-            return jsonify({"status": "order_failed"}), 200
+        # кулдаун занимается атомарно до ордера: параллельный сигнал из другого воркера
+        # прошёл проверку выше, но ордер отправит только один
+        if not STATE.claim("bybit:cooldown", GLOBAL_COOLDOWN_SEC):
+            log_block(f"GLOBAL_COOLDOWN_{int(STATE.ttl('bybit:cooldown'))}s", ticker, direction, payload)
+            return jsonify({"status": "blocked"}), 200
+        link = new_order_link()
+        res = place_order(ticker, side, qty, target_f, stop_f, link)
+        if not res["rejected"]:
+            bybit_account.mark_busy(ticker)  # позиция открыта или могла открыться
+        sw.lap("order")
+        if not res["ok"]:
+            STATE.release("bybit:cooldown")
+            jsonlog.event("🚫 Trade failed at MARKET stage — no Telegram", logging.WARNING)
+            return jsonify({"status": "order_failed", "exec_mode": res["mode"]}), 200
         
         send_telegram(
             f"⚡ *BYBIT TRADE*\n"
             f"{ticker} {side}\n"
             f"Entry~{entry_f}\n"
             f"TP:{target_f}\n"
-            f"SL:{stop_f}"
+            f"SL:{stop_f}\n"
+            f"Mode:{res['mode']}"
         )
-        log_signal(ticker, direction, "1m", "SCALP", entry_f, stop_f, target_f)
+        sw.lap("telegram")
+        log_signal(ticker, direction, "1m", "SCALP", entry_f, stop_f, target_f, link=link)
+        sw.lap("log")
 
 
-        # === ACTIVATE GLOBAL COOLDOWN ===
-        trade_global_cooldown_until = time.time() + 180  # 3 minutes
-        print(f"🕒 GLOBAL COOLDOWN ACTIVATED for 180s due to {ticker} {direction}")
+        jsonlog.event(f"🕒 GLOBAL COOLDOWN ACTIVATED for {GLOBAL_COOLDOWN_SEC}s due to {ticker} {direction}")
 
-        return jsonify({"status": "ok"}), 200
+        return jsonify({"status": "ok", "exec_mode": res["mode"]}), 200
         
+    except resilience.CircuitOpen as e:
+        jsonlog.event(f"⛔ Trade skipped (SCALP): {e}", logging.WARNING)
+        return jsonify({"status": "venue_unavailable"}), 503
     except Exception as e:
-        print("❌ Trade error (SCALP):", e)
+        jsonlog.event(f"❌ Trade error (SCALP): {e}", logging.ERROR)
 
     # === FALLBACK (ОБЯЗАТЕЛЬНО) ===
     log_block("NO_ACTION", ticker, direction, payload)
     return jsonify({"status": "no_action"}), 200
 
-# (остальная часть твоего кода — place_order_market_with_limit_tp_sl, monitor_and_cleanup, monitor_closed_trades, heartbeat_loop, backup_log_worker, main, health — остаётся без изменений)
+# orderLinkId входа: по нему исполнения входа находятся в ленте /v5/execution/list
+# (см. resolve_bybit_outcomes). Ноги TP/SL старой схемы — тот же id с -tp / -sl.
+ORDER_LINK_PREFIX = "tv-"
+
+def new_order_link() -> str:
+    """≤ 36 символов [A-Za-z0-9-], уникален и между воркерами."""
+    return f"{ORDER_LINK_PREFIX}{int(time.time() * 1000):x}-{os.urandom(3).hex()}"
+
+def place_order(symbol, side, qty, tp_price, sl_price, link: str = "") -> dict:
+    """
+    Вход по режиму BYBIT_EXEC_MODE. Возвращает {"ok": bool, "mode": "attached" | "legacy",
+    "rejected": bool} — rejected: биржа точно отклонила вход, позиция не открыта.
+    Если attached-ордер отклонён и BYBIT_EXEC_FALLBACK включён — повторяем старой
+    схемой (ордер не создан — link свободен). При неизвестном исходе повтора нет.
+    """
+    if BYBIT_EXEC_MODE == "legacy":
+        return _place_legacy(symbol, side, qty, tp_price, sl_price, link)
+
+    resp = place_order_market_with_attached_tp_sl(symbol, side, qty, tp_price, sl_price, link)
+    if resp.get("retCode") == 0:
+        return {"ok": True, "mode": "attached", "rejected": False}
+    if bybit_rejected(resp) and BYBIT_EXEC_FALLBACK:
+        jsonlog.event(f"↩️ {symbol}: attached TP/SL rejected ({resp.get('retMsg')}), fallback → legacy")
+        return _place_legacy(symbol, side, qty, tp_price, sl_price, link)
+    return {"ok": False, "mode": "attached", "rejected": bybit_rejected(resp)}
+
+def _place_legacy(symbol, side, qty, tp_price, sl_price, link: str) -> dict:
+    ok = place_order_market_with_limit_tp_sl(symbol, side, qty, tp_price, sl_price, link)
+    return {"ok": ok is True, "mode": "legacy", "rejected": ok is False}
+
+def place_order_market_with_attached_tp_sl(symbol, side, qty, tp_price, sl_price, link: str = "") -> dict:
+    """
+    Market IOC вход с TP/SL в том же запросе: позиция защищена сразу после исполнения.
+    tpslMode=Partial сохраняет старую семантику — TP лимиткой по цене TP, SL стоп-маркетом.
+    """
+    try:
+        jsonlog.event(f"🚀 NEW TRADE {symbol} {side} qty={qty} (attached TP/SL)")
+        payload = {
+            "category": "linear",
+            "symbol": symbol,
+            "side": side,
+            "orderType": "Market",
+            "qty": str(qty),
+            "timeInForce": "IOC",
+            "tpslMode": "Partial",
+            "takeProfit": str(tp_price),
+            "tpTriggerBy": "LastPrice",
+            "tpOrderType": "Limit",
+            "tpLimitPrice": str(tp_price),
+            "stopLoss": str(sl_price),
+            "slTriggerBy": "LastPrice",
+            "slOrderType": "Market",
+        }
+        if link:
+            payload["orderLinkId"] = link
+        placed_ms = BYBIT_CLOCK.now_ms()
+        resp = bybit_post("/v5/order/create", payload)
+        if resp.get("retCode") != 0:
+            jsonlog.event(f"❌ ATTACHED ENTRY FAILED: {resp}", logging.ERROR)
+            return resp
+
+        monitor_and_cleanup(symbol)
+        if link:
+            record_attached_exits(symbol, link, placed_ms)
+        return resp
 
-def place_order_market_with_limit_tp_sl(symbol, side, qty, tp_price, sl_price):
+    except Exception as e:
+        jsonlog.event(f"💀 place_order_market_with_attached_tp_sl error: {e}", logging.ERROR)
+        return {}
+
+def record_attached_exits(symbol: str, link: str, placed_ms: int):
+    """
+    orderId attached TP/SL → сделка link (своего orderLinkId у них нет): без этого
+    выход по ним в ленте исполнений не привязать к сделке (см. resolve_bybit_outcomes).
+    """
     try:
-        print(f"\n🚀 NEW TRADE {symbol} {side} qty={qty}")
+        j = bybit_get("/v5/order/realtime", f"category=linear&symbol={symbol}&orderFilter=StopOrder")
+        orders = {
+            o["orderId"]: _ATTACHED_EXITS[o.get("stopOrderType")]
+            for o in (j.get("result") or {}).get("list") or []
+            if o.get("stopOrderType") in _ATTACHED_EXITS and int(o.get("createdTime") or 0) >= placed_ms - 1000
+        }
+        if orders:
+            trade_journal.add_exit_orders(link, orders)
+        else:
+            jsonlog.event(f"⚠️ {symbol}: attached TP/SL не найдены — исход сделки {link} будет unresolved", logging.WARNING)
+    except Exception as e:
+        jsonlog.event(f"⚠️ {symbol}: attached TP/SL не записаны: {e}", logging.WARNING)
+
+def place_order_market_with_limit_tp_sl(symbol, side, qty, tp_price, sl_price, link: str = ""):
+    """True — вход и ноги отправлены; False — биржа отклонила вход; None — исход неизвестен."""
+    try:
+        jsonlog.event(f"🚀 NEW TRADE {symbol} {side} qty={qty}")
 
         # === 1. MARKET ENTRY ===
         entry_payload = {
@@ -447,10 +514,12 @@ def place_order_market_with_limit_tp_sl(symbol, side, qty, tp_price, sl_price):
             "qty": str(qty),
             "timeInForce": "IOC"
         }
+        if link:
+            entry_payload["orderLinkId"] = link
         entry_resp = bybit_post("/v5/order/create", entry_payload)
         if entry_resp.get("retCode") != 0:
-            print("❌ MARKET ENTRY FAILED:", entry_resp)
-            return False
+            jsonlog.event(f"❌ MARKET ENTRY FAILED: {entry_resp}", logging.ERROR)
+            return False if bybit_rejected(entry_resp) else None
         
         time.sleep(1.2)
 
@@ -469,13 +538,15 @@ def place_order_market_with_limit_tp_sl(symbol, side, qty, tp_price, sl_price):
             "timeInForce": "PostOnly",
             "reduceOnly": True
         }
+        if link:
+            tp_payload["orderLinkId"] = f"{link}-tp"
         tp_resp = bybit_post("/v5/order/create", tp_payload)
 
         # === 3. Актуальная рыночная цена для проверки SL ===
-        ticker_info = requests.get(
+        ticker_info = http_get(
+            "bybit",
             f"{BYBIT_BASE_URL}/v5/market/tickers",
             params={"category": "linear", "symbol": symbol},
-            timeout=5
         ).json()
 
         last_price = float(ticker_info["result"]["list"][0]["lastPrice"])
@@ -506,178 +577,349 @@ def place_order_market_with_limit_tp_sl(symbol, side, qty, tp_price, sl_price):
             "reduceOnly": True,
             "closeOnTrigger": True
         }
+        if link:
+            sl_payload["orderLinkId"] = f"{link}-sl"
         sl_resp = bybit_post("/v5/order/create", sl_payload)
 
-        threading.Thread(target=monitor_and_cleanup, args=(symbol,), daemon=True).start()
+        monitor_and_cleanup(symbol)
         return True
         
     except Exception as e:
-        print("💀 place_order_market_with_limit_tp_sl error:", e)
-        return False
+        jsonlog.event(f"💀 place_order_market_with_limit_tp_sl error: {e}", logging.ERROR)
+        return None  # вход мог уже исполниться
 
 # =============== 🧹 ЧИСТКА СТОПОВ ПОСЛЕ ЗАКРЫТИЯ ===============
 def _min_qty(symbol: str) -> float:
     try:
-        r = requests.get(
-            f"{BYBIT_BASE_URL}/v5/market/instruments-info",
-            params={"category": "linear", "symbol": symbol},
-            timeout=5
-        ).json()
-        info = (((r.get("result") or {}).get("list") or []))[0]
-        min_qty = float((info.get("lotSizeFilter") or {}).get("minOrderQty", "0.001"))
-        return min_qty
+        return float(instruments.bybit_instrument(symbol).get("minOrderQty", "0.001"))
     except Exception:
         return 0.001
 
-def cancel_all_orders(symbol: str, retries: int = 3):
-    """Чистит и активные, и условные ордера. Делает несколько попыток."""
-    for attempt in range(retries):
+def cancel_all_orders(symbol: str):
+    """Чистит и активные (Limit/Market), и условные (триггерные SL/TP) ордера.
+    Повторы с джиттером и дедлайном — в bybit_post по политике cancel-all."""
+    ok = True
+    for order_filter in ("Order", "StopOrder"):
         try:
-            # активные (Limit/Market)
-            bybit_post("/v5/order/cancel-all", {"category": "linear", "symbol": symbol, "orderFilter": "Order"})
-            # условные (триггерные SL/TP)
-            bybit_post("/v5/order/cancel-all", {"category": "linear", "symbol": symbol, "orderFilter": "StopOrder"})
-            print(f"🧹 {symbol}: cancel-all done (try {attempt+1}/{retries})")
-            return
+            j = bybit_post("/v5/order/cancel-all", {"category": "linear", "symbol": symbol, "orderFilter": order_filter})
+            ok = ok and j.get("retCode") == 0
         except Exception as e:
-            print(f"⚠️ {symbol}: cancel-all failed on try {attempt+1}: {e}")
-            time.sleep(1.2)
-
-def monitor_and_cleanup(symbol: str, check_every: float = 3.0, max_checks: int = 5000):
-    """Проверяет размер позиции; как только он ~0 — удаляет все ордера окончательно."""
-    time.sleep(8)  # ждём перед первой проверкой, чтобы Bybit обновил позицию
-    tiny = _min_qty(symbol) * 0.6
-    no_position_count = 0
-
-    for i in range(max_checks):
-        try:
-            time.sleep(check_every)
-
-            # Авторизованный запрос позиций
-            path = "/v5/position/list"
-            query = f"category=linear&symbol={symbol}"
+            ok = False
+            jsonlog.event(f"⚠️ {symbol}: cancel-all {order_filter} failed: {e}", logging.WARNING)
+    jsonlog.event(f"🧹 {symbol}: cancel-all {'done' if ok else 'incomplete'}")
+
+def bybit_get(path: str, query: str) -> dict:
+    """Подписанный GET; query — готовая строка (подписывается ровно она). {} на пустой ответ."""
+    def send():
+        for attempt in (0, 1):
+            rate_limit.acquire("bybit", path)
             headers, _ = _bybit_sign({}, method="GET", query_string=query)
-            resp = requests.get(f"{BYBIT_BASE_URL}{path}?{query}", headers=headers, timeout=5)
-            if not resp.text:
-                print(f"⚠️ monitor_and_cleanup {symbol}: пустой ответ от API")
+            resp = http_get("bybit", f"{BYBIT_BASE_URL}{path}?{query}", headers=headers, limit=False)
+            try:
+                j = resp.json() if resp.text else {}
+            except ValueError:
+                return {"http": resp.status_code, "text": resp.text[:400]}
+            if attempt == 0 and j.get("retCode") == BYBIT_RETCODE_TIMESTAMP and BYBIT_CLOCK.resync():
                 continue
-            r = resp.json()
-
-            pos_list = ((r.get("result") or {}).get("list") or [])
-            size = sum(abs(float(p.get("size", 0))) for p in pos_list if p.get("symbol") == symbol)
-
-            # если позиции нет, увеличиваем счётчик
-            if size <= tiny:
-                no_position_count += 1
-                print(f"🔍 {symbol}: позиция нулевая ({size}), попытка чистки {no_position_count}/3")
-                cancel_all_orders(symbol)
-                if no_position_count >= 3:
-                    print(f"✅ {symbol}: все ордера гарантированно очищены")
-                    cancel_all_orders(symbol)  # финальная зачистка после выхода
-                    return
-
-                time.sleep(1.5)
-            else:
-                no_position_count = 0  # сброс если снова есть объём
+            return j
 
-        except Exception as e:
-            print(f"⚠️ monitor_and_cleanup {symbol}: {e}")
+    return resilience.call("bybit", "GET", path, send)
+
+def bybit_position_size(symbol: str) -> float:
+    r = bybit_get("/v5/position/list", f"category=linear&symbol={symbol}")
+    pos_list = [p for p in ((r.get("result") or {}).get("list") or []) if p.get("symbol") == symbol]
+    for p in pos_list:
+        bybit_leverage.observe(symbol, p.get("leverage"))
+    return sum(abs(float(p.get("size", 0) or 0)) for p in pos_list)
 
-    print(f"⏳ {symbol}: cleanup timed out (возможно, позиция не закрыта)")
+def bybit_has_position(symbol: str) -> bool:
+    """Из кэша аккаунта, если он свежий, иначе живой подписанный запрос. Ошибка проверки сделку не блокирует."""
+    try:
+        cached = bybit_account.busy(symbol)
+        return cached[0] if cached is not None else bybit_position_size(symbol) > 0
+    except Exception as e:
+        jsonlog.event(f"⚠️ Ошибка проверки позиции {symbol}: {e}", logging.WARNING)
+        return False
+
+def fetch_linear_positions():
+    """Все linear USDT-позиции аккаунта одним подписанным запросом (с пагинацией). {symbol: size} или None."""
+    sizes = {}
+    cursor = ""
+    for _ in range(20):
+        query = "category=linear&settleCoin=USDT&limit=200" + (f"&cursor={cursor}" if cursor else "")
+        r = bybit_get("/v5/position/list", query)
+        if not r:
+            jsonlog.event("⚠️ fetch_linear_positions: пустой ответ от API", logging.WARNING)
+            return None
+        if r.get("retCode", 0) != 0:
+            jsonlog.event(f"⚠️ fetch_linear_positions: {r.get('retMsg')}", logging.WARNING)
+            return None
+        result = r.get("result") or {}
+        for p in result.get("list") or []:
+            sym = p.get("symbol")
+            if sym:
+                sizes[sym] = sizes.get(sym, 0.0) + abs(float(p.get("size", 0) or 0))
+                bybit_leverage.observe(sym, p.get("leverage"))
+        cursor = result.get("nextPageCursor") or ""
+        if not cursor:
+            break
+    return sizes
+
+def fetch_linear_open_orders():
+    """Активные и условные (TP/SL) ордера по всем linear USDT-символам: (orders, algo_orders) или None."""
+    orders, algo = {}, {}
+    cursor = ""
+    for _ in range(20):
+        query = "category=linear&settleCoin=USDT&limit=50" + (f"&cursor={cursor}" if cursor else "")
+        r = bybit_get("/v5/order/realtime", query)
+        if r.get("retCode", -1) != 0:
+            jsonlog.event(f"⚠️ fetch_linear_open_orders: {r.get('retMsg')}", logging.WARNING)
+            return None
+        result = r.get("result") or {}
+        for o in result.get("list") or []:
+            book = algo if o.get("stopOrderType") else orders
+            book.setdefault(o.get("symbol", ""), {})[o.get("orderId", "")] = o
+        cursor = result.get("nextPageCursor") or ""
+        if not cursor:
+            break
+    return orders, algo
+
+def bybit_account_snapshot():
+    positions = fetch_linear_positions()
+    open_orders = fetch_linear_open_orders() if positions is not None else None
+    if open_orders is None:
+        return None
+    return {"positions": positions, "orders": open_orders[0], "algo_orders": open_orders[1]}
+
+def fetch_bybit_leverage(symbols) -> dict:
+    """Текущее плечо по символам (позиция по символу отдаётся и при нулевом размере)."""
+    out = {}
+    for sym in symbols:
+        r = bybit_get("/v5/position/list", f"category=linear&symbol={sym}")
+        for p in ((r.get("result") or {}).get("list") or []):
+            if p.get("symbol") == sym and p.get("leverage"):
+                out[sym] = (p["leverage"], None)
+    return out
+
+# плечо не меняется на лету: set-leverage только для нового символа или расхождения
+bybit_leverage = leverage.LeverageBook("bybit", set_leverage, fetch_bybit_leverage,
+                                       BYBIT_LONG_SYMBOLS | BYBIT_SHORT_SYMBOLS)
+
+# позиции/ордера в памяти: стрим (BYBIT_WS_ENABLED) или REST-снимок раз в ACCOUNT_REFRESH_SEC
+bybit_account = AccountCache("bybit", bybit_account_snapshot)
+
+# один поток на все символы: раз в 3 с — один запрос по всем позициям
+position_watcher = PositionWatcher(fetch_linear_positions, interval=3.0, grace=8.0, flat_confirmations=3)
+metrics.Gauge("position_watcher_symbols", "Symbols watched for post-close cleanup", lambda: len(position_watcher.watched()))
+
+def _cleanup_on_flat(symbol: str, final: bool):
+    cancel_all_orders(symbol)
+    if final:
+        jsonlog.event(f"✅ {symbol}: все ордера гарантированно очищены")
+
+def monitor_and_cleanup(symbol: str):
+    """Ставит символ на наблюдение; как только позиция ~0 (3 тика подряд) — удаляет все ордера."""
+    position_watcher.watch(symbol, _cleanup_on_flat, tiny=_min_qty(symbol) * 0.6)
+
+# =============== 🔌 PRIVATE STREAMS ===============
+closed_trades_wakeup = threading.Event()
+
+def _on_bybit_stream_event(event: dict):
+    if event["type"] != "position":
+        return
+    symbol = event["inst"]
+    size = float(event["data"].get("size") or 0)
+    position_watcher.on_position(symbol, size)
+    if size == 0:
+        # будим учёт закрытых сделок, не дожидаясь минутного цикла
+        closed_trades_wakeup.set()
+
+def start_private_streams():
+    if BYBIT_WS_ENABLED and BYBIT_API_KEY:
+        stream = BybitPrivateStream(BYBIT_API_KEY, BYBIT_API_SECRET)
+        stream.subscribe(_on_bybit_stream_event)
+        stream.start()
+    if OKX_WS_ENABLED and OKX_API_KEY:
+        OkxPrivateStream(OKX_API_KEY, OKX_API_SECRET, OKX_PASSPHRASE).start()
 
 # =============== 🔍 MONITOR CLOSED TRADES (тихий, без Telegram) ===============
+# Исход сделки — из ленты исполнений Bybit (/v5/execution/list) сразу по всем
+# символам, от курсора в trade_journal.meta: за цикл столько страниц по 100, сколько
+# пришло новых исполнений (обычно одна). Стоимость растёт с числом закрытий, а не с
+# историей и не с числом открытых сделок. Исполнение входа находится по orderLinkId
+# (new_order_link); выход (closedSize > 0) — тоже только по ордеру: ноги старой схемы
+# <link>-tp / <link>-sl, attached TP/SL — по orderId, записанному при входе
+# (trade_journal.exit_orders). Выход, не привязанный к нашей сделке (ручное закрытие,
+# ликвидация), цен и pnl никому не приписывает: открытые сделки символа без
+# orderLinkId помечаются unresolved; более ранние открытые сделки — так же, когда
+# закрывается следующая (позиция на символе одна).
+# Сделка закрыта, когда закрыт весь объём входа; pnl — по средним ценам исполнений
+# минус комиссии входа и выхода (funding не учитывается).
+EXEC_CURSOR_KEY = "bybit_exec_cursor"
+EXEC_OVERLAP_MS = 5000                  # поздно опубликованное исполнение не теряется; дубли — по execId
+EXEC_WINDOW_MS = 7 * 86400 * 1000 - 60000  # Bybit: startTime..endTime не длиннее 7 дней
+EXEC_MAX_PAGES = 50
+_EXEC_SKIP_TYPES = ("Funding", "Settle")
+_ATTACHED_EXITS = {"PartialTakeProfit": "TP", "PartialStopLoss": "SL"}
+
+def fetch_bybit_executions(start_ms: int, end_ms: int) -> list:
+    """Исполнения linear по всем символам за [start_ms, end_ms], по возрастанию времени."""
+    rows, cursor = [], ""
+    for _ in range(EXEC_MAX_PAGES):
+        q = f"category=linear&limit=100&startTime={start_ms}&endTime={end_ms}" + (f"&cursor={cursor}" if cursor else "")
+        j = bybit_get("/v5/execution/list", q)
+        if j.get("retCode") != 0:
+            raise RuntimeError(f"execution/list: {j}")
+        res = j.get("result") or {}
+        rows.extend(res.get("list") or [])
+        cursor = res.get("nextPageCursor") or ""
+        if not cursor:
+            break
+    else:
+        jsonlog.event(f"⚠️ execution/list: больше {EXEC_MAX_PAGES} страниц за окно, старейшие исполнения не учтены", logging.WARNING)
+    return sorted(rows, key=lambda e: int(e.get("execTime") or 0))
+
+def _exit_order(f: dict):
+    """Исполнение выхода → (orderLinkId входа, "TP" | "SL"), либо None — выход не нашей сделки."""
+    link = f["order_link_id"]
+    if link.startswith(ORDER_LINK_PREFIX) and link[-3:] in ("-tp", "-sl"):
+        return link[:-3], link[-2:].upper()
+    return trade_journal.exit_order(f["order_id"]) if f["order_id"] else None
+
+def _add_entry(t: dict, fills: list) -> dict:
+    """Исполнения входа → qty, средняя цена входа, комиссия."""
+    if not fills:
+        return t
+    qty, px, fee = t["qty"] or 0.0, t["fill_price"] or 0.0, t["open_fee"] or 0.0
+    for f in fills:
+        trade_journal.link_fill(f["exec_id"], t["id"])
+        px = (px * qty + f["price"] * f["qty"]) / (qty + f["qty"])
+        qty += f["qty"]
+        fee += f["fee"] or 0.0
+    fields = {"qty": qty, "fill_price": px, "open_fee": fee}
+    trade_journal.update_trade(t["id"], **fields)
+    return {**t, **fields}
+
+def _apply_execution(f: dict):
+    """Новое исполнение → сделка журнала. -> сделка, если это исполнение её закрыло."""
+    link = f["order_link_id"] or ""
+    if not f["closed_size"]:
+        t = trade_journal.open_trade_by_link(link) if link.startswith(ORDER_LINK_PREFIX) else None
+        if t:
+            _add_entry(t, [f])
+        return None  # иначе вход не наш или строка сделки ещё не записана (подберётся при выходе)
+    direction = "UP" if f["side"] == "Sell" else "DOWN"
+    exit_order = _exit_order(f)
+    t = trade_journal.open_trade_by_link(exit_order[0]) if exit_order else None
+    if t is None:
+        if exit_order is None:
+            trade_journal.mark_unresolved(f["symbol"], direction, f["exec_time"])
+        return None
+    if t["link"] and not t["qty"]:
+        t = _add_entry(t, trade_journal.unlinked_fills(t["link"]))
+    trade_journal.link_fill(f["exec_id"], t["id"])
+    done = t["exit_qty"] or 0.0
+    closed = min(f["closed_size"], t["qty"] - done) if t["qty"] else f["closed_size"]
+    fields = {
+        "exit_qty": done + closed,
+        "exit_price": ((t["exit_price"] or 0.0) * done + f["price"] * closed) / (done + closed),
+        "close_fee": (t["close_fee"] or 0.0) + (f["fee"] or 0.0),
+    }
+    if t["qty"] and fields["exit_qty"] < t["qty"] - 1e-12:
+        trade_journal.update_trade(t["id"], **fields)  # частичный выход
+        return None
+    sign = 1 if direction == "UP" else -1
+    entry = t["fill_price"] or t["entry"]  # вход не попал в окно ленты — по цене сигнала
+    fields["pnl"] = round(sign * (fields["exit_price"] - entry) * fields["exit_qty"]
+                          - (t["open_fee"] or 0.0) - fields["close_fee"], 8)
+    fields["result"] = exit_order[1]
+    fields["closed_ms"] = f["exec_time"]
+    trade_journal.update_trade(t["id"], **fields)
+    trade_journal.mark_unresolved(f["symbol"], direction, f["exec_time"], before_id=t["id"])
+    return {**t, **fields}
+
+def resolve_bybit_outcomes() -> list:
+    """Один проход по новым исполнениям от курсора. -> закрытые за проход сделки."""
+    now = int(time.time() * 1000)
+    cursor = int(trade_journal.get_meta(EXEC_CURSOR_KEY) or 0) or now - EXEC_WINDOW_MS + EXEC_OVERLAP_MS
+    start = cursor - EXEC_OVERLAP_MS
+    end = min(now, start + EXEC_WINDOW_MS)  # после долгого простоя догоняем окнами по 7 дней
+    closed = []
+    for e in fetch_bybit_executions(start, end):
+        if e.get("execType") in _EXEC_SKIP_TYPES:
+            continue
+        f = {
+            "exec_id": e["execId"], "symbol": e["symbol"], "side": e["side"], "order_id": e.get("orderId"),
+            "order_link_id": e.get("orderLinkId") or "", "price": float(e["execPrice"]),
+            "qty": float(e["execQty"]), "fee": float(e.get("execFee") or 0),
+            "closed_size": float(e.get("closedSize") or 0), "exec_time": int(e["execTime"]),
+        }
+        if not trade_journal.add_fill(**f):
+            continue  # уже учтено в прошлом проходе (перекрытие окон)
+        t = _apply_execution(f)
+        if t is not None:
+            closed.append(t)
+    trade_journal.set_meta(EXEC_CURSOR_KEY, end)
+    return closed
+
+def _on_trade_closed(t: dict):
+    ticker, result = t["ticker"], t["result"]
+    if result == "SL":
+        streak = STATE.incr(f"loss_streak:{ticker}")
+    else:
+        streak = 0
+        STATE.put(f"loss_streak:{ticker}", 0)
+    STATE.put(f"loss_streak_reset:{ticker}", time.time())
+    jsonlog.event(f"📊 {ticker}: closed as {result} @ {t['exit_price']:g}, pnl={t['pnl']:+.4f} "
+                  f"(fees {(t['open_fee'] or 0) + t['close_fee']:.4f}), SL streak={int(streak)}",
+                  symbol=ticker, result=result, pnl=t["pnl"], link=t["link"])
+    cancel_all_orders(ticker)
+
 def monitor_closed_trades():
-    print("⚙️ Silent trade monitor started")
-    checked = set()
+    jsonlog.event("⚙️ Silent trade monitor started")
+    rate_limit.mark_background()
+    imported = False
     while True:
         try:
-            time.sleep(60)
-            if not os.path.exists(LOG_FILE): continue
-            with log_lock:
-                with open(LOG_FILE, "r", encoding="utf-8") as f:
-                    rows = list(csv.reader(f))
-            if not rows or len(rows) < 2: continue
-            if "time_utc" in rows[0][0].lower(): rows = rows[1:]
-            open_trades = []
-            for r in rows:
-                if len(r) < 8: continue
-                if len(r) >= 9 and r[8] in ("TP","SL"): continue
-                try:
-                    open_trades.append((r[1], r[2], float(r[5]), float(r[6]), float(r[7])))
-                except: continue
-            for ticker, direction, entry, stop, target in open_trades:
-                key=f"{ticker}_{direction}_{entry}"
-                if key in checked: continue
-                checked.add(key)
-                resp = requests.get(f"{BYBIT_BASE_URL}/v5/position/list", params={"category":"linear","symbol":ticker}, timeout=5)
-                if not resp.text:
-                    print(f"⚠️ monitor_closed_trades: пустой ответ по {ticker}, пропускаю итерацию")
-                    continue
-                pos = resp.json()
-                pos_list = ((pos.get("result") or {}).get("list") or [])
-                size = sum(abs(float(p.get("size",0))) for p in pos_list if p.get("symbol")==ticker)
-                if size>0: continue
-                hist=requests.get(f"{BYBIT_BASE_URL}/v5/order/history",params={"category":"linear","symbol":ticker,"limit":10},timeout=5).json()
-                orders=((hist.get("result")or{}).get("list")or[])
-                result=None
-                for o in orders:
-                    if o.get("orderStatus")!="Filled": continue
-                    if o.get("reduceOnly") and o.get("orderType")=="Limit": result="TP"; break
-                    if o.get("closeOnTrigger") and o.get("orderType")=="Market": result="SL"; break
-                    if direction=="UP" and o.get("side")=="Sell": result="TP" if "Limit" in o.get("orderType","") else "SL"; break
-                    if direction=="DOWN" and o.get("side")=="Buy": result="TP" if "Limit" in o.get("orderType","") else "SL"; break
-                if not result: continue
-                with log_lock:
-                    updated=[]
-                    with open(LOG_FILE,"r",encoding="utf-8") as f: updated=list(csv.reader(f))
-                    for row in updated:
-                        if len(row)<8: continue
-                        if row[1]==ticker and row[2]==direction and row[5]==str(entry):
-                            if len(row)<9: row.append(result)
-                            else: row[8]=result
-                            break
-                    with open(LOG_FILE,"w",newline="",encoding="utf-8") as f:
-                        w=csv.writer(f); [w.writerow(r) for r in updated]
-                now=time.time()
-                if result=="SL":
-                    loss_streak[ticker]=loss_streak.get(ticker,0)+1
-                    loss_streak_reset_time[ticker]=now
-                elif result=="TP":
-                    loss_streak[ticker]=0
-                    loss_streak_reset_time[ticker]=now
-                print(f"📊 {ticker}: closed as {result}, SL streak={loss_streak.get(ticker,0)}")
-                cancel_all_orders(ticker)
+            # ленту исполнений (и импорт старого CSV) разбирает один воркер на хост
+            if MONITOR_LEASE.held():
+                if not imported:
+                    imported = True
+                    try:
+                        trade_journal.import_csv(LOG_FILE)  # один раз: история из старого CSV
+                    except Exception as e:
+                        jsonlog.event(f"⚠️ trade journal CSV import failed: {e}", logging.WARNING)
+                for t in resolve_bybit_outcomes():
+                    _on_trade_closed(t)
+            closed_trades_wakeup.wait(60)  # стрим будит сразу при закрытии позиции
+            closed_trades_wakeup.clear()
         except Exception as e:
-            print("💀 monitor_closed_trades crashed:", e)
+            jsonlog.event(f"💀 monitor_closed_trades crashed: {e}", logging.ERROR)
             time.sleep(15)
 
 
 # =============== OKX HELPERS ===============
-instrument_locks = {}
-instrument_locks_lock = threading.Lock()
-_okx_inst_cache = {}
 _okx_pos_mode = None
 
-OKX_LONG_DAYS_SET = parse_days(OKX_LONG_DAYS_ENV)
-OKX_SHORT_DAYS_SET = parse_days(OKX_SHORT_DAYS_ENV)
-OKX_LONG_HOUR_RANGES = parse_hours(OKX_LONG_HOURS_ENV)
-OKX_SHORT_HOUR_RANGES = parse_hours(OKX_SHORT_HOURS_ENV)
-
 def acquire_instrument_lock(inst_id: str, ttl: int = 30) -> bool:
-    now = time.time()
-    with instrument_locks_lock:
-        ts = instrument_locks.get(inst_id, 0)
-        if now < ts:
-            return False
-        instrument_locks[inst_id] = now + ttl
-        return True
+    return STATE.claim(f"okx:lock:{inst_id}", ttl)
 
 def release_instrument_lock(inst_id: str):
-    with instrument_locks_lock:
-        instrument_locks.pop(inst_id, None)
+    STATE.release(f"okx:lock:{inst_id}")
+
+# время подписи — по часам биржи (clock_sync); 50102 — OK-ACCESS-TIMESTAMP вне окна 30 с
+OKX_CLOCK = clock_sync.ExchangeClock(
+    "okx", lambda: OKX_BASE_URL.rstrip("/") + "/api/v5/public/time", clock_sync.okx_server_ms)
+OKX_CODE_TIMESTAMP = "50102"
+OKX_CODES_UNKNOWN = ("50004",)  # таймаут эндпоинта: ордер мог пройти
+
+def okx_rejected(resp: dict) -> bool:
+    """Ордер точно не принят (в т.ч. не отправлен из-за размера); пустой ответ — исход неизвестен."""
+    code = str(resp.get("code", ""))
+    return resp.get("error") == "bad_size" or (code not in ("", "0") and code not in OKX_CODES_UNKNOWN)
 
 def _okx_timestamp() -> str:
-    now = datetime.now(timezone.utc)
+    now = datetime.fromtimestamp(OKX_CLOCK.now_ms() / 1000, timezone.utc)
     return now.isoformat(timespec="milliseconds").replace("+00:00", "Z")
 
 def _okx_sign(method: str, path: str, body: str = ""):
@@ -694,35 +936,59 @@ def _okx_sign(method: str, path: str, body: str = ""):
         "Content-Type": "application/json",
     }
 
-def okx_private_get(path: str, params: dict = None, timeout: int = 10):
+def okx_private_get(path: str, params: dict = None, timeout=None):
     qs = ""
     if params:
         parts = [f"{k}={v}" for k, v in params.items()]
         qs = "?" + "&".join(parts)
-    headers = _okx_sign("GET", path, "")
     url = OKX_BASE_URL.rstrip("/") + path + qs
-    r = requests.get(url, headers=headers, timeout=timeout)
-    if DEBUG:
-        print("GET", url, r.status_code, r.text[:400])
-    return r.json()
 
-def okx_private_post(path: str, payload: dict, timeout: int = 10):
+    def send():
+        for attempt in (0, 1):
+            rate_limit.acquire("okx", path)  # до подписи: ожидание не старит OK-ACCESS-TIMESTAMP
+            headers = _okx_sign("GET", path + qs, "")  # OKX подписывает путь вместе с querystring
+            r = http_get("okx", url, headers=headers, timeout=timeout, limit=False)
+            if DEBUG:
+                jsonlog.event("okx_get", logging.DEBUG, url=url, status=r.status_code, response=r.text[:400])
+            try:
+                j = r.json()
+            except ValueError:
+                # HTML от балансировщика / пустое тело при 5xx — не падаем, отдаём как ошибку
+                jsonlog.event(f"❌ OKX raw response (not JSON): {r.status_code} {r.text[:400]}", logging.ERROR)
+                return {"http": r.status_code, "text": r.text[:400]}
+            if attempt == 0 and j.get("code") == OKX_CODE_TIMESTAMP and OKX_CLOCK.resync():
+                continue
+            return j
+
+    return resilience.call("okx", "GET", path, send)
+
+def okx_private_post(path: str, payload: dict, timeout=None):
     body = json.dumps(payload, separators=(",", ":"))
-    headers = _okx_sign("POST", path, body)
     url = OKX_BASE_URL.rstrip("/") + path
-    r = requests.post(url, headers=headers, data=body, timeout=timeout)
-    text_preview = r.text[:400]
-    if DEBUG:
-        print("POST", url, "payload:", payload, "resp:", r.status_code, text_preview)
-    try:
-        j = r.json()
-    except Exception:
-        print("❌ OKX raw response (not JSON):", text_preview)
-        return {"http": r.status_code, "text": r.text}
+
+    def send():
+        for attempt in (0, 1):
+            rate_limit.acquire("okx", path)
+            headers = _okx_sign("POST", path, body)
+            r = http_post("okx", url, headers=headers, data=body, timeout=timeout, limit=False)
+            text_preview = r.text[:400]
+            if DEBUG:
+                jsonlog.event("okx_post", logging.DEBUG, url=url, payload=payload, status=r.status_code, response=text_preview)
+            try:
+                j = r.json()
+            except Exception:
+                jsonlog.event(f"❌ OKX raw response (not JSON): {text_preview}", logging.ERROR)
+                return {"http": r.status_code, "text": r.text}
+            # запрос, отвергнутый по времени, биржа не исполняла — повтор безопасен
+            if attempt == 0 and j.get("code") == OKX_CODE_TIMESTAMP and OKX_CLOCK.resync():
+                continue
+            return j
+
+    j = resilience.call("okx", "POST", path, send)
     if j.get("code") not in ("0", 0):
-        print("❌ OKX error:", j)
+        jsonlog.event(f"❌ OKX error: {j}", logging.ERROR)
     else:
-        print("✅ OKX OK:", j)
+        jsonlog.event(f"✅ OKX OK: {j}")
     return j
 
 def tv_ticker_to_okx_inst_id(tv_ticker: str) -> str:
@@ -733,26 +999,14 @@ def tv_ticker_to_okx_inst_id(tv_ticker: str) -> str:
     return s
 
 def get_okx_inst_info(inst_id: str):
-    if inst_id in _okx_inst_cache:
-        return _okx_inst_cache[inst_id]
-    resp = requests.get(
-        OKX_BASE_URL.rstrip("/") + "/api/v5/public/instruments",
-        params={"instType": "SWAP", "instId": inst_id},
-        timeout=10,
-    ).json()
-    data = (resp.get("data") or resp.get("result") or [])
-    if not data:
-        raise RuntimeError(f"Нет данных по инструменту {inst_id}: {resp}")
-    info = data[0]
-    _okx_inst_cache[inst_id] = info
-    return info
+    return instruments.okx_instrument(inst_id)
 
 def get_okx_pos_mode() -> str:
     global _okx_pos_mode
     if _okx_pos_mode:
         return _okx_pos_mode
     try:
-        cfg = okx_private_get("/api/v5/account/config", timeout=10)
+        cfg = okx_private_get("/api/v5/account/config")
         data = cfg.get("data") or []
         if data:
             raw = (data[0].get("posMode") or "net").lower()
@@ -764,19 +1018,24 @@ def get_okx_pos_mode() -> str:
                 _okx_pos_mode = "net"
         else:
             _okx_pos_mode = "net"
-        print("🔧 OKX posMode detected:", _okx_pos_mode)
+        jsonlog.event(f"🔧 OKX posMode detected: {_okx_pos_mode}")
     except Exception as e:
-        print("⚠️ Cannot detect posMode, fallback to 'net':", e)
+        jsonlog.event(f"⚠️ Cannot detect posMode, fallback to 'net': {e}", logging.WARNING)
         _okx_pos_mode = "net"
     return _okx_pos_mode
 
-def set_okx_leverage(inst_id: str, leverage: float):
+def set_okx_leverage(inst_id: str, leverage: float) -> bool:
     try:
         payload = {"instId": inst_id, "lever": str(leverage), "mgnMode": "cross"}
         resp = okx_private_post("/api/v5/account/set-leverage", payload)
-        print("✅ OKX leverage response:", resp)
+        jsonlog.event(f"✅ OKX leverage response: {resp}")
+        return str(resp.get("code")) == "0"
     except Exception as e:
-        print("❌ set_okx_leverage exception:", e)
+        jsonlog.event(f"❌ set_okx_leverage exception: {e}", logging.ERROR)
+        return False
+
+# позиций OKX в конфиге нет — плечо узнаём из позиций (кэш аккаунта) и первого set-leverage
+okx_leverage = leverage.LeverageBook("okx", set_okx_leverage, mode="cross")
 
 def calc_sz_from_risk_okx(entry, stop, risk_usdt, inst_id: str) -> float:
     try:
@@ -801,6 +1060,7 @@ def calc_sz_from_risk_okx(entry, stop, risk_usdt, inst_id: str) -> float:
 def okx_has_position(inst_id: str) -> bool:
     j = okx_private_get("/api/v5/account/positions", {"instType": "SWAP", "instId": inst_id})
     for p in j.get("data", []):
+        okx_leverage.observe(inst_id, p.get("lever"), p.get("mgnMode"))
         pos = float(p.get("pos", "0"))
         avail = float(p.get("availPos", "0"))
         if abs(pos) > 0 or abs(avail) > 0:
@@ -812,14 +1072,42 @@ def okx_has_open_orders(inst_id: str) -> bool:
     return bool(j.get("data"))
 
 def okx_has_algo_orders(inst_id: str) -> bool:
-    j = okx_private_get("/api/v5/trade/orders-algo-pending", {"instType": "SWAP", "instId": inst_id})
+    j = okx_private_get("/api/v5/trade/orders-algo-pending", {"instType": "SWAP", "instId": inst_id, "ordType": OKX_ALGO_ORD_TYPES})
     return bool(j.get("data"))
 
+def okx_state_checks(plan, inst_id: str):
+    """Позиция / ордера / алго-ордера как узлы плана: из свежего кэша — один узел, иначе три живых запроса параллельно."""
+    cached = okx_account.busy(inst_id)
+    if cached is not None:
+        plan.veto_if("state_check", "blocked_existing_state", any, cached)
+        return
+    plan.veto_if("position", "blocked_existing_state", okx_has_position, inst_id)
+    plan.veto_if("open_orders", "blocked_existing_state", okx_has_open_orders, inst_id)
+    plan.veto_if("algo_orders", "blocked_existing_state", okx_has_algo_orders, inst_id)
+
+def okx_account_snapshot():
+    pos = okx_private_get("/api/v5/account/positions", {"instType": "SWAP"})
+    pending = okx_private_get("/api/v5/trade/orders-pending", {"instType": "SWAP"})
+    algos = okx_private_get("/api/v5/trade/orders-algo-pending", {"instType": "SWAP", "ordType": OKX_ALGO_ORD_TYPES})
+    if any(str(j.get("code")) != "0" for j in (pos, pending, algos)):
+        return None
+    positions, orders, algo_orders = {}, {}, {}
+    for p in pos.get("data") or []:
+        positions[p.get("instId", "")] = max(abs(float(p.get("pos") or 0)), abs(float(p.get("availPos") or 0)))
+        okx_leverage.observe(p.get("instId", ""), p.get("lever"), p.get("mgnMode"))
+    for o in pending.get("data") or []:
+        orders.setdefault(o.get("instId", ""), {})[o.get("ordId", "")] = o
+    for a in algos.get("data") or []:
+        algo_orders.setdefault(a.get("instId", ""), {})[a.get("algoId", "")] = a
+    return {"positions": positions, "orders": orders, "algo_orders": algo_orders}
+
+okx_account = AccountCache("okx", okx_account_snapshot)
+
 def okx_place_order_with_tp_sl(inst_id: str, side: str, entry: float, tp: float, sl: float, risk_usdt: float):
     sz = calc_sz_from_risk_okx(entry, sl, risk_usdt, inst_id)
     if sz <= 0:
         msg = f"{inst_id}: sz <= 0, сделка пропущена (risk={risk_usdt}, entry={entry}, sl={sl})"
-        print("⚠️", msg)
+        jsonlog.event(f"⚠️ {msg}", logging.WARNING)
         send_telegram("⚠️ *OKX SIZE ERROR*\n" + msg)
         return {"error": "bad_size"}
     payload = {
@@ -856,10 +1144,19 @@ def parse_payload_okx(req):
 
 @app.route("/webhook_okx", methods=["POST"])
 def webhook_okx():
-    global okx_trade_global_cooldown_until
     if WEBHOOK_SECRET_OKX and request.args.get("key", "") != WEBHOOK_SECRET_OKX:
         return "forbidden", 403
+    sw = metrics.Stopwatch("webhook_okx")
     payload = parse_payload_okx(request)
+    jsonlog.log_request("webhook_okx", request, payload)
+    sw.lap("parse")
+    if idempotency.claim("webhook_okx", request.get_json(silent=True) or request.get_data(), payload["tf"]) is None:
+        return jsonify({"status": "duplicate_delivery"}), 200
+    if ingest.INGEST_ASYNC:
+        return ingest.accept("webhook_okx", payload["instId"], payload, handle_webhook_okx)
+    return handle_webhook_okx(payload, sw)
+
+def handle_webhook_okx(payload: dict, sw):
     typ = payload["type"]
     inst_id = payload["instId"]
     direction = payload["direction"]
@@ -867,26 +1164,30 @@ def webhook_okx():
     if not acquire_instrument_lock(inst_id, ttl=60):
         return jsonify({"status": "blocked_local_lock"}), 200
     try:
-        now_dt = datetime.now(timezone.utc) + timedelta(hours=2)
-        wd = now_dt.weekday()
-        hour = now_dt.hour
-        if direction == "UP":
-            days_set = OKX_LONG_DAYS_SET
-            hour_ranges = OKX_LONG_HOUR_RANGES
-        else:
-            days_set = OKX_SHORT_DAYS_SET
-            hour_ranges = OKX_SHORT_HOUR_RANGES
-        if days_set and wd not in days_set:
-            return jsonify({"status": "blocked_day"}), 200
-        if not hour_allowed(hour, hour_ranges):
-            return jsonify({"status": "blocked_hour"}), 200
+        blocked = TRADING_SCHEDULE.check(("okx", "UP" if direction == "UP" else "DOWN"))
+        if blocked:
+            return jsonify({"status": blocked}), 200
         if typ != "SCALP":
             return jsonify({"status": "ignored"}), 200
-        now = time.time()
-        if now < okx_trade_global_cooldown_until:
+        if STATE.ttl("okx:cooldown") > 0:
             return jsonify({"status": "cooldown"}), 200
-        if okx_has_position(inst_id) or okx_has_open_orders(inst_id) or okx_has_algo_orders(inst_id):
-            return jsonify({"status": "blocked_existing_state"}), 200
+        if resilience.is_open("okx"):
+            return jsonify({"status": "venue_unavailable"}), 503
+        sw.lap("filters")
+        # проверки состояния и (при включённой торговле) плечо / инструмент / posMode — параллельно
+        plan = pretrade.Plan("webhook_okx")
+        okx_state_checks(plan, inst_id)
+        if TRADE_ENABLED_OKX:
+            plan.add("leverage", okx_leverage.ensure, inst_id, OKX_LEVERAGE)
+            plan.add("instrument", get_okx_inst_info, inst_id)
+            plan.add("pos_mode", get_okx_pos_mode)
+        try:
+            plan.run()
+        except pretrade.Abort as a:
+            if a.error is not None:
+                raise a.error
+            return jsonify({"status": a.status}), 200
+        sw.lap("pretrade")
         if not TRADE_ENABLED_OKX:
             return jsonify({"status": "trade_disabled"}), 200
         try:
@@ -903,12 +1204,19 @@ def webhook_okx():
             side = "sell"
             sl = round(entry_f + stop_size, 6)
             tp = round(entry_f - take_size, 6)
-        set_okx_leverage(inst_id, OKX_LEVERAGE)
+        sw.skip()
+        if not STATE.claim("okx:cooldown", GLOBAL_COOLDOWN_SEC):  # другой воркер успел раньше
+            return jsonify({"status": "cooldown"}), 200
         resp = okx_place_order_with_tp_sl(inst_id, side, entry_f, tp, sl, MAX_RISK_USDT_OKX)
-        okx_trade_global_cooldown_until = time.time() + 180
+        if not okx_rejected(resp):
+            okx_account.mark_busy(inst_id)  # позиция открыта или могла открыться
+        sw.lap("order")
         return jsonify({"status": "ok", "okx_resp": resp}), 200
+    except resilience.CircuitOpen as e:
+        jsonlog.event(f"⛔ WEBHOOK OKX: {e}", logging.WARNING)
+        return jsonify({"status": "venue_unavailable"}), 503
     except Exception as e:
-        print("❌ WEBHOOK OKX ERROR:", e)
+        jsonlog.event(f"❌ WEBHOOK OKX ERROR: {e}", logging.ERROR)
         return jsonify({"status": "error"}), 500
     finally:
         release_instrument_lock(inst_id)
@@ -919,12 +1227,12 @@ def heartbeat_loop():
     sent_today=None
     while True:
         try:
-            now = datetime.now(timezone.utc) + timedelta(hours=2)
-            if now.hour==3 and sent_today!=now.date():
+            now = TRADING_SCHEDULE.now()
+            if now.hour==3 and sent_today!=now.date() and HEARTBEAT_LEASE.held():
                 send_telegram(f"💙 *HEARTBEAT*\nServer alive {now.strftime('%H:%M')}")
                 sent_today=now.date()
         except Exception as e:
-            print("❌ Heartbeat:", e)
+            jsonlog.event(f"❌ Heartbeat: {e}", logging.ERROR)
         time.sleep(60)
 
 # =============== MAIN ===============
@@ -936,10 +1244,102 @@ def root(): return "OK",200
 def health():
     return "OK", 200
 
-if __name__=="__main__":
-    print("🚀 Starting SCALP-only server")
+@app.route("/telegram/outbox")
+def telegram_outbox_stats():
+    return jsonify(telegram_outbox.stats()), 200
+
+@app.route("/signal/<sig_id>")
+def signal_status(sig_id):
+    return ingest.signal_status(sig_id)
+
+@app.route("/leverage")
+def leverage_status():
+    return jsonify(leverage.status()), 200
+
+@app.route("/account/cache")
+def account_cache_status():
+    return jsonify([bybit_account.status(), okx_account.status()]), 200
+
+@app.route("/clock")
+def clock_status():
+    return jsonify(clock_sync.status()), 200
+
+@app.route("/rate-limit")
+def rate_limit_status():
+    return jsonify(rate_limit.status()), 200
+
+@app.route("/breakers")
+def breakers_status():
+    return jsonify(resilience.status()), 200
+
+_STATUS_ROUTES = ("webhook", "webhook_okx")
+
+@app.before_request
+def _metrics_start():
+    g.t0 = time.perf_counter()
+    if request.endpoint in _STATUS_ROUTES:
+        g.trace = tracing.root(request.endpoint)
+
+@app.after_request
+def _metrics_status(resp):
+    route = request.endpoint
+    if route in _STATUS_ROUTES:
+        body = resp.get_json(silent=True) if resp.is_json else None
+        status = (body or {}).get("status") or f"http_{resp.status_code}"
+        metrics.webhook_status_total.inc(route, status)
+        metrics.stage_seconds.observe(time.perf_counter() - g.t0, route, "total")
+        sp = g.get("trace")
+        if sp:
+            sp.set(status=status, http=resp.status_code)
+            resp.headers["X-Trace-Id"] = sp.trace
+    return resp
+
+@app.teardown_request
+def _trace_end(exc):
+    sp = g.pop("trace", None)
+    if sp:
+        sp.end(**({"error": repr(exc)} if exc else {}))
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+@app.route("/debug/verbose", methods=["POST"])
+def debug_verbose():
+    # полные дампы запросов на лету: ?key=<WEBHOOK_SECRET>&on=1|0 (действует на текущий воркер)
+    if not WEBHOOK_SECRET or request.args.get("key", "") != WEBHOOK_SECRET:
+        return "forbidden", 403
+    jsonlog.set_verbose(request.args.get("on", "1").lower() in ("1", "true", "on"))
+    return jsonify({"verbose": jsonlog.is_verbose()}), 200
+
+# =============== ФОН ПРОЦЕССА ===============
+# Потоки не переживают fork, а __main__ под gunicorn не выполняется: воркер стартует
+# фон сам — из gunicorn post_worker_init (gunicorn.conf.py), до первого запроса.
+# Справочники, часы, стримы, кэш аккаунта и плечо — в каждом воркере; разбор закрытых
+# сделок и heartbeat — в каждом тоже, но работает только держатель аренды (один на хост).
+MONITOR_LEASE = shared_state.Lease(STATE, "bybit:closed_trades", 180)
+HEARTBEAT_LEASE = shared_state.Lease(STATE, "heartbeat:app", 180)
+_background_pid = None
+_background_lock = threading.Lock()
+
+def start_background():
+    global _background_pid
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    instruments.start()
+    BYBIT_CLOCK.start()
+    OKX_CLOCK.start()
+    start_private_streams()
+    bybit_account.start()
+    bybit_leverage.start()
     threading.Thread(target=heartbeat_loop,daemon=True).start()
     threading.Thread(target=monitor_closed_trades,daemon=True).start()
+
+if __name__=="__main__":
+    jsonlog.event("🚀 Starting SCALP-only server")
+    start_background()
     port=int(os.getenv("PORT","8080"))
     app.run(host="0.0.0.0",port=port,use_reloader=False)
 
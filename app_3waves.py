@@ -1,13 +1,16 @@
 import os
 import json
 import time
+import logging
 from collections import deque
 from datetime import datetime, timezone
 
-import requests
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
+
+import idempotency, jsonlog, metrics, telegram_outbox, tracing
 
 app = Flask(__name__)
+idempotency.init_app(app)
 
 # === ENV ===
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
@@ -25,16 +28,9 @@ events_5m = deque()
 # === Telegram ===
 def send_telegram(text: str):
     if not TELEGRAM_TOKEN or not CHAT_ID:
-        print("⚠️ Telegram credentials missing.")
+        jsonlog.event("⚠️ Telegram credentials missing.", logging.WARNING)
         return
-    try:
-        requests.get(
-            f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage",
-            params={"chat_id": CHAT_ID, "text": text},
-            timeout=8,
-        )
-    except Exception as e:
-        print("❌ Telegram error:", e)
+    telegram_outbox.send_message(TELEGRAM_TOKEN, CHAT_ID, text)
 
 
 def ms_to_str(ms: int) -> str:
@@ -86,7 +82,7 @@ def handle_event(ticker: str, tf: str, time_ms: int):
             best = min(matches, key=lambda e: abs(e["time_ms"] - time_ms))
             send_cluster_alert(ticker, time_ms_5m=best["time_ms"], time_ms_3m=time_ms)
     else:
-        print(f"⚠️ unknown tf: {tf}")
+        jsonlog.event(f"⚠️ unknown tf: {tf}", logging.WARNING)
 
 
 def send_cluster_alert(ticker: str, time_ms_5m: int, time_ms_3m: int):
@@ -97,7 +93,7 @@ def send_cluster_alert(ticker: str, time_ms_5m: int, time_ms_3m: int):
         f"3m: {ms_to_str(time_ms_3m)}\n"
         f"Окно: ±{WINDOW_SEC // 60} минут"
     )
-    print(txt)
+    jsonlog.event(txt)
     send_telegram(txt)
 
 
@@ -108,12 +104,8 @@ def webhook_3waves():
     if WEBHOOK_SECRET and request.args.get("key", "") != WEBHOOK_SECRET:
         return "forbidden", 403
 
-    raw = request.get_data(as_text=True)
-    print("\n=== 3WAVES WEBHOOK RAW ===")
-    print(raw)
-
     data = request.get_json(silent=True) or {}
-    print("JSON:", data)
+    jsonlog.log_request("webhook_3waves", request)
 
     typ    = str(data.get("type", "")).upper()
     ticker = str(data.get("ticker", ""))
@@ -127,11 +119,15 @@ def webhook_3waves():
     try:
         t_ms = int(t_ms)
     except Exception:
-        print("⚠️ bad time in payload:", t_ms)
+        jsonlog.event(f"⚠️ bad time in payload: {t_ms}", logging.WARNING)
         return jsonify({"status": "bad_time"}), 200
 
+    # повтор того же бара (ретрай TradingView) не должен второй раз попасть в окно кластера
+    if idempotency.claim("webhook_3waves", data, tf) is None:
+        return jsonify({"status": "duplicate_delivery"}), 200
+
     if tf not in ("3", "5"):
-        print("⚠️ unexpected tf:", tf)
+        jsonlog.event(f"⚠️ unexpected tf: {tf}", logging.WARNING)
         # всё равно примем, но кластер логика может пропустить
     handle_event(ticker, tf, t_ms)
 
@@ -148,7 +144,58 @@ def health():
     return "OK", 200
 
 
+@app.route("/telegram/outbox")
+def telegram_outbox_stats():
+    return jsonify(telegram_outbox.stats()), 200
+
+
+_STATUS_ROUTES = ("webhook_3waves",)
+
+
+@app.before_request
+def _metrics_start():
+    g.t0 = time.perf_counter()
+    if request.endpoint in _STATUS_ROUTES:
+        g.trace = tracing.root(request.endpoint)
+
+
+@app.after_request
+def _metrics_status(resp):
+    route = request.endpoint
+    if route in _STATUS_ROUTES:
+        body = resp.get_json(silent=True) if resp.is_json else None
+        status = (body or {}).get("status") or f"http_{resp.status_code}"
+        metrics.webhook_status_total.inc(route, status)
+        metrics.stage_seconds.observe(time.perf_counter() - g.t0, route, "total")
+        sp = g.get("trace")
+        if sp:
+            sp.set(status=status, http=resp.status_code)
+            resp.headers["X-Trace-Id"] = sp.trace
+    return resp
+
+
+@app.teardown_request
+def _trace_end(exc):
+    sp = g.pop("trace", None)
+    if sp:
+        sp.end(**({"error": repr(exc)} if exc else {}))
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
+@app.route("/debug/verbose", methods=["POST"])
+def debug_verbose():
+    # полные дампы запросов на лету: ?key=<WEBHOOK_SECRET_3WAVES>&on=1|0
+    if not WEBHOOK_SECRET or request.args.get("key", "") != WEBHOOK_SECRET:
+        return "forbidden", 403
+    jsonlog.set_verbose(request.args.get("on", "1").lower() in ("1", "true", "on"))
+    return jsonify({"verbose": jsonlog.is_verbose()}), 200
+
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "8080"))
-    print(f"🚀 Starting 3WAVES cluster server on {port}")
+    jsonlog.event(f"🚀 Starting 3WAVES cluster server on {port}")
     app.run(host="0.0.0.0", port=port, use_reloader=False)
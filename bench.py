@@ -0,0 +1,258 @@
+# bench.py — микробенчмарки CPU-части горячего пути (без сети)
+#
+# Каждый бенчмарк — фабрика, которая готовит входные данные и возвращает функцию
+# без аргументов. Замер как в timeit: autorange до ~0.2 с на повтор, GC выключен,
+# берётся медиана и минимум нс/вызов по --repeat повторам.
+#
+#   python bench.py run -o bench_baseline.json            # все бенчмарки → JSON
+#   python bench.py run -k sign --compare bench_baseline.json
+#   python bench.py compare bench_baseline.json bench_new.json --threshold 0.10
+#
+# compare сравнивает медианы и выходит с кодом 1, если что-то замедлилось больше порога.
+
+import os, io, gc, sys, json, time, timeit, argparse, platform, statistics, contextlib, subprocess
+
+# фиксированные ключи/настройки до импорта приложений: подпись и расписание детерминированы
+os.environ.setdefault("BYBIT_API_KEY", "bench-key")
+os.environ.setdefault("BYBIT_API_SECRET", "bench-secret")
+os.environ.setdefault("OKX_API_KEY", "bench-okx-key")
+os.environ.setdefault("OKX_API_SECRET", "bench-okx-secret")
+os.environ.setdefault("OKX_PASSPHRASE", "bench-pass")
+os.environ.setdefault("TRACE_ENABLED", "false")
+os.environ.setdefault("CLOCK_SYNC_ENABLED", "false")
+
+import instruments
+
+# реестр инструментов заполнен заранее и помечен загруженным — ни одного запроса в сеть
+instruments._bybit.update({
+    "BTCUSDT": {"qtyStep": "0.001", "minOrderQty": "0.001", "maxOrderQty": "100", "tickSize": "0.1"},
+    "ETHUSDT": {"qtyStep": "0.01", "minOrderQty": "0.01", "maxOrderQty": "1000", "tickSize": "0.01"},
+})
+instruments._okx.update({
+    "BTC-USDT-SWAP": {"ctVal": "0.01", "lotSz": "0.01", "minSz": "0.01", "tickSz": "0.1", "state": "live"},
+    "ETH-USDT-SWAP": {"ctVal": "0.1", "lotSz": "0.01", "minSz": "0.01", "tickSz": "0.01", "state": "live"},
+})
+instruments._started_pid = os.getpid()
+
+import app, okx_app, app_3waves
+
+DEFAULT_REPEAT = 7
+MIN_TIME = 0.2
+
+_BENCHES = {}
+
+def bench(name: str):
+    def deco(factory):
+        _BENCHES[name] = factory
+        return factory
+    return deco
+
+# =============== БЕНЧМАРКИ ===============
+@bench("bybit_sign_post")
+def _():
+    payload = {"category": "linear", "symbol": "BTCUSDT", "side": "Buy", "orderType": "Market",
+               "qty": "0.002", "timeInForce": "IOC", "takeProfit": "60432", "stopLoss": "59820"}
+    return lambda: app._bybit_sign(payload)
+
+@bench("bybit_sign_get")
+def _():
+    query = "category=linear&settleCoin=USDT&limit=200"
+    return lambda: app._bybit_sign({}, method="GET", query_string=query)
+
+@bench("okx_sign")
+def _():
+    body = json.dumps({"instId": "BTC-USDT-SWAP", "tdMode": "cross", "side": "buy", "ordType": "market", "sz": "1"},
+                      separators=(",", ":"))
+    return lambda: app._okx_sign("POST", "/api/v5/trade/order", body)
+
+@bench("okx_app_sign")
+def _():
+    return lambda: okx_app._okx_sign("GET", "/api/v5/account/positions?instType=SWAP&instId=BTC-USDT-SWAP", "")
+
+def _in_request(flask_app, fn, body: dict):
+    """parse_payload читает flask.request — держим контекст запроса открытым на время замера."""
+    ctx = flask_app.test_request_context("/webhook", method="POST", json=body)
+    ctx.push()
+    fn()  # get_json кэширует тело — меряем разбор полей, как во второй половине вебхука
+    return fn
+
+@bench("parse_payload")
+def _():
+    body = {"type": "SCALP", "ticker": "BYBIT:BTCUSDT.P", "direction": "UP", "tf": "1m", "entry": "60000.5"}
+    return _in_request(app.app, lambda: app.parse_payload(None), body)
+
+@bench("parse_payload_okx")
+def _():
+    body = {"type": "SCALP", "ticker": "OKX:BTCUSDT.P", "direction": "DOWN", "tf": "1m", "entry": "60000.5"}
+    return _in_request(app.app, lambda: app.parse_payload_okx(None), body)
+
+@bench("okx_app_parse_payload")
+def _():
+    body = {"type": "SCALP", "ticker": "OKX:ETHUSDT.P", "direction": "UP", "tf": "1m", "entry": "3000.25"}
+    return _in_request(okx_app.app, lambda: okx_app.parse_payload(None), body)
+
+@bench("schedule_check")
+def _():
+    return lambda: app.TRADING_SCHEDULE.check(("okx", "UP"))
+
+@bench("schedule_check_bybit")
+def _():
+    return lambda: app.TRADING_SCHEDULE.check(("bybit", "DOWN"))
+
+@bench("calc_qty_from_risk")
+def _():
+    return lambda: app.calc_qty_from_risk(60000.0, 59820.0, 0.5, "BTCUSDT")
+
+@bench("calc_sz_from_risk_okx")
+def _():
+    return lambda: app.calc_sz_from_risk_okx(3000.0, 2991.0, 1.0, "ETH-USDT-SWAP")
+
+@bench("okx_app_calc_sz_from_risk")
+def _():
+    return lambda: okx_app.calc_sz_from_risk_okx(3000.0, 2991.0, 1.0, "ETH-USDT-SWAP")
+
+@bench("md_escape")
+def _():
+    text = "⚡ *BYBIT TRADE*\nBTCUSDT Buy\nEntry~60000.5\nTP:60432.1\nSL:59820.0\nMode:attached"
+    return lambda: app.md_escape(text)
+
+@bench("tv_ticker_to_okx_inst_id")
+def _():
+    return lambda: app.tv_ticker_to_okx_inst_id("OKX:BTCUSDT.P")
+
+@bench("handle_event_no_match")
+def _():
+    # окно заполнено чужими сигналами: перебор без совпадений
+    app_3waves.events_3m.clear()
+    app_3waves.events_5m.clear()
+    base = 1_700_000_000_000
+    for i in range(200):
+        app_3waves.events_5m.append({"ticker": f"T{i}USDT", "time_ms": base})
+    t = [base]
+
+    def run():
+        t[0] += 1  # время растёт: prune не выбрасывает окно, deque 3m растёт как в бою
+        app_3waves.handle_event("BTCUSDT", "3", t[0])
+        if len(app_3waves.events_3m) > 200:
+            app_3waves.events_3m.popleft()
+    return run
+
+@bench("handle_event_match")
+def _():
+    app_3waves.events_3m.clear()
+    app_3waves.events_5m.clear()
+    app_3waves.send_telegram = lambda text: None  # без очереди Telegram
+    base = 1_700_000_000_000
+    for i in range(50):
+        app_3waves.events_5m.append({"ticker": "BTCUSDT" if i % 10 == 0 else f"T{i}USDT", "time_ms": base + i})
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            app_3waves.handle_event("BTCUSDT", "3", base + 60)
+        app_3waves.events_3m.pop()
+    return run
+
+# =============== ЗАМЕР ===============
+def measure(fn, repeat: int = DEFAULT_REPEAT, min_time: float = MIN_TIME) -> dict:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    runs = [t / number * 1e9 for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "ns_per_op": round(statistics.median(runs), 2),
+        "ns_min": round(min(runs), 2),
+        "ns_stdev": round(statistics.stdev(runs), 2) if len(runs) > 1 else 0.0,
+        "number": number,
+        "repeat": repeat,
+    }
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except Exception:
+        return ""
+
+def run(names=None, repeat: int = DEFAULT_REPEAT, min_time: float = MIN_TIME, out=sys.stdout) -> dict:
+    results = {}
+    for name, factory in _BENCHES.items():
+        if names and not any(n in name for n in names):
+            continue
+        fn = factory()
+        gc.collect()
+        results[name] = measure(fn, repeat, min_time)
+        r = results[name]
+        print(f"{name:32s} {r['ns_per_op']:12.1f} ns/op  (min {r['ns_min']:.1f}, ±{r['ns_stdev']:.1f}, n={r['number']})", file=out)
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+def compare(base: dict, new: dict, threshold: float = 0.10, out=sys.stdout) -> list:
+    """Печатает таблицу и возвращает имена бенчмарков, замедлившихся больше threshold (по медиане)."""
+    regressions = []
+    b, n = base.get("results") or {}, new.get("results") or {}
+    print(f"{'benchmark':32s} {'base ns':>12s} {'new ns':>12s} {'delta':>8s}", file=out)
+    for name in sorted(set(b) | set(n)):
+        if name not in b or name not in n:
+            print(f"{name:32s} {'—' if name not in b else b[name]['ns_per_op']:>12} "
+                  f"{'—' if name not in n else n[name]['ns_per_op']:>12}", file=out)
+            continue
+        old, cur = b[name]["ns_per_op"], n[name]["ns_per_op"]
+        delta = (cur - old) / old if old else 0.0
+        flag = ""
+        if delta > threshold:
+            flag = "  ❌ REGRESSION"
+            regressions.append(name)
+        elif delta < -threshold:
+            flag = "  ✅ faster"
+        print(f"{name:32s} {old:12.1f} {cur:12.1f} {delta:+8.1%}{flag}", file=out)
+    bm, nm = base.get("meta") or {}, new.get("meta") or {}
+    if (bm.get("python"), bm.get("machine")) != (nm.get("python"), nm.get("machine")):
+        print(f"⚠️ разные окружения: {bm.get('python')}/{bm.get('machine')} vs {nm.get('python')}/{nm.get('machine')}", file=out)
+    return regressions
+
+def _load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Hot-path microbenchmarks")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run")
+    r.add_argument("-k", action="append", help="подстрока имени (можно несколько)")
+    r.add_argument("-o", "--output", help="записать результаты в JSON")
+    r.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    r.add_argument("--min-time", type=float, default=MIN_TIME, help="секунд на один повтор")
+    r.add_argument("--compare", help="сравнить с сохранённым baseline")
+    r.add_argument("--threshold", type=float, default=0.10)
+    c = sub.add_parser("compare")
+    c.add_argument("baseline")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=0.10)
+    sub.add_parser("list")
+    a = ap.parse_args(argv)
+
+    if a.cmd == "list":
+        print("\n".join(_BENCHES))
+        return 0
+    if a.cmd == "compare":
+        return 1 if compare(_load(a.baseline), _load(a.new), a.threshold) else 0
+    res = run(a.k, a.repeat, a.min_time)
+    if a.output:
+        with open(a.output, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2, sort_keys=True)
+        print(f"💾 {a.output}")
+    if a.compare:
+        return 1 if compare(_load(a.compare), res, a.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
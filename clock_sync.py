@@ -0,0 +1,149 @@
+# clock_sync.py — смещение часов хоста относительно биржи и recv_window по измеренному джиттеру
+#
+# Фоновый поток раз в CLOCK_SYNC_SEC снимает CLOCK_SAMPLES замеров server-time
+# эндпоинта площадки и берёт замер с наименьшим RTT (у него меньше всего ошибка):
+#   offset = server - (t0 + t1) / 2
+# Смещение, RTT и джиттер RTT сглаживаются EWMA (CLOCK_ALPHA). Подпись берёт
+# время из now_ms() (локальное + offset), Bybit — ещё и recv_window_ms():
+# запас на RTT + 4 джиттера, но не меньше прежних 5000 и не больше CLOCK_RECV_WINDOW_MAX_MS.
+# Если биржа всё же отвергла запрос по времени, вызывающий делает resync() — замер
+# без сглаживания, смещение сразу подтягивается — и повторяет запрос один раз.
+
+import os, time, logging, threading
+
+import jsonlog, metrics, rate_limit
+from http_clients import http_get
+
+CLOCK_SYNC_ENABLED = os.getenv("CLOCK_SYNC_ENABLED", "true").lower() == "true"
+CLOCK_SYNC_SEC = float(os.getenv("CLOCK_SYNC_SEC", "30"))
+CLOCK_SAMPLES = int(os.getenv("CLOCK_SAMPLES", "3"))
+CLOCK_ALPHA = float(os.getenv("CLOCK_ALPHA", "0.3"))
+CLOCK_RECV_WINDOW_MIN_MS = int(os.getenv("CLOCK_RECV_WINDOW_MIN_MS", "5000"))
+CLOCK_RECV_WINDOW_MAX_MS = int(os.getenv("CLOCK_RECV_WINDOW_MAX_MS", "20000"))
+_RESYNC_MIN_GAP_SEC = 1.0
+
+_clocks = {}
+
+def bybit_server_ms(j: dict) -> float:
+    """/v5/market/time: timeNano (нс), иначе time (мс) верхнего уровня."""
+    nano = (j.get("result") or {}).get("timeNano")
+    return int(nano) / 1e6 if nano else float(j["time"])
+
+def okx_server_ms(j: dict) -> float:
+    """/api/v5/public/time: data[0].ts (мс)."""
+    return float(j["data"][0]["ts"])
+
+class ExchangeClock:
+    """
+    url() -> адрес server-time эндпоинта (функция: базовый URL задаёт приложение)
+    parse(json) -> время сервера в мс
+    """
+
+    def __init__(self, venue: str, url, parse):
+        self.venue = venue
+        self.url = url
+        self.parse = parse
+        self.offset_ms = 0.0      # сервер - локальные часы
+        self.rtt_ms = 0.0
+        self.jitter_ms = 0.0
+        self.synced_at = 0.0
+        self.stats = {"syncs": 0, "sync_errors": 0, "resyncs": 0}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        _clocks[venue] = self
+
+    # =============== ПОДПИСЬ ===============
+    def now_ms(self) -> int:
+        """Время биржи по оценке (мс) — для X-BAPI-TIMESTAMP / OK-ACCESS-TIMESTAMP."""
+        self.start()
+        return int(time.time() * 1000 + self.offset_ms)
+
+    def recv_window_ms(self) -> int:
+        if not self.synced_at:
+            return CLOCK_RECV_WINDOW_MIN_MS
+        need = self.rtt_ms + 4 * self.jitter_ms
+        return int(min(CLOCK_RECV_WINDOW_MAX_MS, max(CLOCK_RECV_WINDOW_MIN_MS, need)))
+
+    # =============== ЗАМЕРЫ ===============
+    def _sample(self):
+        t0 = time.time() * 1000
+        r = http_get(self.venue, self.url(), timeout=(3, 5))
+        t1 = time.time() * 1000
+        return self.parse(r.json()) - (t0 + t1) / 2, t1 - t0
+
+    def sync(self, smooth: bool = True) -> bool:
+        samples = []
+        for _ in range(max(1, CLOCK_SAMPLES)):
+            try:
+                samples.append(self._sample())
+            except Exception as e:
+                jsonlog.event(f"⚠️ clock {self.venue}: замер не удался: {e}", logging.WARNING)
+        if not samples:
+            self.stats["sync_errors"] += 1
+            return False
+        offset, rtt = min(samples, key=lambda s: s[1])
+        with self._lock:
+            if smooth and self.synced_at:
+                a = CLOCK_ALPHA
+                self.jitter_ms = (1 - a) * self.jitter_ms + a * abs(rtt - self.rtt_ms)
+                self.rtt_ms = (1 - a) * self.rtt_ms + a * rtt
+                self.offset_ms = (1 - a) * self.offset_ms + a * offset
+            else:
+                if not self.synced_at:
+                    self.rtt_ms = rtt
+                    self.jitter_ms = (max(s[1] for s in samples) - rtt) if len(samples) > 1 else rtt / 2
+                self.offset_ms = offset
+            self.synced_at = time.time()
+            self.stats["syncs"] += 1
+        return True
+
+    def resync(self) -> bool:
+        """Биржа отвергла время запроса: замерить сейчас, смещение — без сглаживания."""
+        with self._lock:
+            if time.time() - self.synced_at < _RESYNC_MIN_GAP_SEC:
+                return True  # соседний поток только что пересинхронизировал
+            self.stats["resyncs"] += 1
+        jsonlog.event(f"⏱ clock {self.venue}: биржа отвергла время запроса, пересинхронизация")
+        return self.sync(smooth=False)
+
+    def status(self) -> dict:
+        return {
+            "venue": self.venue,
+            "enabled": CLOCK_SYNC_ENABLED,
+            "offset_ms": round(self.offset_ms, 1),
+            "rtt_ms": round(self.rtt_ms, 1),
+            "jitter_ms": round(self.jitter_ms, 1),
+            "recv_window_ms": self.recv_window_ms(),
+            "age_sec": round(time.time() - self.synced_at, 1) if self.synced_at else None,
+            **self.stats,
+        }
+
+    # =============== ФОН ===============
+    def start(self):
+        """Один поток-замерщик на процесс (после fork gunicorn — новый)."""
+        pid = os.getpid()
+        if self._pid == pid or not CLOCK_SYNC_ENABLED:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+        threading.Thread(target=self._loop, name=f"clock-{self.venue}", daemon=True).start()
+
+    def _loop(self):
+        rate_limit.mark_background()
+        while True:
+            self.sync()
+            self._wakeup.wait(CLOCK_SYNC_SEC)
+            self._wakeup.clear()
+
+def status() -> list:
+    return [c.status() for c in _clocks.values()]
+
+metrics.Gauge("exchange_clock_offset_ms", "Exchange time minus local time (ms)",
+              lambda: {(v,): round(c.offset_ms, 1) for v, c in _clocks.items()}, ("venue",))
+metrics.Gauge("exchange_rtt_ms", "Smoothed round-trip time to the exchange time endpoint (ms)",
+              lambda: {(v,): round(c.rtt_ms, 1) for v, c in _clocks.items()}, ("venue",))
+metrics.Gauge("exchange_recv_window_ms", "recv_window currently used for signed requests (ms)",
+              lambda: {(v,): c.recv_window_ms() for v, c in _clocks.items()}, ("venue",))
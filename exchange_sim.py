@@ -0,0 +1,746 @@
+# exchange_sim.py — локальный симулятор REST Bybit v5 / OKX v5 для офлайн-тестов и бенчмарков
+#
+# Реализует ровно те эндпоинты, которые используют app.py / okx_app.py / instruments.py,
+# с проверкой подписи (как на бирже), настраиваемой задержкой, инъекцией ошибок,
+# лимитами запросов (10006 / HTTP 429) и простым движком: market-ордера исполняются
+# по последней цене, TP/SL (attached, reduce-only лимитки, стоп-маркеты, OKX attachAlgoOrds)
+# срабатывают при движении цены (/sim/price или случайное блуждание --walk-bps).
+#
+#   python exchange_sim.py --port 9000 --bybit-key K --bybit-secret S --latency-ms 20
+#   BYBIT_BASE_URL=http://127.0.0.1:9000 OKX_BASE_URL=http://127.0.0.1:9000 python app.py
+#
+# Управление: POST /sim/price {"symbol": "BTCUSDT", "price": 61000}
+#             POST /sim/config {"latency_ms": 50, "error_rate": 0.1, "rate_limit": 5}
+#             GET  /sim/state, GET /sim/orders, POST /sim/reset
+
+import os, time, hmac, base64, random, hashlib, argparse, threading
+from datetime import datetime
+
+from flask import Flask, request, jsonify, g
+
+# symbol -> (цена, qtyStep, tickSize); OKX: ctVal = qtyStep, lotSz = minSz = 0.01
+DEFAULT_SYMBOLS = {
+    "BTCUSDT": (60000.0, "0.001", "0.1"),
+    "ETHUSDT": (3000.0, "0.01", "0.01"),
+    "SOLUSDT": (150.0, "0.1", "0.001"),
+    "XRPUSDT": (0.6, "1", "0.0001"),
+}
+
+TAKER_FEE = 0.00055
+MAKER_FEE = 0.0002
+
+def _ms() -> int:
+    return int(time.time() * 1000)
+
+def okx_inst_id(symbol: str) -> str:
+    return f"{symbol[:-4]}-USDT-SWAP" if symbol.endswith("USDT") else symbol
+
+# =============== ДВИЖОК ===============
+class Market:
+    """
+    Один инструмент одной площадки: цена, нетто-позиция, ордера.
+    qty в единицах площадки (Bybit — монеты, OKX — контракты), mult — размер контракта.
+    """
+
+    def __init__(self, venue: str, symbol: str, price: float, mult: float = 1.0):
+        self.venue, self.symbol, self.mult = venue, symbol, mult
+        self.price = price
+        self.pos = 0.0       # >0 long, <0 short
+        self.avg = 0.0
+        self.leverage = "10"
+        self.orders = []     # активные (state live / untriggered)
+        self.history = []    # исполненные / отменённые, новые в конце
+        self.closed = []     # записи закрытого PnL
+        self.execs = []      # исполнения (лента /v5/execution/list), новые в конце
+
+    def _pnl_close(self, closing_side: str, qty: float, px: float, order: dict, fee: float):
+        sign = 1 if self.pos > 0 else -1
+        self.closed.append({
+            "symbol": self.symbol, "side": closing_side, "qty": qty, "orderId": order["id"],
+            "orderLinkId": order.get("link", ""), "avgEntryPrice": self.avg, "avgExitPrice": px,
+            "closedPnl": round(sign * (px - self.avg) * qty * self.mult - fee, 8),
+            "fee": round(fee, 8), "createdTime": _ms(),
+        })
+
+    def fill(self, order: dict, qty: float, px: float, maker: bool = False) -> float:
+        """Исполняет qty по px с учётом reduce-only. Возвращает фактически исполненный объём."""
+        signed = qty if order["side"] == "buy" else -qty
+        if order.get("reduce_only"):
+            if self.pos == 0 or (self.pos > 0) == (signed > 0):
+                return 0.0
+            qty = min(qty, abs(self.pos))
+            signed = qty if signed > 0 else -qty
+        fee = qty * px * self.mult * (MAKER_FEE if maker else TAKER_FEE)
+        closing = 0.0
+        if self.pos == 0 or (self.pos > 0) == (signed > 0):
+            total = abs(self.pos) + qty
+            self.avg = (self.avg * abs(self.pos) + px * qty) / total
+            self.pos += signed
+        else:
+            closing = min(qty, abs(self.pos))
+            self._pnl_close("Buy" if signed > 0 else "Sell", closing, px, order, fee)
+            rest = qty - closing
+            self.pos += signed
+            if abs(self.pos) < 1e-12:
+                self.pos, self.avg = 0.0, 0.0
+            elif rest > 0:
+                self.avg = px
+        order["filled"] = order.get("filled", 0.0) + qty
+        order["avg_px"] = px
+        order["fee"] = order.get("fee", 0.0) + fee
+        order["fills"] = order.get("fills", 0) + 1
+        self.execs.append({
+            "execId": f"{order['id']}-{order['fills']}", "symbol": self.symbol, "orderId": order["id"],
+            "orderLinkId": order.get("link", ""), "side": "Buy" if signed > 0 else "Sell",
+            "orderType": "Market" if order["kind"] == "market" else "Limit",
+            "stopOrderType": order.get("stop_type", ""), "execType": "Trade",
+            "execPrice": str(px), "execQty": str(qty), "execFee": str(round(fee, 8)),
+            "closedSize": str(closing), "isMaker": maker, "execTime": str(_ms()),
+        })
+        return qty
+
+    def _finish(self, order: dict, state: str):
+        order["state"] = state
+        order["updated"] = _ms()
+        if order in self.orders:
+            self.orders.remove(order)
+        self.history.append(order)
+
+    def add(self, order: dict):
+        """Новый ордер: market — сразу, limit — в книгу (PostOnly через спред — отмена), trigger — ждёт."""
+        order.setdefault("created", _ms())
+        order["updated"] = order["created"]
+        if order.get("trigger") is None:
+            if order["kind"] == "market":
+                done = self.fill(order, order["qty"], self.price)
+                self._finish(order, "filled" if done else "cancelled")
+                self._after_fill()
+                return order
+            crosses = (order["side"] == "buy" and self.price <= order["price"]) or \
+                      (order["side"] == "sell" and self.price >= order["price"])
+            if crosses and order.get("post_only"):
+                self._finish(order, "cancelled")
+                return order
+        order["state"] = "live"
+        self.orders.append(order)
+        if order.get("trigger") is None:
+            self.on_price(self.price)
+        return order
+
+    def cancel(self, pred) -> list:
+        gone = [o for o in self.orders if pred(o)]
+        for o in gone:
+            self._finish(o, "cancelled")
+        return gone
+
+    def _after_fill(self):
+        if self.pos != 0:
+            return
+        # позиция закрыта: привязанные TP/SL снимаются, reduce-only лимитки — тоже
+        self.cancel(lambda o: o.get("tied") or (o.get("reduce_only") and o.get("trigger") is None))
+
+    def on_price(self, price: float):
+        self.price = price
+        for o in list(self.orders):
+            if o not in self.orders:
+                continue  # снят как OCO-пара или после закрытия позиции
+            trig = o.get("trigger")
+            if trig is not None:
+                if not ((o["trigger_dir"] > 0 and price >= trig) or (o["trigger_dir"] < 0 and price <= trig)):
+                    continue
+                o["trigger"] = None
+                o["triggered"] = True
+                if o["kind"] == "market":
+                    done = self.fill(o, o["qty"], price)
+                    self._finish(o, "filled" if done else "cancelled")
+            if o["kind"] == "limit":  # лимитка (в т.ч. после триггера) — исполняется по своей цене
+                hit = (o["side"] == "buy" and price <= o["price"]) or (o["side"] == "sell" and price >= o["price"])
+                if not hit:
+                    continue
+                done = self.fill(o, o["qty"] - o.get("filled", 0.0), o["price"], maker=True)
+                self._finish(o, "filled" if done else "cancelled")
+            if o.get("group"):
+                self.cancel(lambda x: x.get("group") == o["group"])
+            self._after_fill()
+
+class Exchange:
+    def __init__(self, symbols: dict = None, bybit_key: str = "", bybit_secret: str = "",
+                 okx_key: str = "", okx_secret: str = "", okx_passphrase: str = "",
+                 latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 rate_limit: int = 0, clock_skew_ms: int = 0, walk_bps: float = 0.0, tick_sec: float = 1.0):
+        self.symbols = dict(symbols or DEFAULT_SYMBOLS)
+        self.keys = {"bybit": (bybit_key, bybit_secret), "okx": (okx_key, okx_secret, okx_passphrase)}
+        self.cfg = {
+            "latency_ms": latency_ms, "jitter_ms": jitter_ms,
+            "error_rate": error_rate,  # доля ответов 5xx / внутренних ошибок площадки
+            "errors": {},              # path -> доля, поверх error_rate
+            "rate_limit": rate_limit,  # запросов в секунду на эндпоинт (0 — без лимита)
+            "clock_skew_ms": clock_skew_ms,
+            "walk_bps": walk_bps, "tick_sec": tick_sec,
+        }
+        self.lock = threading.RLock()
+        self.stats = {"requests": 0, "errors_injected": 0, "rate_limited": 0, "bad_sign": 0}
+        self._windows = {}  # (venue, path) -> [second, count]
+        self._ids = 0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.markets = {}
+            for sym, (px, step, _tick) in self.symbols.items():
+                self.markets[("bybit", sym)] = Market("bybit", sym, px)
+                self.markets[("okx", okx_inst_id(sym))] = Market("okx", okx_inst_id(sym), px, mult=float(step))
+            self.okx_algos = {}  # algoId -> {"inst", "group", "side", "sz", ...}
+            self.order_log = []  # момент прихода каждого ордера (для замера сигнал → ордер)
+
+    def next_id(self) -> str:
+        with self.lock:
+            self._ids += 1
+            return f"{_ms()}{self._ids:06d}"
+
+    def log_order(self, venue: str, symbol: str, order: dict):
+        self.order_log.append({"venue": venue, "symbol": symbol, "ts": time.time(), "orderId": order["id"],
+                               "link": order.get("link", ""), "state": order.get("state")})
+
+    def market(self, venue: str, symbol: str):
+        return self.markets.get((venue, symbol))
+
+    def set_price(self, symbol: str, price: float):
+        with self.lock:
+            for key in (("bybit", symbol), ("okx", okx_inst_id(symbol)), ("okx", symbol)):
+                m = self.markets.get(key)
+                if m is not None:
+                    m.on_price(price)
+
+    def now_ms(self) -> int:
+        return _ms() + int(self.cfg["clock_skew_ms"])
+
+    # --- лимиты / ошибки ---
+    def rate_limited(self, venue: str, path: str):
+        """-> (limited, remaining, limit, reset_ms)."""
+        limit = int(self.cfg["rate_limit"] or 0)
+        if not limit:
+            return False, 0, 0, 0
+        sec = int(time.time())
+        with self.lock:
+            w = self._windows.get((venue, path))
+            if w is None or w[0] != sec:
+                w = self._windows[(venue, path)] = [sec, 0]
+            w[1] += 1
+            used = w[1]
+        return used > limit, max(0, limit - used), limit, (sec + 1) * 1000
+
+    def inject_error(self, path: str) -> bool:
+        rate = self.cfg["errors"].get(path, self.cfg["error_rate"])
+        return bool(rate) and random.random() < rate
+
+    def walk(self):
+        while True:
+            time.sleep(max(0.05, float(self.cfg["tick_sec"])))
+            bps = float(self.cfg["walk_bps"] or 0)
+            if not bps:
+                continue
+            with self.lock:
+                for sym in self.symbols:
+                    m = self.markets[("bybit", sym)]
+                    self.set_price(sym, m.price * (1 + random.gauss(0, bps / 10000)))
+
+    def state(self) -> dict:
+        with self.lock:
+            return {
+                f"{v}:{s}": {"price": m.price, "pos": m.pos, "avg": m.avg, "leverage": m.leverage,
+                             "orders": len(m.orders), "history": len(m.history), "closed": len(m.closed)}
+                for (v, s), m in self.markets.items()
+            } | {"stats": dict(self.stats), "cfg": dict(self.cfg)}
+
+# =============== ПОДПИСИ ===============
+def check_bybit(ex: Exchange, req):
+    """None — подпись верна, иначе (retCode, retMsg)."""
+    key, secret = ex.keys["bybit"]
+    h = req.headers
+    if not h.get("X-BAPI-API-KEY") or not h.get("X-BAPI-SIGN"):
+        return 10003, "API key is invalid."
+    if key and h.get("X-BAPI-API-KEY") != key:
+        return 10003, "API key is invalid."
+    try:
+        ts = int(h.get("X-BAPI-TIMESTAMP", "0"))
+        recv = int(h.get("X-BAPI-RECV-WINDOW", "5000"))
+    except ValueError:
+        return 10002, "invalid request, please check your timestamp"
+    server = ex.now_ms()
+    if not (server - recv <= ts < server + 1000):
+        return 10002, f"invalid request, please check your server timestamp or recv_window param. req_timestamp[{ts}],server_timestamp[{server}],recv_window[{recv}]"
+    payload = req.get_data(as_text=True) if req.method == "POST" else req.query_string.decode()
+    want = hmac.new(secret.encode(), f"{ts}{h.get('X-BAPI-API-KEY')}{recv}{payload}".encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(want, h.get("X-BAPI-SIGN", "")):
+        return 10004, "error sign! origin_string[...]"
+    return None
+
+def check_okx(ex: Exchange, req):
+    """None — подпись верна, иначе (http, code, msg)."""
+    key, secret, passphrase = ex.keys["okx"]
+    h = req.headers
+    if not h.get("OK-ACCESS-KEY") or (key and h.get("OK-ACCESS-KEY") != key):
+        return 401, "50111", "Invalid OK-ACCESS-KEY"
+    if passphrase and h.get("OK-ACCESS-PASSPHRASE") != passphrase:
+        return 401, "50105", "Invalid OK-ACCESS-PASSPHRASE"
+    ts_txt = h.get("OK-ACCESS-TIMESTAMP", "")
+    try:
+        ts = datetime.fromisoformat(ts_txt.replace("Z", "+00:00")).timestamp() * 1000
+    except ValueError:
+        return 401, "50112", "Invalid OK-ACCESS-TIMESTAMP"
+    if abs(ex.now_ms() - ts) > 30000:
+        return 401, "50102", "Timestamp request expired"
+    path = req.path + (("?" + req.query_string.decode()) if req.query_string else "")
+    prehash = f"{ts_txt}{req.method}{path}{req.get_data(as_text=True) if req.method == 'POST' else ''}"
+    want = base64.b64encode(hmac.new(secret.encode(), prehash.encode(), digestmod="sha256").digest()).decode()
+    if not hmac.compare_digest(want, h.get("OK-ACCESS-SIGN", "")):
+        return 401, "50113", "Invalid Sign"
+    return None
+
+# =============== ПРЕДСТАВЛЕНИЕ ===============
+_BYBIT_STATUS = {"live": "New", "filled": "Filled", "cancelled": "Cancelled", "deactivated": "Deactivated"}
+
+def bybit_order_view(o: dict) -> dict:
+    state = o.get("state", "live")
+    status = "Untriggered" if state == "live" and o.get("trigger") is not None else _BYBIT_STATUS.get(state, state)
+    if state == "cancelled" and o.get("tied"):
+        status = "Deactivated"
+    return {
+        "orderId": o["id"], "orderLinkId": o.get("link", ""), "symbol": o["symbol"],
+        "side": "Buy" if o["side"] == "buy" else "Sell",
+        "orderType": "Market" if o["kind"] == "market" else "Limit",
+        "price": str(o.get("price") or "0"), "qty": str(o["qty"]),
+        "triggerPrice": str(o.get("trigger_px") or ""), "triggerDirection": 1 if o.get("trigger_dir", 0) > 0 else (2 if o.get("trigger_dir") else 0),
+        "stopOrderType": o.get("stop_type", ""), "orderStatus": status,
+        "reduceOnly": bool(o.get("reduce_only")), "closeOnTrigger": bool(o.get("close_on_trigger")),
+        "timeInForce": o.get("tif", "GTC"), "avgPrice": str(o.get("avg_px") or ""),
+        "cumExecQty": str(o.get("filled", 0.0)), "cumExecFee": str(round(o.get("fee", 0.0), 8)),
+        "createdTime": str(o["created"]), "updatedTime": str(o["updated"]),
+    }
+
+def bybit_position_view(m: Market) -> dict:
+    return {
+        "symbol": m.symbol, "positionIdx": 0,
+        "side": "Buy" if m.pos > 0 else ("Sell" if m.pos < 0 else ""),
+        "size": str(abs(m.pos)), "avgPrice": str(m.avg), "markPrice": str(m.price),
+        "leverage": m.leverage, "positionValue": str(abs(m.pos) * m.avg),
+        "unrealisedPnl": str(round((m.price - m.avg) * m.pos, 8)) if m.pos else "0",
+        "updatedTime": str(_ms()),
+    }
+
+def okx_position_view(m: Market) -> dict:
+    return {
+        "instId": m.symbol, "instType": "SWAP", "mgnMode": "cross", "posSide": "net",
+        "pos": str(m.pos), "availPos": str(abs(m.pos)), "avgPx": str(m.avg) if m.pos else "",
+        "lever": m.leverage, "last": str(m.price), "uTime": str(_ms()),
+    }
+
+# =============== FLASK ===============
+def create_app(ex: Exchange) -> Flask:
+    app = Flask("exchange_sim")
+
+    def bybit_ok(result: dict, headers: dict = None):
+        resp = jsonify({"retCode": 0, "retMsg": "OK", "result": result, "retExtInfo": {}, "time": ex.now_ms()})
+        return resp, 200, headers or {}
+
+    def bybit_err(code: int, msg: str, http: int = 200):
+        return jsonify({"retCode": code, "retMsg": msg, "result": {}, "retExtInfo": {}, "time": ex.now_ms()}), http
+
+    def okx_ok(data: list, code: str = "0", msg: str = ""):
+        return jsonify({"code": code, "msg": msg, "data": data})
+
+    def okx_err(http: int, code: str, msg: str):
+        return jsonify({"code": code, "msg": msg, "data": []}), http
+
+    @app.before_request
+    def _gate():
+        path = request.path
+        if path.startswith("/sim/"):
+            return None
+        venue = "okx" if path.startswith("/api/v5/") else "bybit"
+        g.venue = venue
+        with ex.lock:
+            ex.stats["requests"] += 1
+        delay = float(ex.cfg["latency_ms"]) + random.uniform(0, float(ex.cfg["jitter_ms"]))
+        if delay > 0:
+            time.sleep(delay / 1000)
+        limited, remaining, limit, reset_ms = ex.rate_limited(venue, path)
+        g.limit_headers = {"X-Bapi-Limit": str(limit), "X-Bapi-Limit-Status": str(remaining),
+                           "X-Bapi-Limit-Reset-Timestamp": str(reset_ms)} if venue == "bybit" and limit else {}
+        if limited:
+            with ex.lock:
+                ex.stats["rate_limited"] += 1
+            if venue == "bybit":
+                r, code = bybit_err(10006, "Too many visits!")
+                return r, code, g.limit_headers
+            return okx_err(429, "50011", "Too Many Requests")
+        if ex.inject_error(path):
+            with ex.lock:
+                ex.stats["errors_injected"] += 1
+            if random.random() < 0.5:
+                return "<html><body>502 Bad Gateway</body></html>", 502, {"Content-Type": "text/html"}
+            return bybit_err(10016, "Internal system error.") if venue == "bybit" else okx_err(500, "50001", "Service temporarily unavailable")
+        private = path.startswith(("/v5/order/", "/v5/position/", "/v5/execution/", "/api/v5/account/", "/api/v5/trade/"))
+        if private:
+            bad = check_bybit(ex, request) if venue == "bybit" else check_okx(ex, request)
+            if bad:
+                with ex.lock:
+                    ex.stats["bad_sign"] += 1
+                return bybit_err(*bad, http=401 if bad[0] == 10003 else 200) if venue == "bybit" else okx_err(*bad)
+        return None
+
+    @app.after_request
+    def _limit_headers(resp):
+        for k, v in (g.get("limit_headers") or {}).items():
+            resp.headers[k] = v
+        return resp
+
+    # --- Bybit: публичные ---
+    @app.get("/v5/market/time")
+    def bybit_time():
+        now = ex.now_ms()
+        return bybit_ok({"timeSecond": str(now // 1000), "timeNano": str(now * 1_000_000)})
+
+    @app.get("/v5/market/tickers")
+    def bybit_tickers():
+        sym = request.args.get("symbol")
+        with ex.lock:
+            ms = [m for (v, s), m in ex.markets.items() if v == "bybit" and (not sym or s == sym)]
+            rows = [{"symbol": m.symbol, "lastPrice": str(m.price), "markPrice": str(m.price),
+                     "bid1Price": str(m.price), "ask1Price": str(m.price)} for m in ms]
+        return bybit_ok({"category": "linear", "list": rows})
+
+    @app.get("/v5/market/instruments-info")
+    def bybit_instruments():
+        sym = request.args.get("symbol")
+        limit = int(request.args.get("limit", 500))
+        start = int(request.args.get("cursor") or 0)
+        names = [s for s in ex.symbols if not sym or s == sym]
+        page = names[start:start + limit]
+        rows = [{
+            "symbol": s, "status": "Trading", "contractType": "LinearPerpetual",
+            "lotSizeFilter": {"qtyStep": ex.symbols[s][1], "minOrderQty": ex.symbols[s][1], "maxOrderQty": "1000000"},
+            "priceFilter": {"tickSize": ex.symbols[s][2]},
+        } for s in page]
+        nxt = str(start + limit) if start + limit < len(names) else ""
+        return bybit_ok({"category": "linear", "list": rows, "nextPageCursor": nxt})
+
+    # --- Bybit: приватные ---
+    @app.post("/v5/position/set-leverage")
+    def bybit_set_leverage():
+        body = request.get_json(silent=True) or {}
+        with ex.lock:
+            m = ex.market("bybit", body.get("symbol", ""))
+            if m is None:
+                return bybit_err(10001, "params error: symbol invalid")
+            if m.leverage == str(body.get("buyLeverage")):
+                return bybit_err(110043, "leverage not modified")
+            m.leverage = str(body.get("buyLeverage"))
+        return bybit_ok({})
+
+    @app.get("/v5/position/list")
+    def bybit_positions():
+        sym = request.args.get("symbol")
+        if not sym and not request.args.get("settleCoin"):
+            return bybit_err(10001, "params error: symbol or settleCoin is required")
+        with ex.lock:
+            if sym:
+                m = ex.market("bybit", sym)
+                rows = [bybit_position_view(m)] if m else []
+            else:
+                rows = [bybit_position_view(m) for (v, _), m in ex.markets.items() if v == "bybit" and m.pos]
+        return bybit_ok({"category": "linear", "list": rows, "nextPageCursor": ""})
+
+    @app.post("/v5/order/create")
+    def bybit_create():
+        b = request.get_json(silent=True) or {}
+        with ex.lock:
+            m = ex.market("bybit", b.get("symbol", ""))
+            if m is None:
+                return bybit_err(10001, "params error: symbol invalid")
+            try:
+                qty = float(b.get("qty", 0))
+            except ValueError:
+                return bybit_err(10001, "params error: qty invalid")
+            if qty < float(ex.symbols[m.symbol][1]):
+                return bybit_err(10001, "The number of contracts is below the minimum allowed.")
+            side = "buy" if b.get("side") == "Buy" else "sell"
+            reduce_only = bool(b.get("reduceOnly") or b.get("closeOnTrigger"))
+            if reduce_only and (m.pos == 0 or (m.pos > 0) == (side == "buy")):
+                return bybit_err(110017, "current position is zero, cannot fix reduce-only order qty")
+            order = {
+                "id": ex.next_id(), "link": b.get("orderLinkId", ""), "symbol": m.symbol, "side": side,
+                "kind": "market" if b.get("orderType") == "Market" else "limit",
+                "price": float(b["price"]) if b.get("price") else None, "qty": qty,
+                "reduce_only": reduce_only, "close_on_trigger": bool(b.get("closeOnTrigger")),
+                "post_only": b.get("timeInForce") == "PostOnly", "tif": b.get("timeInForce", "GTC"),
+            }
+            if b.get("triggerPrice"):
+                trig = float(b["triggerPrice"])
+                order.update(trigger=trig, trigger_px=trig, stop_type="Stop",
+                             trigger_dir=1 if int(b.get("triggerDirection", 1)) == 1 else -1)
+            m.add(order)
+            ex.log_order("bybit", m.symbol, order)
+            if order["state"] == "filled" and (b.get("takeProfit") or b.get("stopLoss")):
+                _attach_bybit_tpsl(m, order, b)
+        return bybit_ok({"orderId": order["id"], "orderLinkId": order["link"]})
+
+    def _attach_bybit_tpsl(m: Market, entry: dict, b: dict):
+        exit_side = "sell" if entry["side"] == "buy" else "buy"
+        up = 1 if entry["side"] == "buy" else -1  # long: TP выше, SL ниже
+        qty = entry["filled"]
+        if b.get("takeProfit"):
+            tp = float(b["takeProfit"])
+            limit = b.get("tpOrderType") == "Limit"
+            m.add({"id": ex.next_id(), "link": "", "symbol": m.symbol, "side": exit_side,
+                   "kind": "limit" if limit else "market", "price": float(b.get("tpLimitPrice") or tp) if limit else None,
+                   "qty": qty, "reduce_only": True, "tied": True, "stop_type": "PartialTakeProfit",
+                   "trigger": tp, "trigger_px": tp, "trigger_dir": up})
+        if b.get("stopLoss"):
+            sl = float(b["stopLoss"])
+            m.add({"id": ex.next_id(), "link": "", "symbol": m.symbol, "side": exit_side,
+                   "kind": "market", "price": None, "qty": qty, "reduce_only": True, "tied": True,
+                   "stop_type": "PartialStopLoss", "trigger": sl, "trigger_px": sl, "trigger_dir": -up})
+
+    @app.post("/v5/order/cancel-all")
+    def bybit_cancel_all():
+        b = request.get_json(silent=True) or {}
+        flt = b.get("orderFilter")
+        with ex.lock:
+            m = ex.market("bybit", b.get("symbol", ""))
+            if m is None:
+                return bybit_err(10001, "params error: symbol invalid")
+            if flt == "StopOrder":
+                gone = m.cancel(lambda o: o.get("stop_type"))
+            elif flt == "Order":
+                gone = m.cancel(lambda o: not o.get("stop_type"))
+            else:
+                gone = m.cancel(lambda o: True)
+        return bybit_ok({"list": [{"orderId": o["id"], "orderLinkId": o.get("link", "")} for o in gone], "success": "1"})
+
+    @app.get("/v5/order/realtime")
+    def bybit_realtime():
+        sym = request.args.get("symbol")
+        if not sym and not request.args.get("settleCoin"):
+            return bybit_err(10001, "params error: symbol or settleCoin is required")
+        with ex.lock:
+            rows = [bybit_order_view(o) for (v, s), m in ex.markets.items()
+                    if v == "bybit" and (not sym or s == sym) for o in m.orders]
+        return bybit_ok({"category": "linear", "list": rows, "nextPageCursor": ""})
+
+    @app.get("/v5/execution/list")
+    def bybit_executions():
+        # как на бирже: без startTime — последние 7 дней, окно не длиннее 7 дней, новые первыми
+        week = 7 * 86400 * 1000
+        sym = request.args.get("symbol")
+        start = int(request.args.get("startTime") or 0) or _ms() - week
+        end = int(request.args.get("endTime") or 0) or start + week
+        limit = min(100, int(request.args.get("limit", 50)))
+        offset = int(request.args.get("cursor") or 0)
+        with ex.lock:
+            rows = [e for (v, s), m in ex.markets.items() if v == "bybit" and (not sym or s == sym)
+                    for e in m.execs if start <= int(e["execTime"]) <= end]
+        rows.sort(key=lambda e: int(e["execTime"]), reverse=True)
+        nxt = str(offset + limit) if offset + limit < len(rows) else ""
+        return bybit_ok({"category": "linear", "list": rows[offset:offset + limit], "nextPageCursor": nxt})
+
+    @app.get("/v5/order/history")
+    def bybit_history():
+        limit = int(request.args.get("limit", 20))
+        with ex.lock:
+            m = ex.market("bybit", request.args.get("symbol", ""))
+            rows = [bybit_order_view(o) for o in reversed(m.history[-limit:])] if m else []
+        return bybit_ok({"category": "linear", "list": rows, "nextPageCursor": ""})
+
+    # --- OKX: публичные ---
+    @app.get("/api/v5/public/time")
+    def okx_time():
+        return okx_ok([{"ts": str(ex.now_ms())}])
+
+    @app.get("/api/v5/public/instruments")
+    def okx_instruments():
+        inst = request.args.get("instId")
+        rows = []
+        for sym, (_px, step, tick) in ex.symbols.items():
+            iid = okx_inst_id(sym)
+            if inst and inst != iid:
+                continue
+            rows.append({"instId": iid, "instType": "SWAP", "ctVal": step, "lotSz": "0.01", "minSz": "0.01",
+                         "tickSz": tick, "state": "live", "settleCcy": "USDT"})
+        return okx_ok(rows)
+
+    # --- OKX: приватные ---
+    @app.get("/api/v5/account/config")
+    def okx_config():
+        return okx_ok([{"posMode": "net_mode", "acctLv": "2"}])
+
+    @app.post("/api/v5/account/set-leverage")
+    def okx_set_leverage():
+        b = request.get_json(silent=True) or {}
+        with ex.lock:
+            m = ex.market("okx", b.get("instId", ""))
+            if m is None:
+                return okx_ok([], "51001", "Instrument ID does not exist")
+            m.leverage = str(b.get("lever"))
+        return okx_ok([{"lever": m.leverage, "mgnMode": b.get("mgnMode", "cross"), "instId": m.symbol, "posSide": "net"}])
+
+    @app.get("/api/v5/account/positions")
+    def okx_positions():
+        inst = request.args.get("instId")
+        with ex.lock:
+            rows = [okx_position_view(m) for (v, s), m in ex.markets.items()
+                    if v == "okx" and m.pos and (not inst or s == inst)]
+        return okx_ok(rows)
+
+    @app.get("/api/v5/trade/orders-pending")
+    def okx_orders_pending():
+        inst = request.args.get("instId")
+        with ex.lock:
+            rows = [{"ordId": o["id"], "clOrdId": o.get("link", ""), "instId": s, "side": o["side"],
+                     "ordType": "limit", "px": str(o["price"]), "sz": str(o["qty"]), "state": "live"}
+                    for (v, s), m in ex.markets.items() if v == "okx" and (not inst or s == inst)
+                    for o in m.orders if not o.get("algo")]
+        return okx_ok(rows)
+
+    @app.get("/api/v5/trade/orders-algo-pending")
+    def okx_algo_pending():
+        inst = request.args.get("instId")
+        types = [t for t in request.args.get("ordType", "").split(",") if t]
+        if not types:
+            return okx_ok([], "51000", "Parameter ordType error")
+        with ex.lock:
+            rows = [dict(a, state="live") for a in ex.okx_algos.values()
+                    if (not inst or a["instId"] == inst) and a["ordType"] in types
+                    and any(o.get("group") == a["algoId"] for o in ex.markets[("okx", a["instId"])].orders)]
+        return okx_ok(rows)
+
+    @app.post("/api/v5/trade/order")
+    def okx_order():
+        b = request.get_json(silent=True) or {}
+        with ex.lock:
+            m = ex.market("okx", b.get("instId", ""))
+            if m is None:
+                return okx_ok([{"ordId": "", "sCode": "51001", "sMsg": "Instrument ID does not exist"}], "1", "")
+            try:
+                sz = float(b.get("sz", 0))
+            except ValueError:
+                sz = 0.0
+            if sz < 0.01:
+                return okx_ok([{"ordId": "", "clOrdId": b.get("clOrdId", ""), "sCode": "51008", "sMsg": "Order failed. Insufficient size"}], "1", "")
+            side = b.get("side", "buy")
+            order = {"id": ex.next_id(), "link": b.get("clOrdId", ""), "symbol": m.symbol, "side": side,
+                     "kind": "market" if b.get("ordType") == "market" else "limit",
+                     "price": float(b["px"]) if b.get("px") else None, "qty": sz,
+                     "reduce_only": str(b.get("reduceOnly", "")).lower() == "true"}
+            m.add(order)
+            ex.log_order("okx", m.symbol, order)
+            if order["state"] == "filled":
+                for att in b.get("attachAlgoOrds") or []:
+                    _attach_okx_algo(m, order, att)
+        return okx_ok([{"ordId": order["id"], "clOrdId": order["link"], "tag": "", "sCode": "0", "sMsg": "Order placed"}])
+
+    def _attach_okx_algo(m: Market, entry: dict, att: dict):
+        algo_id = ex.next_id()
+        exit_side = "sell" if entry["side"] == "buy" else "buy"
+        up = 1 if entry["side"] == "buy" else -1
+        base = {"symbol": m.symbol, "side": exit_side, "qty": entry["filled"], "reduce_only": True,
+                "tied": True, "algo": True, "group": algo_id}
+        legs = []
+        for kind, d in (("tp", up), ("sl", -up)):
+            trig = att.get(f"{kind}TriggerPx")
+            if not trig:
+                continue
+            px = att.get(f"{kind}OrdPx", "-1")
+            legs.append(dict(base, id=ex.next_id(), kind="market" if px in ("-1", -1) else "limit",
+                             price=None if px in ("-1", -1) else float(px),
+                             trigger=float(trig), trigger_px=float(trig), trigger_dir=d))
+        for leg in legs:
+            m.add(leg)
+        ex.okx_algos[algo_id] = {
+            "algoId": algo_id, "instId": m.symbol, "ordType": "oco" if len(legs) == 2 else "conditional",
+            "side": exit_side, "sz": str(entry["filled"]), "attachAlgoClOrdId": att.get("attachAlgoClOrdId", ""),
+            "tpTriggerPx": att.get("tpTriggerPx", ""), "tpOrdPx": att.get("tpOrdPx", ""),
+            "slTriggerPx": att.get("slTriggerPx", ""), "slOrdPx": att.get("slOrdPx", ""),
+            "ordId": entry["id"],
+        }
+
+    # --- управление симулятором ---
+    @app.post("/sim/price")
+    def sim_price():
+        b = request.get_json(silent=True) or {}
+        ex.set_price(str(b.get("symbol", "")).upper(), float(b.get("price", 0)))
+        return jsonify(ex.state())
+
+    @app.post("/sim/config")
+    def sim_config():
+        b = request.get_json(silent=True) or {}
+        with ex.lock:
+            for k, v in b.items():
+                if k in ex.cfg:
+                    ex.cfg[k] = v
+        return jsonify(ex.cfg)
+
+    @app.post("/sim/reset")
+    def sim_reset():
+        ex.reset()
+        return jsonify({"ok": True})
+
+    @app.get("/sim/orders")
+    def sim_orders():
+        with ex.lock:
+            return jsonify(list(ex.order_log))
+
+    @app.get("/sim/state")
+    def sim_state():
+        return jsonify(ex.state())
+
+    return app
+
+def serve(ex: Exchange, host: str = "127.0.0.1", port: int = 0):
+    """Запуск в фоне (для бенчмарков / нагрузочных тестов). -> (server, base_url)."""
+    from werkzeug.serving import make_server
+    srv = make_server(host, port, create_app(ex), threaded=True)
+    threading.Thread(target=srv.serve_forever, name="exchange-sim", daemon=True).start()
+    threading.Thread(target=ex.walk, name="exchange-sim-walk", daemon=True).start()
+    return srv, f"http://{host}:{srv.server_port}"
+
+def _parse_symbols(txt: str) -> dict:
+    """'BTCUSDT=60000:0.001:0.1,ETHUSDT=3000' → {symbol: (price, step, tick)}."""
+    out = {}
+    for part in (txt or "").split(","):
+        if "=" not in part:
+            continue
+        sym, spec = part.split("=", 1)
+        bits = spec.split(":")
+        d = DEFAULT_SYMBOLS.get(sym.strip().upper(), (0.0, "0.001", "0.01"))
+        out[sym.strip().upper()] = (float(bits[0]), bits[1] if len(bits) > 1 else d[1], bits[2] if len(bits) > 2 else d[2])
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="Local Bybit v5 / OKX v5 REST simulator")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9000)
+    ap.add_argument("--symbols", default="", help="BTCUSDT=60000:0.001:0.1,... (по умолчанию — встроенный набор)")
+    ap.add_argument("--bybit-key", default=os.getenv("BYBIT_API_KEY", ""))
+    ap.add_argument("--bybit-secret", default=os.getenv("BYBIT_API_SECRET", ""))
+    ap.add_argument("--okx-key", default=os.getenv("OKX_API_KEY", ""))
+    ap.add_argument("--okx-secret", default=os.getenv("OKX_API_SECRET", ""))
+    ap.add_argument("--okx-passphrase", default=os.getenv("OKX_PASSPHRASE", ""))
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--rate-limit", type=int, default=0, help="запросов/с на эндпоинт, 0 — без лимита")
+    ap.add_argument("--clock-skew-ms", type=int, default=0)
+    ap.add_argument("--walk-bps", type=float, default=0.0, help="случайное блуждание цены, б.п. за тик")
+    ap.add_argument("--tick-sec", type=float, default=1.0)
+    a = ap.parse_args()
+    ex = Exchange(_parse_symbols(a.symbols) or None, a.bybit_key, a.bybit_secret, a.okx_key, a.okx_secret,
+                  a.okx_passphrase, a.latency_ms, a.jitter_ms, a.error_rate, a.rate_limit, a.clock_skew_ms,
+                  a.walk_bps, a.tick_sec)
+    threading.Thread(target=ex.walk, name="exchange-sim-walk", daemon=True).start()
+    print(f"🧪 exchange simulator on http://{a.host}:{a.port} ({', '.join(ex.symbols)})")
+    create_app(ex).run(host=a.host, port=a.port, threaded=True, use_reloader=False)
+
+if __name__ == "__main__":
+    main()
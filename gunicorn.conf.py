@@ -0,0 +1,15 @@
+# gunicorn.conf.py — gunicorn подхватывает его сам из рабочего каталога (`gunicorn app:app`,
+# `gunicorn okx_app:app`; из другого каталога — `-c /path/gunicorn.conf.py`).
+#
+# __main__ приложения под gunicorn не выполняется, а потоки мастера не переживают fork:
+# без этого хука справочники инструментов, часы биржи, стримы и мониторы не стартовали,
+# и первый вебхук воркера грузил справочники обеих площадок прямо внутри сделки.
+# post_worker_init вызывается в каждом воркере после загрузки приложения, до первого запроса.
+
+import sys
+
+def post_worker_init(worker):
+    module = sys.modules.get(getattr(worker.wsgi, "import_name", ""))
+    start = getattr(module, "start_background", None)
+    if start is not None:
+        start()
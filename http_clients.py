@@ -0,0 +1,135 @@
+# http_clients.py — общий слой исходящих HTTP-вызовов (Bybit / OKX / Telegram)
+#
+# Один requests.Session на площадку и на процесс: keep-alive, пул соединений,
+# без повторного DNS/TCP/TLS на каждый сигнал. Таймауты задаются по эндпоинтам.
+
+import os, time, threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics, rate_limit, resilience, tracing
+
+# gunicorn --threads N: каждый поток может держать своё соединение к площадке
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", "8"))
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "2"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", str(max(10, GUNICORN_THREADS * 2))))
+
+VENUES = ("bybit", "okx", "telegram")
+
+# (connect, read) по префиксу пути; побеждает самый длинный совпавший префикс
+TIMEOUTS = {
+    "bybit": {
+        "": (3, 10),
+        "/v5/order/create": (3, 6),
+        "/v5/order/cancel-all": (3, 6),
+        "/v5/position/": (3, 5),
+        "/v5/market/": (3, 5),
+    },
+    "okx": {
+        "": (3, 10),
+        "/api/v5/trade/order": (3, 6),
+        "/api/v5/trade/": (3, 5),
+        "/api/v5/account/": (3, 5),
+        "/api/v5/public/": (3, 8),
+    },
+    "telegram": {
+        "": (3, 8),
+        "/sendDocument": (3, 20),
+    },
+}
+
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+def _new_session(venue: str) -> requests.Session:
+    s = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        pool_block=False,
+        max_retries=0,
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers.update({"Connection": "keep-alive", "User-Agent": f"tv-autotrade/{venue}"})
+    return s
+
+def session(venue: str) -> requests.Session:
+    """
+    Возвращает пул для площадки. Пересоздаётся после fork (gunicorn),
+    чтобы воркеры не делили сокеты мастера.
+    """
+    global _sessions_pid
+    pid = os.getpid()
+    s = _sessions.get(venue) if _sessions_pid == pid else None
+    if s is not None:
+        return s
+    with _sessions_lock:
+        if _sessions_pid != pid:
+            _sessions.clear()
+            _sessions_pid = pid
+        s = _sessions.get(venue)
+        if s is None:
+            s = _new_session(venue)
+            _sessions[venue] = s
+        return s
+
+def timeout_for(venue: str, path: str):
+    table = TIMEOUTS.get(venue) or {"": (3, 10)}
+    best = ""
+    for key in table:
+        if not key:
+            continue
+        # путь у Telegram вида /bot<token>/sendMessage — матчим по хвосту
+        hit = path.endswith(key) if venue == "telegram" else path.startswith(key)
+        if hit and len(key) > len(best):
+            best = key
+    return table.get(best, (3, 10))
+
+def endpoint_label(venue: str, path: str) -> str:
+    # у Telegram в пути токен бота — в метки идёт только метод API
+    return "/" + path.rsplit("/", 1)[-1] if venue == "telegram" else path
+
+def http_request(venue: str, method: str, url: str, timeout=None, limit: bool = True, **kwargs) -> requests.Response:
+    """limit=False — токен лимитера уже взят вызывающим (подписанные запросы берут его до подписи)."""
+    path = urlsplit(url).path
+    if timeout is None:
+        timeout = timeout_for(venue, path)
+    endpoint = endpoint_label(venue, path)
+    breaker = resilience.breaker(venue)
+    if breaker is not None:
+        breaker.check()  # открыт — CircuitOpen сразу, без запроса
+    sp = tracing.span("http", venue=venue, method=method, endpoint=endpoint)
+    # ожидание токена лимитера — в спане, но не во времени ответа биржи
+    waited = rate_limit.acquire(venue, path) if limit else 0.0
+    if waited and sp:
+        sp.set(rate_limit_wait=round(waited, 4))
+    t0 = time.perf_counter()
+    code = "error"
+    try:
+        r = session(venue).request(method, url, timeout=timeout, **kwargs)
+        rate_limit.observe(venue, path, r)
+        if breaker is not None:
+            breaker.record(not resilience.server_failure(venue, r))
+        code = str(r.status_code)
+        if sp:
+            sp.set(**tracing.response_codes(r.text))
+        return r
+    except Exception as e:
+        if breaker is not None and isinstance(e, requests.RequestException):
+            breaker.record(False)
+        sp.set(error=type(e).__name__)
+        raise
+    finally:
+        metrics.exchange_request_seconds.observe(time.perf_counter() - t0, venue, method, endpoint)
+        metrics.exchange_requests_total.inc(venue, endpoint, code)
+        sp.end(status=code)
+
+def http_get(venue: str, url: str, **kwargs) -> requests.Response:
+    return http_request(venue, "GET", url, **kwargs)
+
+def http_post(venue: str, url: str, **kwargs) -> requests.Response:
+    return http_request(venue, "POST", url, **kwargs)
@@ -0,0 +1,107 @@
+# idempotency.py — повторная доставка вебхука (ретраи TradingView, рестарты) не доходит до биржи
+#
+# Ключ — sha256(маршрут | время бара | канонический JSON тела). Время бара — поле
+# bar_time/time из тела, иначе текущее время, округлённое вниз до tf сигнала: тот же
+# алерт в пределах того же бара — повтор. Поиск O(1): сначала LRU процесса
+# (IDEMPOTENCY_LRU_SIZE, только «уже видели»), при промахе — атомарный claim в
+# shared_state (sqlite по умолчанию: общий для воркеров и переживает рестарт).
+# Ключ живёт IDEMPOTENCY_TTL_SEC. Если обработка закончилась 5xx, ключ снимается,
+# и ретрай отправителя пройдёт заново.
+
+import os, re, json, time, hashlib, threading
+from collections import OrderedDict
+
+from flask import g, has_request_context
+
+import metrics, shared_state
+
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_TTL_SEC = float(os.getenv("IDEMPOTENCY_TTL_SEC", "3600"))
+IDEMPOTENCY_LRU_SIZE = int(os.getenv("IDEMPOTENCY_LRU_SIZE", "10000"))
+
+_store = shared_state.default()
+_seen = OrderedDict()  # key -> expires
+_seen_lock = threading.Lock()
+
+deliveries_total = metrics.Counter(
+    "webhook_deliveries_total", "Webhook deliveries by idempotency outcome", ("route", "result"))
+
+# tf TradingView: "1", "3", "15", "60", "1m", "4h", "D", "1W"; без единицы — минуты
+_TF_RE = re.compile(r"^(\d*)([smhdw]?)$", re.I)
+_TF_UNIT = {"": 60, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+def bar_seconds(tf) -> int:
+    m = _TF_RE.match(str(tf or "").strip())
+    if not m or not (m.group(1) or m.group(2)):
+        return 60
+    return max(1, int(m.group(1) or 1) * _TF_UNIT[m.group(2).lower()])
+
+def bar_time(body: dict, tf) -> int:
+    """Время бара (мс): из тела, иначе начало текущего бара tf."""
+    for field in ("bar_time", "time"):
+        try:
+            return int(body[field])
+        except (KeyError, TypeError, ValueError):
+            pass
+    step = bar_seconds(tf)
+    return int(time.time() // step * step) * 1000
+
+def delivery_key(route: str, body, tf=None) -> str:
+    if isinstance(body, dict):
+        canon = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        bar = bar_time(body, tf)
+    else:
+        canon = body.decode("utf-8", "replace") if isinstance(body, bytes) else str(body)
+        bar = bar_time({}, tf)
+    return hashlib.sha256(f"{route}|{bar}|{canon}".encode()).hexdigest()
+
+def _remember(key: str, expires: float):
+    with _seen_lock:
+        _seen[key] = expires
+        _seen.move_to_end(key)
+        while len(_seen) > IDEMPOTENCY_LRU_SIZE:
+            _seen.popitem(last=False)
+
+def claim(route: str, body, tf=None):
+    """Ключ доставки, если она первая; None — повтор (отвечать, ничего не делая)."""
+    if not IDEMPOTENCY_ENABLED:
+        return ""
+    key = delivery_key(route, body, tf)
+    now = time.time()
+    with _seen_lock:
+        expires = _seen.get(key)
+        if expires is not None and expires <= now:
+            del _seen[key]
+            expires = None
+    if expires is None:
+        if _store.claim(f"idem:{key}", IDEMPOTENCY_TTL_SEC):
+            _remember(key, now + IDEMPOTENCY_TTL_SEC)
+            deliveries_total.inc(route, "new")
+            if has_request_context():
+                g.idempotency_key = key
+            return key
+        _remember(key, now + _store.ttl(f"idem:{key}"))
+    deliveries_total.inc(route, "duplicate")
+    return None
+
+def forget(key: str):
+    """Снять ключ: следующая такая же доставка будет обработана."""
+    if not key:
+        return
+    with _seen_lock:
+        _seen.pop(key, None)
+    _store.release(f"idem:{key}")
+
+def init_app(app):
+    """5xx или исключение в обработчике — ключ снимается, ретрай отправителя пройдёт."""
+
+    @app.after_request
+    def _idempotency_release(resp):
+        if resp.status_code >= 500:
+            forget(g.pop("idempotency_key", None))
+        return resp
+
+    @app.teardown_request
+    def _idempotency_release_exc(exc):
+        if exc is not None:
+            forget(g.pop("idempotency_key", None))
@@ -0,0 +1,144 @@
+# ingest.py — быстрый приём сигналов: 202 сразу, исполнение — в пуле с очередью на символ
+#
+# При INGEST_ASYNC=true вебхук проверяет секрет и тело, пишет сигнал в trade_journal
+# (таблица signals) и отвечает 202 {"status": "accepted", "signal_id": ...} за
+# миллисекунды. Обработчик сигнала (тот же, что в синхронном режиме) выполняется в
+# пуле: сигналы одного символа — строго по очереди, разных символов — параллельно.
+# Итоговый статус — GET /signal/<id> (из любого воркера gunicorn: таблица общая).
+#
+# Очередь живёт в памяти процесса: сигналы, не успевшие выполниться до рестарта,
+# остаются в таблице в состоянии queued.
+
+import os, json, time, logging, secrets, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g, jsonify
+
+import jsonlog, metrics, trade_journal, tracing
+
+INGEST_ASYNC = os.getenv("INGEST_ASYNC", "false").lower() == "true"
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "8"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "1000"))
+INGEST_KEEP_SEC = float(os.getenv("INGEST_KEEP_SEC", str(7 * 86400)))
+_PRUNE_EVERY_SEC = 3600
+
+class KeyedExecutor:
+    """Пул потоков, где задачи с одним ключом идут строго по очереди (по одной за раз)."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool = None
+        self._pid = None
+        self._queues = {}  # key -> deque задач, ждущих за выполняющейся
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest")
+                    self._queues.clear()
+                    self._pending = 0
+                    self._pid = pid
+        return self._pool
+
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(self, key, fn) -> bool:
+        """False — очередь переполнена (INGEST_MAX_PENDING)."""
+        pool = self._executor()
+        with self._lock:
+            if self._pending >= INGEST_MAX_PENDING:
+                return False
+            self._pending += 1
+            q = self._queues.get(key)
+            if q is not None:
+                q.append(fn)
+                return True
+            self._queues[key] = deque()
+        pool.submit(self._run, key, fn)
+        return True
+
+    def _run(self, key, fn):
+        try:
+            fn()
+        except Exception as e:
+            jsonlog.event(f"❌ ingest {key}: {e}", logging.ERROR)
+        with self._lock:
+            self._pending -= 1
+            q = self._queues.get(key)
+            if not q:
+                self._queues.pop(key, None)
+                return
+            nxt = q.popleft()
+        # следующая задача ключа — снова в общую очередь пула, чтобы длинная очередь
+        # одного символа не держала поток в ущерб остальным
+        self._pool.submit(self._run, key, nxt)
+
+executor = KeyedExecutor(INGEST_WORKERS)
+_last_prune = 0.0
+
+metrics.Gauge("ingest_pending", "Signals accepted but not yet executed", executor.pending)
+
+def accept(route: str, symbol: str, payload: dict, handler):
+    """
+    handler(payload, sw) — обработчик вебхука, возвращает то же, что Flask-view.
+    Возвращает ответ Flask: 202 с signal_id, 400 без символа, 503 при переполнении.
+    """
+    if not symbol:
+        return jsonify({"status": "bad_payload"}), 400
+    sig_id = secrets.token_hex(8)
+    received = time.time()
+    trace = g.get("trace")
+    ctx = (trace.trace, trace.id) if trace else None
+    app = current_app._get_current_object()
+    trade_journal.record_signal(sig_id, route, symbol, received, ctx[0] if ctx else None,
+                                json.dumps(payload, ensure_ascii=False, default=str))
+    job = lambda: _execute(app, sig_id, route, payload, handler, ctx, received)
+    if not executor.submit((route, symbol), job):
+        trade_journal.update_signal(sig_id, state="rejected", status="overloaded", finished=time.time())
+        return jsonify({"status": "overloaded", "signal_id": sig_id}), 503
+    return jsonify({"status": "accepted", "signal_id": sig_id}), 202, {"Location": f"/signal/{sig_id}"}
+
+def _execute(app, sig_id: str, route: str, payload: dict, handler, ctx, received: float):
+    started = time.time()
+    metrics.stage_seconds.observe(started - received, route, "queued")
+    trade_journal.update_signal(sig_id, state="running", started=started)
+    try:
+        with tracing.attach(ctx), app.app_context():
+            resp = app.make_response(handler(payload, metrics.Stopwatch(route)))
+        body = resp.get_json(silent=True) or {}
+        status = body.get("status") or f"http_{resp.status_code}"
+        state = "done"
+    except Exception as e:
+        jsonlog.event(f"❌ ingest {route} {sig_id}: {e}", logging.ERROR)
+        body, status, state = {"error": str(e)}, "error", "error"
+    metrics.webhook_status_total.inc(route, status)
+    trade_journal.update_signal(sig_id, state=state, status=status, finished=time.time(),
+                                result=json.dumps(body, ensure_ascii=False, default=str))
+    _maybe_prune()
+
+def _maybe_prune():
+    global _last_prune
+    now = time.time()
+    if now - _last_prune < _PRUNE_EVERY_SEC:
+        return
+    _last_prune = now
+    try:
+        trade_journal.prune_signals(now - INGEST_KEEP_SEC)
+    except Exception as e:
+        jsonlog.event(f"⚠️ ingest prune: {e}", logging.WARNING)
+
+def signal_status(sig_id: str):
+    """Ответ для GET /signal/<id>."""
+    rec = trade_journal.get_signal(sig_id)
+    if rec is None:
+        return jsonify({"status": "not_found"}), 404
+    for k in ("payload", "result"):
+        if rec.get(k):
+            rec[k] = json.loads(rec[k])
+    return jsonify(rec), 200
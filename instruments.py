@@ -0,0 +1,167 @@
+# instruments.py — единый реестр инструментов (Bybit linear + OKX SWAP)
+#
+# Все инструменты грузятся пачкой при старте (снапшот с диска → быстрый холодный
+# старт), потом обновляются в фоне раз в INSTRUMENTS_TTL_SEC. Поиск — O(1) по dict,
+# поэтому расчёт размера позиции не ходит в сеть на горячем пути.
+
+import os, time, json, logging, threading
+
+import jsonlog, rate_limit
+from http_clients import http_get
+
+BYBIT_BASE_URL = os.getenv("BYBIT_BASE_URL", "https://api.bybit.com")
+OKX_BASE_URL = os.getenv("OKX_BASE_URL", "https://www.okx.com")
+
+INSTRUMENTS_TTL_SEC = int(os.getenv("INSTRUMENTS_TTL_SEC", "3600"))
+INSTRUMENTS_SNAPSHOT = os.getenv("INSTRUMENTS_SNAPSHOT", "/tmp/instruments_snapshot.json")
+
+_BYBIT_FIELDS = ("qtyStep", "minOrderQty", "maxOrderQty")
+_OKX_FIELDS = ("ctVal", "lotSz", "minSz", "tickSz", "state")
+
+_bybit = {}   # symbol -> {"qtyStep", "minOrderQty", "maxOrderQty", "tickSize"}
+_okx = {}     # instId -> {"ctVal", "lotSz", "minSz", "tickSz", "state"}
+_loaded_at = {"bybit": 0.0, "okx": 0.0}
+_lock = threading.Lock()
+_started_pid = None
+
+# =============== ЗАГРУЗКА ===============
+def _bybit_entry(info: dict) -> dict:
+    lot = info.get("lotSizeFilter") or {}
+    price = info.get("priceFilter") or {}
+    entry = {k: str(lot[k]) for k in _BYBIT_FIELDS if lot.get(k) not in (None, "")}
+    if price.get("tickSize"):
+        entry["tickSize"] = str(price["tickSize"])
+    return entry
+
+def _okx_entry(info: dict) -> dict:
+    return {k: str(info[k]) for k in _OKX_FIELDS if info.get(k) not in (None, "")}
+
+def fetch_bybit(symbol: str = None) -> dict:
+    """Все linear-инструменты Bybit (постранично через nextPageCursor) или один символ."""
+    url = BYBIT_BASE_URL.rstrip("/") + "/v5/market/instruments-info"
+    params = {"category": "linear", "limit": 1000}
+    if symbol:
+        params["symbol"] = symbol
+    out = {}
+    for _ in range(50):
+        r = http_get("bybit", url, params=params).json()
+        result = r.get("result") or {}
+        for info in result.get("list") or []:
+            if info.get("symbol"):
+                out[info["symbol"]] = _bybit_entry(info)
+        cursor = result.get("nextPageCursor")
+        if symbol or not cursor:
+            break
+        params["cursor"] = cursor
+    return out
+
+def fetch_okx(inst_id: str = None) -> dict:
+    """Все SWAP-инструменты OKX одним запросом или один instId."""
+    params = {"instType": "SWAP"}
+    if inst_id:
+        params["instId"] = inst_id
+    r = http_get("okx", OKX_BASE_URL.rstrip("/") + "/api/v5/public/instruments", params=params).json()
+    return {
+        info["instId"]: _okx_entry(info)
+        for info in (r.get("data") or [])
+        if info.get("instId")
+    }
+
+def refresh(venue: str = None):
+    for name, fetch, store in (("bybit", fetch_bybit, _bybit), ("okx", fetch_okx, _okx)):
+        if venue and venue != name:
+            continue
+        try:
+            fresh = fetch()
+        except Exception as e:
+            jsonlog.event(f"⚠️ instruments refresh {name} failed: {e}", logging.WARNING)
+            continue
+        if not fresh:
+            jsonlog.event(f"⚠️ instruments refresh {name}: пустой ответ, оставляю старые данные", logging.WARNING)
+            continue
+        with _lock:
+            store.clear()
+            store.update(fresh)
+            _loaded_at[name] = time.time()
+        jsonlog.event(f"📚 instruments {name}: {len(fresh)} loaded")
+    save_snapshot()
+
+# =============== СНАПШОТ ===============
+def save_snapshot(path: str = None):
+    path = path or INSTRUMENTS_SNAPSHOT
+    with _lock:
+        data = {"bybit": dict(_bybit), "okx": dict(_okx), "loaded_at": dict(_loaded_at)}
+    try:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+    except Exception as e:
+        jsonlog.event(f"⚠️ instruments snapshot save failed: {e}", logging.WARNING)
+
+def load_snapshot(path: str = None) -> bool:
+    path = path or INSTRUMENTS_SNAPSHOT
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        jsonlog.event(f"⚠️ instruments snapshot broken: {e}", logging.WARNING)
+        return False
+    with _lock:
+        _bybit.update(data.get("bybit") or {})
+        _okx.update(data.get("okx") or {})
+        for k, v in (data.get("loaded_at") or {}).items():
+            _loaded_at[k] = float(v)
+    jsonlog.event(f"📚 instruments snapshot: bybit={len(_bybit)} okx={len(_okx)}")
+    return True
+
+# =============== ФОН ===============
+def _refresh_loop():
+    rate_limit.mark_background()
+    while True:
+        oldest = min(_loaded_at.values())
+        time.sleep(max(30.0, oldest + INSTRUMENTS_TTL_SEC - time.time()))
+        refresh()
+
+def start():
+    """Идемпотентно: снапшот → (синхронная загрузка, если снапшота нет) → фоновый рефреш. Один раз на процесс."""
+    global _started_pid
+    pid = os.getpid()
+    if _started_pid == pid:
+        return
+    with _lock:
+        if _started_pid == pid:
+            return
+        _started_pid = pid
+    if not load_snapshot():
+        refresh()
+    threading.Thread(target=_refresh_loop, daemon=True).start()
+
+# =============== ПОИСК ===============
+def bybit_instrument(symbol: str) -> dict:
+    """qtyStep / minOrderQty / tickSize для linear-символа. Сеть — только для неизвестного символа."""
+    start()
+    info = _bybit.get(symbol)
+    if info is None:
+        fresh = fetch_bybit(symbol)
+        with _lock:
+            _bybit.update(fresh)
+        info = fresh.get(symbol)
+        if info is None:
+            raise RuntimeError(f"Нет данных по инструменту {symbol}")
+    return info
+
+def okx_instrument(inst_id: str) -> dict:
+    """ctVal / lotSz / minSz / tickSz для SWAP. Сеть — только для неизвестного instId."""
+    start()
+    info = _okx.get(inst_id)
+    if info is None:
+        fresh = fetch_okx(inst_id)
+        with _lock:
+            _okx.update(fresh)
+        info = fresh.get(inst_id)
+        if info is None:
+            raise RuntimeError(f"Нет данных по инструменту {inst_id}")
+    return info
@@ -0,0 +1,145 @@
+# jsonlog.py — структурные JSON-логи через неблокирующую очередь
+#
+# Вебхук кладёт запись в QueueHandler и идёт дальше; в stdout пишет фоновый
+# QueueListener. Полные дампы запросов (тело, args, заголовки) — только по
+# выборке LOG_SAMPLE (на маршрут) или при включённом verbose (переключается
+# на лету через /debug/verbose). Секреты маскируются по списку LOG_REDACT: в разобранных
+# полях — по ключу; сырое тело пишется, только если оно не JSON, и тогда маскируются
+# пары key=value / "key": value. Все сообщения сервиса (бывшие print) — тоже JSON через
+# event() с уровнем; print остаётся только в CLI-утилитах (bench, loadtest, tracing).
+
+import os, re, sys, json, queue, random, atexit, logging, threading
+from logging.handlers import QueueHandler, QueueListener
+
+import tracing
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "webhook=0.01,webhook_okx=0.05" — доля запросов с полным дампом; "*" — по умолчанию
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "*=0")
+LOG_REDACT = os.getenv(
+    "LOG_REDACT",
+    "key,secret,token,passphrase,authorization,cookie,x-bapi-api-key,x-bapi-sign,ok-access-key,ok-access-sign,ok-access-passphrase",
+)
+LOG_VERBOSE = os.getenv("LOG_VERBOSE", "false").lower() == "true"
+
+_REDACTED = "***"
+_redact_keys = {k.strip().lower() for k in LOG_REDACT.split(",") if k.strip()}
+# key=value (форма, query) и "key": "value" / 'key': value (JSON-подобный текст)
+_redact_text_re = re.compile(
+    r"""(["']?\b(?:%s)["']?\s*[:=]\s*)("[^"]*"|'[^']*'|[^\s&,;}]+)""" % "|".join(map(re.escape, sorted(_redact_keys))),
+    re.I,
+) if _redact_keys else None
+_verbose = LOG_VERBOSE
+
+def _parse_rates(txt: str) -> dict:
+    rates = {}
+    for part in txt.split(","):
+        if "=" not in part:
+            continue
+        route, rate = part.split("=", 1)
+        try:
+            rates[route.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+_sample_rates = _parse_rates(LOG_SAMPLE)
+
+# =============== ФОРМАТ ===============
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update(fields)
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+logger = logging.getLogger("tv")
+logger.propagate = False
+logger.setLevel(LOG_LEVEL)
+
+_listener = None
+_listener_pid = None
+_setup_lock = threading.Lock()
+
+def setup():
+    """Один QueueListener на процесс (после fork gunicorn — новый)."""
+    global _listener, _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _setup_lock:
+        if _listener_pid == pid:
+            return
+        q = queue.Queue(maxsize=10000)
+        for h in list(logger.handlers):
+            logger.removeHandler(h)
+        logger.addHandler(QueueHandler(q))
+        out = logging.StreamHandler(sys.stdout)
+        out.setFormatter(JsonFormatter())
+        _listener = QueueListener(q, out, respect_handler_level=False)
+        _listener.start()
+        _listener_pid = pid
+
+def _stop():
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+atexit.register(_stop)
+
+# =============== API ===============
+def event(msg: str, level: int = logging.INFO, **fields):
+    setup()
+    if logger.isEnabledFor(level):
+        trace = tracing.trace_id()
+        if trace:
+            fields["trace"] = trace
+        logger.log(level, msg, extra={"fields": redact(fields)})
+
+def redact(obj):
+    if isinstance(obj, dict):
+        return {k: (_REDACTED if str(k).lower() in _redact_keys else redact(v)) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [redact(v) for v in obj]
+    return obj
+
+def redact_text(text: str) -> str:
+    """Маскировка секретов в сыром тексте (тело не JSON)."""
+    return _redact_text_re.sub(lambda m: m.group(1) + _REDACTED, text) if _redact_text_re else text
+
+def set_verbose(on: bool):
+    global _verbose
+    _verbose = bool(on)
+
+def is_verbose() -> bool:
+    return _verbose
+
+def sampled(route: str) -> bool:
+    if _verbose:
+        return True
+    rate = _sample_rates.get(route, _sample_rates.get("*", 0.0))
+    return rate > 0 and random.random() < rate
+
+def log_request(route: str, req, parsed: dict = None):
+    """Полный дамп запроса — только по выборке/verbose; иначе одна короткая строка уровня DEBUG."""
+    if sampled(route):
+        try:
+            body = req.get_json(silent=True)
+            fields = {"json": body} if body is not None else {"body": redact_text(req.get_data(as_text=True)[:4000])}
+            event(
+                "webhook_received", route=route,
+                args=dict(req.args),
+                headers=dict(req.headers.items()),
+                parsed=parsed,
+                **fields,
+            )
+        except Exception as e:
+            event("webhook_read_error", logging.WARNING, route=route, error=str(e))
+    elif logger.isEnabledFor(logging.DEBUG):
+        event("webhook_received", logging.DEBUG, route=route, parsed=parsed)
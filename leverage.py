@@ -0,0 +1,107 @@
+# leverage.py — сверка плеча: set-leverage уходит только при расхождении с биржей
+#
+# Плечо (и режим маржи) по символам хранится в памяти процесса, как posMode в
+# get_okx_pos_mode: при старте читается разом по настроенным символам, дальше
+# ensure() шлёт set-leverage только для неизвестного символа или расхождения.
+# Ответы бирж, где видно плечо (позиции из кэша аккаунта и живых проверок),
+# идут в observe(): расхождение перезаписывает запись, и следующая сделка
+# выставит плечо заново.
+
+import os, logging, threading
+
+import jsonlog, rate_limit
+
+LEVERAGE_RECONCILE = os.getenv("LEVERAGE_RECONCILE", "true").lower() == "true"
+
+_books = {}
+
+class LeverageBook:
+    """
+    apply(symbol, leverage) -> bool: set-leverage; True — на бирже теперь нужное плечо
+    fetch(symbols) -> {symbol: (leverage, mode)}: текущее состояние, mode может быть None
+    mode: нужный режим маржи ("cross" на OKX); None — не сверяется
+    """
+
+    def __init__(self, venue: str, apply, fetch=None, symbols=(), mode: str = None):
+        self.venue = venue
+        self.apply = apply
+        self.fetch = fetch
+        self.symbols = symbols
+        self.mode = mode
+        self.stats = {"skipped": 0, "sent": 0, "failed": 0, "mismatches": 0}
+        self._known = {}  # symbol -> (leverage: float, mode | None)
+        self._lock = threading.Lock()
+        self._pid = None
+        _books[venue] = self
+
+    def _matches(self, cur, leverage: float) -> bool:
+        return (cur is not None and cur[0] == leverage
+                and (self.mode is None or cur[1] is None or cur[1] == self.mode))
+
+    def ensure(self, symbol: str, leverage) -> bool:
+        """Нужное плечо на символе: из памяти без запроса, иначе set-leverage."""
+        leverage = float(leverage)
+        if LEVERAGE_RECONCILE:
+            self.start()
+            with self._lock:
+                cur = self._known.get(symbol)
+            if self._matches(cur, leverage):
+                self.stats["skipped"] += 1
+                return True
+        ok = self.apply(symbol, leverage)
+        with self._lock:
+            if ok:
+                self._known[symbol] = (leverage, self.mode)
+                self.stats["sent"] += 1
+            else:
+                self._known.pop(symbol, None)
+                self.stats["failed"] += 1
+        return ok
+
+    def observe(self, symbol: str, leverage, mode: str = None):
+        """Плечо из ответа биржи; расхождение с записью — запись заменяется."""
+        try:
+            lev = float(leverage)
+        except (TypeError, ValueError):
+            return
+        if lev <= 0:
+            return
+        with self._lock:
+            cur = self._known.get(symbol)
+            if cur is not None and (cur[0] != lev or (mode is not None and cur[1] not in (None, mode))):
+                self.stats["mismatches"] += 1
+            self._known[symbol] = (lev, mode)
+
+    def status(self) -> dict:
+        with self._lock:
+            known = {s: {"leverage": lev, "mode": mode} for s, (lev, mode) in sorted(self._known.items())}
+        return {"venue": self.venue, "enabled": LEVERAGE_RECONCILE, "known": known, **self.stats}
+
+    # =============== СТАРТ ===============
+    def start(self):
+        """Один раз на процесс (после fork gunicorn — заново): прочитать плечо по настроенным символам."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+        if self.fetch and self.symbols:
+            threading.Thread(target=self._prime, name=f"leverage-{self.venue}", daemon=True).start()
+
+    def _prime(self):
+        rate_limit.mark_background()
+        try:
+            current = self.fetch(sorted(self.symbols)) or {}
+        except Exception as e:
+            jsonlog.event(f"⚠️ leverage {self.venue}: не удалось прочитать плечо: {e}", logging.WARNING)
+            return
+        with self._lock:
+            for symbol, (lev, mode) in current.items():
+                # ensure() мог успеть раньше — его ответ свежее снимка
+                self._known.setdefault(symbol, (float(lev), mode))
+        jsonlog.event(f"🔧 leverage {self.venue}: известно плечо по {len(current)} символам")
+
+def status() -> list:
+    return [b.status() for b in _books.values()]
@@ -0,0 +1,366 @@
+# loadtest.py — нагрузочный прогон вебхуков пачками (как TradingView на закрытии свечи)
+#
+# Поднимает exchange_sim.py и приложение под gunicorn (N воркеров × T потоков),
+# направленное на симулятор, и шлёт пачки алертов по многим символам за доли секунды
+# (синтетические или записанные: --replay). Отчёт: пропускная способность,
+# p50/p99/p999 ответа вебхука и «сигнал → ордер на бирже», разбивка статусов,
+# дубли ордеров (гонки на глобальных переменных между воркерами/потоками),
+# CPU по воркерам из /proc и латентность этапов из трейсов.
+#
+#   python loadtest.py --app app --path /webhook --workers 4 --threads 8 \
+#       --bursts 3 --burst-size 300 --spread-ms 1000 --symbols 300 -o load.json
+#   python loadtest.py --app app_3waves --path /webhook_3waves --burst-size 500
+#   python loadtest.py --replay alerts.jsonl     # строки {"t": сек, "path": "...", "body": {...}}
+
+import os, sys, json, time, random, signal, socket, argparse, tempfile, threading, subprocess
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+KEYS = {
+    "BYBIT_API_KEY": "load-key", "BYBIT_API_SECRET": "load-secret",
+    "OKX_API_KEY": "load-okx-key", "OKX_API_SECRET": "load-okx-secret", "OKX_PASSPHRASE": "load-pass",
+}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_http(url: str, timeout: float = 30.0, proc=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"process exited with {proc.returncode}: {url}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"timeout waiting for {url}")
+
+def pct(values: list, p: float):
+    if not values:
+        return None
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, int(round(p / 100 * len(s) + 0.5)) - 1))]
+
+def summary_ms(values: list) -> dict:
+    return {
+        "n": len(values),
+        "p50": pct(values, 50), "p99": pct(values, 99), "p999": pct(values, 99.9),
+        "max": max(values) if values else None,
+    }
+
+# =============== /proc ===============
+def children(pid: int) -> list:
+    out = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            out.append(int(name))
+    return sorted(out)
+
+def cpu_seconds(pid: int):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # после ")" : state(0) ppid(1) ... utime(11) stime(12)
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+# =============== СЦЕНАРИЙ ===============
+def symbol_names(n: int) -> list:
+    return [f"L{i:03d}USDT" for i in range(n)]
+
+def synthetic_body(path: str, symbol: str, seq: int, bar_ms: int) -> dict:
+    direction = "UP" if seq % 2 == 0 else "DOWN"
+    if path == "/webhook_3waves":
+        return {"type": "3WAVESUP", "ticker": symbol, "tf": random.choice(("3", "5")), "time": bar_ms}
+    if path == "/webhook_okx":
+        return {"type": "SCALP", "ticker": f"OKX:{symbol}.P", "direction": direction, "entry": 100.0, "tf": "1m"}
+    return {"type": "SCALP", "ticker": f"BYBIT:{symbol}.P", "direction": direction, "entry": 100.0, "tf": "1m"}
+
+def synthetic_events(a) -> list:
+    symbols = symbol_names(a.symbols)
+    events = []
+    for b in range(a.bursts):
+        bar_ms = int(time.time() * 1000) + b * a.interval * 1000
+        for i in range(a.burst_size):
+            events.append({
+                "t": b * a.interval + random.uniform(0, a.spread_ms / 1000),
+                "path": a.path,
+                "body": synthetic_body(a.path, symbols[i % len(symbols)], i, bar_ms),
+            })
+    events.sort(key=lambda e: e["t"])
+    return events
+
+def load_replay(path: str) -> list:
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                events.append(json.loads(line))
+    events.sort(key=lambda e: e["t"])
+    return events
+
+def _symbol_of(body: dict) -> str:
+    return str(body.get("ticker", "")).upper().replace("BYBIT:", "").replace("OKX:", "").replace(".P", "")
+
+# =============== ПРОЦЕССЫ ===============
+def start_sim(a, symbols: list, tmp: str):
+    port = free_port()
+    spec = ",".join(f"{s}=100:0.01:0.01" for s in symbols)
+    cmd = [sys.executable, os.path.join(HERE, "exchange_sim.py"), "--port", str(port), "--symbols", spec,
+           "--bybit-key", KEYS["BYBIT_API_KEY"], "--bybit-secret", KEYS["BYBIT_API_SECRET"],
+           "--okx-key", KEYS["OKX_API_KEY"], "--okx-secret", KEYS["OKX_API_SECRET"],
+           "--okx-passphrase", KEYS["OKX_PASSPHRASE"],
+           "--latency-ms", str(a.sim_latency_ms), "--jitter-ms", str(a.sim_jitter_ms),
+           "--error-rate", str(a.sim_error_rate), "--rate-limit", str(a.sim_rate_limit)]
+    log = open(os.path.join(tmp, "sim.log"), "w")
+    proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=HERE)
+    url = f"http://127.0.0.1:{port}"
+    wait_http(url + "/sim/state", proc=proc)
+    return proc, url
+
+def start_app(a, sim_url: str, symbols: list, tmp: str):
+    port = free_port()
+    sym_list = ",".join(symbols)
+    env = dict(os.environ, **KEYS)
+    env.update({
+        "BYBIT_BASE_URL": sim_url, "OKX_BASE_URL": sim_url,
+        "TRADE_ENABLED": "true", "TRADE_ENABLED_OKX": "true",
+        "BYBIT_LONG_SYMBOLS": sym_list, "BYBIT_SHORT_SYMBOLS": sym_list,
+        "BYBIT_LONG_DAYS": "0,1,2,3,4,5,6", "BYBIT_SHORT_DAYS": "0,1,2,3,4,5,6",
+        "BYBIT_LONG_HOURS": "0-24", "BYBIT_SHORT_HOURS": "0-24",
+        "OKX_LONG_HOURS": "0-24", "OKX_SHORT_HOURS": "0-24",
+        "TELEGRAM_TOKEN": "", "CHAT_ID": "",
+        "WEBHOOK_SECRET": "", "WEBHOOK_SECRET_OKX": "", "WEBHOOK_SECRET_3WAVES": "",
+        "GUNICORN_THREADS": str(a.threads),
+        "INSTRUMENTS_SNAPSHOT": os.path.join(tmp, "instruments.json"),
+        "TRADE_JOURNAL_DB": os.path.join(tmp, "trades.sqlite3"),
+        "STATE_DB": os.path.join(tmp, "state.sqlite3"),
+        "TRACE_FILE": os.path.join(tmp, "traces.jsonl"),
+        "LOG_LEVEL": "WARNING",
+    })
+    cmd = [sys.executable, "-m", "gunicorn", "-w", str(a.workers), "--threads", str(a.threads),
+           "-b", f"127.0.0.1:{port}", "--chdir", HERE, "--timeout", "120", f"{a.app}:app"]
+    log = open(os.path.join(tmp, "app.log"), "w")
+    proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=HERE, env=env)
+    url = f"http://127.0.0.1:{port}"
+    wait_http(url + "/health", timeout=60, proc=proc)
+    # дождаться всех воркеров
+    deadline = time.monotonic() + 30
+    while len(children(proc.pid)) < a.workers and time.monotonic() < deadline:
+        time.sleep(0.1)
+    return proc, url
+
+def stop(proc):
+    if proc is None or proc.poll() is not None:
+        return
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+# =============== НАГРУЗКА ===============
+_tls = threading.local()
+
+def _session() -> requests.Session:
+    s = getattr(_tls, "s", None)
+    if s is None:
+        s = _tls.s = requests.Session()
+    return s
+
+def fire(app_url: str, t0: float, ev: dict) -> dict:
+    delay = t0 + ev["t"] - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+    sent = time.time()
+    p0 = time.perf_counter()
+    rec = {"t": ev["t"], "path": ev["path"], "symbol": _symbol_of(ev["body"]), "sent": sent,
+           "lag_ms": max(0.0, -delay) * 1000}
+    try:
+        r = _session().post(app_url + ev["path"], json=ev["body"], timeout=60)
+        rec["ms"] = (time.perf_counter() - p0) * 1000
+        rec["http"] = r.status_code
+        try:
+            rec["status"] = (r.json() or {}).get("status") or f"http_{r.status_code}"
+        except ValueError:
+            rec["status"] = f"http_{r.status_code}"
+        rec["trace"] = r.headers.get("X-Trace-Id")
+    except requests.RequestException as e:
+        rec["ms"] = (time.perf_counter() - p0) * 1000
+        rec["status"] = f"error:{type(e).__name__}"
+    return rec
+
+def run_load(app_url: str, events: list, concurrency: int) -> list:
+    t0 = time.monotonic() + 0.5
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(fire, app_url, t0, ev) for ev in events]
+        return [f.result() for f in futures]
+
+# =============== ОТЧЁТ ===============
+def signal_to_order(results: list, orders: list) -> list:
+    """Для каждого сигнала со status=ok — первый ордер по символу, пришедший на биржу после отправки."""
+    by_symbol = defaultdict(list)
+    for o in orders:
+        sym = o["symbol"].replace("-USDT-SWAP", "USDT")
+        by_symbol[sym].append(o["ts"])
+    for v in by_symbol.values():
+        v.sort()
+    out = []
+    for r in results:
+        if r.get("status") != "ok":
+            continue
+        ts = next((t for t in by_symbol.get(r["symbol"], []) if t >= r["sent"]), None)
+        if ts is not None:
+            out.append((ts - r["sent"]) * 1000)
+    return out
+
+def stage_latency(trace_file: str) -> dict:
+    stages = defaultdict(list)
+    if not os.path.exists(trace_file):
+        return {}
+    with open(trace_file, encoding="utf-8") as f:
+        for line in f:
+            try:
+                s = json.loads(line)
+            except ValueError:
+                continue
+            name = s.get("name")
+            if name == "http":
+                name = f"http {s.get('endpoint')}"
+            stages[name].append(s.get("dur_ms", 0.0))
+    return {k: summary_ms(v) for k, v in sorted(stages.items())}
+
+def report(a, results: list, orders: list, cpu: dict, wall: float, stages: dict) -> dict:
+    ms = [r["ms"] for r in results if "ms" in r]
+    statuses = Counter(r["status"] for r in results)
+    first = min(r["sent"] for r in results)
+    last = max(r["sent"] + r.get("ms", 0) / 1000 for r in results)
+    entries = Counter(o["symbol"] for o in orders)
+    dupes = {s: n for s, n in entries.items() if n > 1}
+    # глобальный кулдаун 180 с должен пропускать одну сделку на окно; больше — гонка между воркерами/потоками
+    allowance = 1 + int((last - first) // 180) if a.path in ("/webhook", "/webhook_okx") else None
+    return {
+        "config": {k: v for k, v in vars(a).items() if k not in ("output",)},
+        "requests": len(results),
+        "duration_s": round(last - first, 3),
+        "throughput_rps": round(len(results) / max(1e-9, last - first), 1),
+        "client_lag_ms": summary_ms([r["lag_ms"] for r in results]),
+        "webhook_ms": summary_ms(ms),
+        "signal_to_order_ms": summary_ms(signal_to_order(results, orders)),
+        "statuses": dict(statuses.most_common()),
+        "orders_at_exchange": len(orders),
+        "symbols_with_multiple_orders": dupes,
+        "cooldown_allowance": allowance,
+        "worker_cpu": cpu,
+        "wall_s": round(wall, 3),
+        "stages_ms": stages,
+    }
+
+def _fmt(d: dict) -> str:
+    if not d or not d.get("n"):
+        return "n=0"
+    return f"n={d['n']}  p50={d['p50']:.1f}  p99={d['p99']:.1f}  p999={d['p999']:.1f}  max={d['max']:.1f}"
+
+def print_report(rep: dict):
+    print(f"\n📊 {rep['requests']} requests in {rep['duration_s']}s → {rep['throughput_rps']} req/s")
+    print(f"   webhook latency ms:        {_fmt(rep['webhook_ms'])}")
+    print(f"   signal→order ms:           {_fmt(rep['signal_to_order_ms'])}")
+    print(f"   client send lag ms:        {_fmt(rep['client_lag_ms'])}")
+    print("   statuses:")
+    for k, v in rep["statuses"].items():
+        print(f"     {k:28s} {v}")
+    print(f"   orders at exchange: {rep['orders_at_exchange']}")
+    if rep["cooldown_allowance"] is not None and rep["orders_at_exchange"] > rep["cooldown_allowance"]:
+        print(f"   ⚠️ global cooldown allows {rep['cooldown_allowance']}, got {rep['orders_at_exchange']} "
+              "(per-worker globals / check-then-set race)")
+    if rep["symbols_with_multiple_orders"]:
+        print(f"   ⚠️ symbols with >1 order (race on per-worker globals): {len(rep['symbols_with_multiple_orders'])}")
+    print("   worker CPU:")
+    for pid, c in rep["worker_cpu"].items():
+        print(f"     pid {pid:>7}  {c['cpu_s']:.2f}s  ({c['pct']:.0f}% of wall)")
+    if rep["stages_ms"]:
+        print("   stages (from traces):")
+        for k, v in rep["stages_ms"].items():
+            print(f"     {k:36s} {_fmt(v)}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Burst load harness for the webhook endpoints")
+    ap.add_argument("--app", default="app", choices=("app", "okx_app", "app_3waves"))
+    ap.add_argument("--path", default="/webhook", help="/webhook, /webhook_okx, /webhook_3waves")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--bursts", type=int, default=1)
+    ap.add_argument("--burst-size", type=int, default=300)
+    ap.add_argument("--spread-ms", type=float, default=1000.0, help="за сколько мс приходит пачка")
+    ap.add_argument("--interval", type=int, default=5, help="секунд между пачками")
+    ap.add_argument("--symbols", type=int, default=300)
+    ap.add_argument("--concurrency", type=int, default=256, help="одновременных клиентских соединений")
+    ap.add_argument("--replay", help="JSONL с событиями {t, path, body}")
+    ap.add_argument("--record", help="сохранить сгенерированные события в JSONL")
+    ap.add_argument("--sim-latency-ms", type=float, default=20.0)
+    ap.add_argument("--sim-jitter-ms", type=float, default=10.0)
+    ap.add_argument("--sim-error-rate", type=float, default=0.0)
+    ap.add_argument("--sim-rate-limit", type=int, default=0)
+    ap.add_argument("--settle", type=float, default=2.0, help="секунд ожидания фоновых ордеров после нагрузки")
+    ap.add_argument("-o", "--output", help="записать отчёт в JSON")
+    a = ap.parse_args(argv)
+
+    events = load_replay(a.replay) if a.replay else synthetic_events(a)
+    if a.record:
+        with open(a.record, "w", encoding="utf-8") as f:
+            for ev in events:
+                f.write(json.dumps(ev) + "\n")
+    symbols = sorted({_symbol_of(ev["body"]) for ev in events} | set(symbol_names(a.symbols)))
+
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    sim = app_proc = None
+    try:
+        sim, sim_url = start_sim(a, symbols, tmp)
+        app_proc, app_url = start_app(a, sim_url, symbols, tmp)
+        workers = children(app_proc.pid)
+        print(f"🧪 sim {sim_url}, {a.app} on {app_url} ({len(workers)} workers × {a.threads} threads), "
+              f"{len(events)} events, logs in {tmp}")
+        cpu0 = {pid: cpu_seconds(pid) for pid in workers + [app_proc.pid]}
+        w0 = time.monotonic()
+        results = run_load(app_url, events, a.concurrency)
+        time.sleep(a.settle)
+        wall = time.monotonic() - w0
+        cpu = {}
+        for pid, before in cpu0.items():
+            after = cpu_seconds(pid)
+            if before is not None and after is not None:
+                used = after - before
+                cpu[pid if pid != app_proc.pid else f"{pid} (master)"] = {"cpu_s": round(used, 3), "pct": round(100 * used / wall, 1)}
+        orders = requests.get(sim_url + "/sim/orders", timeout=10).json()
+        stop(app_proc)  # трейсы дописываются при остановке воркеров
+        app_proc = None
+        rep = report(a, results, orders, cpu, wall, stage_latency(os.path.join(tmp, "traces.jsonl")))
+    finally:
+        stop(app_proc)
+        stop(sim)
+    print_report(rep)
+    if a.output:
+        with open(a.output, "w", encoding="utf-8") as f:
+            json.dump(rep, f, indent=2, default=str)
+        print(f"💾 {a.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+# log_writer.py — буферизованная запись CSV-лога сигналов в фоне
+#
+# Вебхук только кладёт строку в очередь. Фоновый поток пишет пачкой:
+# по LOG_FLUSH_ROWS строк или раз в LOG_FLUSH_SEC, ротирует файл по размеру
+# и по смене дня (UTC) и дописывает остаток при остановке процесса.
+
+import os, csv, time, queue, atexit, logging, threading
+from datetime import datetime, timezone
+
+import jsonlog
+
+LOG_FLUSH_ROWS = int(os.getenv("LOG_FLUSH_ROWS", "200"))
+LOG_FLUSH_SEC = float(os.getenv("LOG_FLUSH_SEC", "1.0"))
+LOG_ROTATE_BYTES = int(os.getenv("LOG_ROTATE_BYTES", str(20 * 1024 * 1024)))
+LOG_ROTATE_DAILY = os.getenv("LOG_ROTATE_DAILY", "false").lower() == "true"
+LOG_QUEUE_MAXSIZE = int(os.getenv("LOG_QUEUE_MAXSIZE", "10000"))
+
+class BufferedCsvWriter:
+    def __init__(self, path: str, header: list, flush_rows: int = None, flush_sec: float = None,
+                 rotate_bytes: int = None, rotate_daily: bool = None):
+        self.path = path
+        self.header = header
+        self.flush_rows = flush_rows or LOG_FLUSH_ROWS
+        self.flush_sec = flush_sec if flush_sec is not None else LOG_FLUSH_SEC
+        self.rotate_bytes = rotate_bytes if rotate_bytes is not None else LOG_ROTATE_BYTES
+        self.rotate_daily = LOG_ROTATE_DAILY if rotate_daily is None else rotate_daily
+        self.lock = threading.Lock()  # держится только на время записи пачки
+        self.stats = {"written": 0, "dropped": 0, "flushes": 0, "rotations": 0}
+        self._q = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+        self._day = None
+        self._pid = None
+        atexit.register(self.close)
+
+    # =============== ПУБЛИЧНОЕ API ===============
+    def write(self, row: list) -> bool:
+        """Неблокирующая постановка строки. False — очередь переполнена."""
+        self._ensure_thread()
+        try:
+            self._q.put_nowait(row)
+            return True
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return False
+
+    def depth(self) -> int:
+        return self._q.qsize()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while self._q.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.02)
+        return not self._q.unfinished_tasks
+
+    def close(self):
+        """Дописывает всё, что осталось в очереди (atexit / остановка gunicorn-воркера)."""
+        rows = []
+        while True:
+            try:
+                rows.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        if rows:
+            self._write_batch(rows)
+            for _ in rows:
+                self._q.task_done()
+
+    # =============== ВНУТРЕННЕЕ ===============
+    def _ensure_thread(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self.lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+        threading.Thread(target=self._loop, name="csv-log-writer", daemon=True).start()
+
+    def _rotate_if_needed(self):
+        if not os.path.exists(self.path):
+            return
+        today = datetime.now(timezone.utc).date()
+        if self._day is None:
+            self._day = datetime.fromtimestamp(os.path.getmtime(self.path), timezone.utc).date()
+        too_big = self.rotate_bytes and os.path.getsize(self.path) >= self.rotate_bytes
+        new_day = self.rotate_daily and today != self._day
+        if too_big or new_day:
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+            base, ext = os.path.splitext(self.path)
+            target, n = f"{base}-{stamp}{ext}", 1
+            while os.path.exists(target):
+                target, n = f"{base}-{stamp}-{n}{ext}", n + 1
+            os.replace(self.path, target)
+            self.stats["rotations"] += 1
+            jsonlog.event(f"🗂 log rotated → {target}")
+        self._day = today
+
+    def _write_batch(self, rows: list):
+        try:
+            with self.lock:
+                self._rotate_if_needed()
+                create_header = not os.path.exists(self.path)
+                with open(self.path, "a", newline="", encoding="utf-8") as f:
+                    w = csv.writer(f)
+                    if create_header:
+                        w.writerow(self.header)
+                    w.writerows(rows)
+            self.stats["written"] += len(rows)
+            self.stats["flushes"] += 1
+        except Exception as e:
+            jsonlog.event(f"❌ Log error: {e}", logging.ERROR)
+
+    def _loop(self):
+        while True:
+            rows = [self._q.get()]
+            deadline = time.monotonic() + self.flush_sec
+            while len(rows) < self.flush_rows:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    rows.append(self._q.get(timeout=left))
+                except queue.Empty:
+                    break
+            self._write_batch(rows)
+            for _ in rows:
+                self._q.task_done()
@@ -0,0 +1,150 @@
+# metrics.py — метрики в текстовом формате Prometheus (/metrics)
+#
+# Без внешних зависимостей: счётчики, гистограммы (фиксированные бакеты, bisect)
+# и гейджи-коллбэки. Запись — одна блокировка и пара сложений, поэтому
+# метрики можно держать включёнными в проде. Монотонные счётчики — только Counter
+# (имя на _total), чтобы rate()/increase() в Prometheus считались верно.
+#
+# Реестр — на процесс. Под `gunicorn -w N` /metrics отвечает случайный воркер своими
+# значениями: счётчики каждого воркера — отдельные ряды, которые сбрасываются при его
+# рестарте. Серия worker_info{pid} показывает, какой воркер ответил. Точные суммы —
+# при -w 1 (--threads N); при N воркерах это выборка одного процесса за скрейп.
+
+import os, time, bisect, threading
+
+import tracing
+
+# секунды: от 1 мс (фильтры) до 10 с (таймауты бирж)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+def _fmt_labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, n: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + n
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for lv, v in items:
+            out.append(f"{self.name}{_fmt_labels(self.labels, lv)} {v}")
+        return out
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [counts per bucket (+Inf последний), sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(label_values)
+            if s is None:
+                s = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def render(self) -> list:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(lv, (list(s[0]), s[1], s[2])) for lv, s in self._series.items()]
+        for lv, (counts, total, n) in items:
+            acc = 0
+            for b, c in zip(self.buckets, counts):
+                acc += c
+                le = 'le="%s"' % b
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, lv, le)} {acc}")
+            le = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labels, lv, le)} {n}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, lv)} {total}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, lv)} {n}")
+        return out
+
+class Gauge:
+    """Значение снимается в момент /metrics: fn() -> число или {labels_tuple: число}."""
+
+    def __init__(self, name: str, help_text: str, fn, labels=()):
+        self.name, self.help, self.fn, self.labels = name, help_text, fn, tuple(labels)
+        _registry.append(self)
+
+    def render(self) -> list:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            v = self.fn()
+        except Exception:
+            return out
+        if isinstance(v, dict):
+            for lv, x in v.items():
+                out.append(f"{self.name}{_fmt_labels(self.labels, lv if isinstance(lv, tuple) else (lv,))} {x}")
+        else:
+            out.append(f"{self.name} {v}")
+        return out
+
+def render() -> str:
+    lines = []
+    for m in list(_registry):
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# =============== ОБЩИЕ МЕТРИКИ ===============
+stage_seconds = Histogram(
+    "webhook_stage_seconds", "Time spent in each webhook pipeline stage", ("route", "stage"))
+webhook_status_total = Counter(
+    "webhook_status_total", "Webhook responses by returned status", ("route", "status"))
+exchange_request_seconds = Histogram(
+    "exchange_request_seconds", "Outbound HTTP latency per venue endpoint", ("venue", "method", "endpoint"))
+exchange_requests_total = Counter(
+    "exchange_requests_total", "Outbound HTTP requests per venue endpoint and HTTP code", ("venue", "endpoint", "code"))
+Gauge("threads_alive", "Live Python threads in this worker", lambda: threading.active_count())
+Gauge("worker_info", "Process that served this scrape (registries are per worker)", lambda: {(os.getpid(),): 1}, ("pid",))
+
+class Stopwatch:
+    """
+    sw = Stopwatch("webhook"); ...; sw.lap("parse"); ...; sw.lap("filters")
+    Каждый lap пишет время с предыдущего lap в webhook_stage_seconds{route, stage}
+    и, внутри трейса, закрывает спан этапа (HTTP-вызовы этапа — его дети).
+    """
+    __slots__ = ("route", "_t", "_span")
+
+    def __init__(self, route: str):
+        self.route = route
+        self._t = time.perf_counter()
+        self._span = tracing.span("stage")
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        stage_seconds.observe(now - self._t, self.route, stage)
+        self._t = now
+        if self._span:
+            self._span.name = stage
+            self._span.end()
+        self._span = tracing.span("stage")
+
+    def skip(self):
+        """Сбросить точку отсчёта, не записывая (этап не выполнялся)."""
+        self._t = time.perf_counter()
+        self._span.discard()
+        self._span = tracing.span("stage")
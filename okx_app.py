@@ -1,10 +1,17 @@
 # okx_app.py — минимальный автотрейд-сервер под OKX (SCALP)
 
-import os, time, json, math, hmac, base64, threading, requests, re
-from datetime import datetime, timezone, timedelta
-from flask import Flask, request, jsonify
+import os, time, json, math, hmac, base64, re, threading, logging
+from datetime import datetime, timezone
+from flask import Flask, request, jsonify, g
+
+import clock_sync, idempotency, ingest, instruments, jsonlog, leverage, metrics, pretrade, rate_limit, resilience, shared_state, telegram_outbox, tracing
+from account_cache import AccountCache
+from private_stream import OkxPrivateStream
+from trading_schedule import TRADING_TZ, TradingSchedule
+from http_clients import http_get, http_post
 
 app = Flask(__name__)
+idempotency.init_app(app)
 
 DEBUG = False
 
@@ -14,6 +21,8 @@ OKX_API_SECRET    = os.getenv("OKX_API_SECRET", "")
 OKX_PASSPHRASE    = os.getenv("OKX_PASSPHRASE", "")
 OKX_POS_MODE      = os.getenv("OKX_POS_MODE", "net")  # 'net' или 'hedge'
 OKX_BASE_URL      = os.getenv("OKX_BASE_URL", "https://www.okx.com")
+# orders-algo-pending требует ordType; conditional и oco можно перечислить через запятую
+OKX_ALGO_ORD_TYPES = "conditional,oco"
 OKX_LONG_DAYS_ENV  = os.getenv("OKX_LONG_DAYS",  "0,1,2,3,4,5,6")
 OKX_SHORT_DAYS_ENV = os.getenv("OKX_SHORT_DAYS", "0,1,2,3,4,5,6")
 OKX_LONG_HOURS_ENV  = os.getenv("OKX_LONG_HOURS",  "0-3,3-6,6-9,9-12,12-15,15-18,18-21,21-24")
@@ -21,60 +30,20 @@ OKX_SHORT_HOURS_ENV = os.getenv("OKX_SHORT_HOURS", "0-3,3-6,6-9,9-12,12-15,15-18
 
 WEBHOOK_SECRET    = os.getenv("WEBHOOK_SECRET_OKX", "")  # можно другой, чтобы не путать с Bybit
 TRADE_ENABLED     = os.getenv("TRADE_ENABLED_OKX", "false").lower() == "true"
-instrument_locks = {}
-instrument_locks_lock = threading.Lock()
+OKX_WS_ENABLED    = os.getenv("OKX_WS_ENABLED", "false").lower() == "true"  # приватный стрим positions/orders/orders-algo
 
 MAX_RISK_USDT     = float(os.getenv("MAX_RISK_USDT_OKX", "1"))
 LEVERAGE          = float(os.getenv("OKX_LEVERAGE", "20"))
 BASE_SL_PCT       = float(os.getenv("OKX_BASE_SL_PCT", "0.003"))  # 0.3%
 RR_RATIO          = float(os.getenv("OKX_RR_RATIO", "2.4"))       # TP = SL * 2.4
 
-def _parse_days(txt: str):
-    try:
-        return {int(x.strip()) for x in txt.split(",") if x.strip() != ""}
-    except Exception:
-        return set()  # если мусор в env — считаем, что ограничений по дням нет
-
-def _parse_hour_ranges(txt: str):
-    """
-    Парсит строки вида "0-2,3-5,6-8" → [(0,2), (3,5), (6,8)]
-    Окна трактуются как [start, end), то есть 0-2 = часы 0 и 1.
-    """
-    ranges = []
-    try:
-        parts = txt.split(",")
-        for part in parts:
-            part = part.strip()
-            if not part:
-                continue
-            if "-" not in part:
-                continue
-            a, b = part.split("-", 1)
-            start = int(a.strip())
-            end   = int(b.strip())
-            # простая защита от бреда
-            if 0 <= start <= 23 and 1 <= end <= 24 and start < end:
-                ranges.append((start, end))
-    except Exception:
-        return []
-    return ranges
-
-def _hour_allowed(hour: int, ranges):
-    """
-    Возвращает True, если час попадает хотя бы в один диапазон.
-    Если ranges пустой → ограничений по часам нет.
-    """
-    if not ranges:
-        return True
-    for start, end in ranges:
-        if start <= hour < end:
-            return True
-    return False
-
-OKX_LONG_DAYS_SET       = _parse_days(OKX_LONG_DAYS_ENV)
-OKX_SHORT_DAYS_SET      = _parse_days(OKX_SHORT_DAYS_ENV)
-OKX_LONG_HOUR_RANGES    = _parse_hour_ranges(OKX_LONG_HOURS_ENV)
-OKX_SHORT_HOUR_RANGES   = _parse_hour_ranges(OKX_SHORT_HOURS_ENV)
+# расписание: (venue, direction) → таблица минут недели в TRADING_TZ (IANA, с DST)
+# пустой список дней/часов = без ограничений, как раньше
+TRADING_SCHEDULE = (
+    TradingSchedule()
+    .add(("okx", "UP"), OKX_LONG_DAYS_ENV, OKX_LONG_HOURS_ENV, empty_days_allow=True, empty_windows_allow=True)
+    .add(("okx", "DOWN"), OKX_SHORT_DAYS_ENV, OKX_SHORT_HOURS_ENV, empty_days_allow=True, empty_windows_allow=True)
+)
 
 # === Telegram (тот же бот, что у Bybit) ===
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
@@ -87,57 +56,58 @@ def md_escape(text: str) -> str:
 
 def send_telegram(text: str):
     if not TELEGRAM_TOKEN or not CHAT_ID:
-        print("⚠️ Telegram credentials missing.")
+        jsonlog.event("⚠️ Telegram credentials missing.", logging.WARNING)
         return
     safe_text = md_escape(text)
-    try:
-        r = requests.get(
-            f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage",
-            params={"chat_id": CHAT_ID, "text": safe_text, "parse_mode": "MarkdownV2"},
-            timeout=8,
-        )
-        if r.status_code != 200:
-            print("❌ Telegram error:", r.text[:300])
-    except Exception as e:
-        print("❌ Telegram exception:", e)
+    # не блокирует вебхук: отправка идёт из фоновой очереди
+    telegram_outbox.send_message(TELEGRAM_TOKEN, CHAT_ID, safe_text, parse_mode="MarkdownV2")
 
-# глобальный кулдаун, как у тебя в bybit-коде
-trade_global_cooldown_until = 0
+# глобальный кулдаун, как у тебя в bybit-коде; он и локи инструментов — общие
+# для воркеров gunicorn (STATE_BACKEND, см. shared_state)
+GLOBAL_COOLDOWN_SEC = 180
+STATE = shared_state.default()
 
 def acquire_instrument_lock(inst_id: str, ttl: int = 30) -> bool:
     """
-    Возвращает False, если инструмент уже заблокирован
+    Возвращает False, если инструмент уже заблокирован (в любом воркере)
     """
-    now = time.time()
-    with instrument_locks_lock:
-        ts = instrument_locks.get(inst_id, 0)
-        if now < ts:
-            return False
-        instrument_locks[inst_id] = now + ttl
-        return True
+    return STATE.claim(f"okx:lock:{inst_id}", ttl)
 
 def release_instrument_lock(inst_id: str):
-    with instrument_locks_lock:
-        instrument_locks.pop(inst_id, None)
+    STATE.release(f"okx:lock:{inst_id}")
 
-def set_okx_leverage(inst_id: str, leverage: float):
+def set_okx_leverage(inst_id: str, leverage: float) -> bool:
     try:
         payload = {
             "instId": inst_id,
             "lever": str(leverage),
             "mgnMode": "cross",  # у тебя cross
         }
-        resp = okx_private_post("/api/v5/account/set-leverage", payload, timeout=10)
-        print("🔧 set_leverage resp:", resp)
-        return resp
+        resp = okx_private_post("/api/v5/account/set-leverage", payload)
+        jsonlog.event(f"🔧 set_leverage resp: {resp}")
+        return str(resp.get("code")) == "0"
     except Exception as e:
-        print("⚠️ set_okx_leverage error:", e)
-        return None
+        jsonlog.event(f"⚠️ set_okx_leverage error: {e}", logging.WARNING)
+        return False
+
+# плечо не меняется на лету: set-leverage только для нового инструмента или расхождения
+# (списка инструментов в конфиге нет — плечо узнаём из позиций и первого set-leverage)
+okx_leverage = leverage.LeverageBook("okx", set_okx_leverage, mode="cross")
 
 # =============== ВСПОМОГАТЕЛЬНОЕ ===============
+# время подписи — по часам биржи (clock_sync); 50102 — OK-ACCESS-TIMESTAMP вне окна 30 с
+OKX_CLOCK = clock_sync.ExchangeClock(
+    "okx", lambda: OKX_BASE_URL.rstrip("/") + "/api/v5/public/time", clock_sync.okx_server_ms)
+OKX_CODE_TIMESTAMP = "50102"
+OKX_CODES_UNKNOWN = ("50004",)  # таймаут эндпоинта: ордер мог пройти
+
+def okx_rejected(resp: dict) -> bool:
+    """Ордер точно не принят (в т.ч. не отправлен из-за размера); пустой ответ — исход неизвестен."""
+    code = str(resp.get("code", ""))
+    return resp.get("error") == "bad_size" or (code not in ("", "0") and code not in OKX_CODES_UNKNOWN)
+
 def _okx_timestamp() -> str:
-    # корректный вариант без DeprecationWarning
-    now = datetime.now(timezone.utc)
+    now = datetime.fromtimestamp(OKX_CLOCK.now_ms() / 1000, timezone.utc)
     return now.isoformat(timespec="milliseconds").replace("+00:00", "Z")
 
 def _okx_sign(method: str, path: str, body: str = ""):
@@ -160,39 +130,63 @@ def _okx_sign(method: str, path: str, body: str = ""):
     }
     return headers
 
-def okx_private_get(path: str, params: dict = None, timeout: int = 10):
+def okx_private_get(path: str, params: dict = None, timeout=None):
     qs = ""
     if params:
         # OKX для приватных GET разрешает querystring просто в URL
         parts = [f"{k}={v}" for k, v in params.items()]
         qs = "?" + "&".join(parts)
-    headers = _okx_sign("GET", path, "")
     url = OKX_BASE_URL.rstrip("/") + path + qs
-    r = requests.get(url, headers=headers, timeout=timeout)
-    if DEBUG:
-        print("GET", url, r.status_code, r.text[:400])
-    return r.json()
 
-def okx_private_post(path: str, payload: dict, timeout: int = 10):
+    def send():
+        for attempt in (0, 1):
+            rate_limit.acquire("okx", path)  # до подписи: ожидание не старит OK-ACCESS-TIMESTAMP
+            headers = _okx_sign("GET", path + qs, "")  # OKX подписывает путь вместе с querystring
+            r = http_get("okx", url, headers=headers, timeout=timeout, limit=False)
+            if DEBUG:
+                jsonlog.event("okx_get", logging.DEBUG, url=url, status=r.status_code, response=r.text[:400])
+            try:
+                j = r.json()
+            except ValueError:
+                # HTML от балансировщика / пустое тело при 5xx — не падаем, отдаём как ошибку
+                jsonlog.event(f"❌ OKX raw response (not JSON): {r.status_code} {r.text[:400]}", logging.ERROR)
+                return {"http": r.status_code, "text": r.text[:400]}
+            if attempt == 0 and j.get("code") == OKX_CODE_TIMESTAMP and OKX_CLOCK.resync():
+                continue
+            return j
+
+    return resilience.call("okx", "GET", path, send)
+
+def okx_private_post(path: str, payload: dict, timeout=None):
     body = json.dumps(payload, separators=(",", ":"))
-    headers = _okx_sign("POST", path, body)
     url = OKX_BASE_URL.rstrip("/") + path
-    r = requests.post(url, headers=headers, data=body, timeout=timeout)
 
-    text_preview = r.text[:400]
-    if DEBUG:
-        print("POST", url, "payload:", payload, "resp:", r.status_code, text_preview)
+    def send():
+        for attempt in (0, 1):
+            rate_limit.acquire("okx", path)
+            headers = _okx_sign("POST", path, body)
+            r = http_post("okx", url, headers=headers, data=body, timeout=timeout, limit=False)
+
+            text_preview = r.text[:400]
+            if DEBUG:
+                jsonlog.event("okx_post", logging.DEBUG, url=url, payload=payload, status=r.status_code, response=text_preview)
+
+            try:
+                j = r.json()
+            except Exception:
+                jsonlog.event(f"❌ OKX raw response (not JSON): {text_preview}", logging.ERROR)
+                return {"http": r.status_code, "text": r.text}
+            # запрос, отвергнутый по времени, биржа не исполняла — повтор безопасен
+            if attempt == 0 and j.get("code") == OKX_CODE_TIMESTAMP and OKX_CLOCK.resync():
+                continue
+            return j
 
-    try:
-        j = r.json()
-    except Exception:
-        print("❌ OKX raw response (not JSON):", text_preview)
-        return {"http": r.status_code, "text": r.text}
+    j = resilience.call("okx", "POST", path, send)
 
     if j.get("code") not in ("0", 0):
-        print("❌ OKX error:", j)
+        jsonlog.event(f"❌ OKX error: {j}", logging.ERROR)
     else:
-        print("✅ OKX OK:", j)
+        jsonlog.event(f"✅ OKX OK: {j}")
 
     return j
 
@@ -213,23 +207,11 @@ def tv_ticker_to_okx_inst_id(tv_ticker: str) -> str:
 
 
 # === получаем размер контракта и minSz, чтобы считать количество ===
-_okx_inst_cache = {}
 _okx_pos_mode = None  # 'net' или 'long_short'
 
 def get_okx_inst_info(inst_id: str):
-    if inst_id in _okx_inst_cache:
-        return _okx_inst_cache[inst_id]
-    resp = requests.get(
-        OKX_BASE_URL.rstrip("/") + "/api/v5/public/instruments",
-        params={"instType": "SWAP", "instId": inst_id},
-        timeout=10,
-    ).json()
-    data = (resp.get("data") or resp.get("result") or [])
-    if not data:
-        raise RuntimeError(f"Нет данных по инструменту {inst_id}: {resp}")
-    info = data[0]
-    _okx_inst_cache[inst_id] = info
-    return info
+    # реестр: пачкой при старте + фоновый рефреш, без сети на горячем пути
+    return instruments.okx_instrument(inst_id)
 
 def get_okx_pos_mode() -> str:
     """
@@ -242,7 +224,7 @@ def get_okx_pos_mode() -> str:
         return _okx_pos_mode
 
     try:
-        cfg = okx_private_get("/api/v5/account/config", timeout=10)
+        cfg = okx_private_get("/api/v5/account/config")
         data = cfg.get("data") or []
         if data:
             raw = (data[0].get("posMode") or "net").lower()
@@ -254,9 +236,9 @@ def get_okx_pos_mode() -> str:
                 _okx_pos_mode = "net"
         else:
             _okx_pos_mode = "net"
-        print("🔧 OKX posMode detected:", _okx_pos_mode)
+        jsonlog.event(f"🔧 OKX posMode detected: {_okx_pos_mode}")
     except Exception as e:
-        print("⚠️ Cannot detect posMode, fallback to 'net':", e)
+        jsonlog.event(f"⚠️ Cannot detect posMode, fallback to 'net': {e}", logging.WARNING)
         _okx_pos_mode = "net"
 
     return _okx_pos_mode
@@ -294,6 +276,7 @@ def okx_has_position(inst_id: str) -> bool:
         {"instType": "SWAP", "instId": inst_id}
     )
     for p in j.get("data", []):
+        okx_leverage.observe(inst_id, p.get("lever"), p.get("mgnMode"))
         pos = float(p.get("pos", "0"))
         avail = float(p.get("availPos", "0"))
         if abs(pos) > 0 or abs(avail) > 0:
@@ -310,10 +293,42 @@ def okx_has_open_orders(inst_id: str) -> bool:
 def okx_has_algo_orders(inst_id: str) -> bool:
     j = okx_private_get(
         "/api/v5/trade/orders-algo-pending",
-        {"instType": "SWAP", "instId": inst_id}
+        {"instType": "SWAP", "instId": inst_id, "ordType": OKX_ALGO_ORD_TYPES}
     )
     return bool(j.get("data"))
 
+# === кэш позиций/ордеров аккаунта: проверка перед сделкой без запроса в сеть ===
+def okx_account_snapshot():
+    pos = okx_private_get("/api/v5/account/positions", {"instType": "SWAP"})
+    pending = okx_private_get("/api/v5/trade/orders-pending", {"instType": "SWAP"})
+    algos = okx_private_get(
+        "/api/v5/trade/orders-algo-pending",
+        {"instType": "SWAP", "ordType": OKX_ALGO_ORD_TYPES}
+    )
+    if any(str(j.get("code")) != "0" for j in (pos, pending, algos)):
+        return None
+    positions, orders, algo_orders = {}, {}, {}
+    for p in pos.get("data") or []:
+        positions[p.get("instId", "")] = max(abs(float(p.get("pos") or 0)), abs(float(p.get("availPos") or 0)))
+        okx_leverage.observe(p.get("instId", ""), p.get("lever"), p.get("mgnMode"))
+    for o in pending.get("data") or []:
+        orders.setdefault(o.get("instId", ""), {})[o.get("ordId", "")] = o
+    for a in algos.get("data") or []:
+        algo_orders.setdefault(a.get("instId", ""), {})[a.get("algoId", "")] = a
+    return {"positions": positions, "orders": orders, "algo_orders": algo_orders}
+
+okx_account = AccountCache("okx", okx_account_snapshot)
+
+def okx_state_checks(plan, inst_id: str):
+    """Позиция / ордера / алго-ордера как узлы плана: из свежего кэша — один узел, иначе три живых запроса параллельно."""
+    cached = okx_account.busy(inst_id)
+    if cached is not None:
+        plan.veto_if("state_check", "blocked_existing_state", any, cached)
+        return
+    plan.veto_if("position", "blocked_existing_state", okx_has_position, inst_id)
+    plan.veto_if("open_orders", "blocked_existing_state", okx_has_open_orders, inst_id)
+    plan.veto_if("algo_orders", "blocked_existing_state", okx_has_algo_orders, inst_id)
+
 # === размещение сделки: Market entry + TP/SL как attachAlgoOrds ===
 def okx_place_order_with_tp_sl(inst_id: str, side: str, entry: float, tp: float, sl: float, risk_usdt: float):
     """
@@ -323,14 +338,14 @@ def okx_place_order_with_tp_sl(inst_id: str, side: str, entry: float, tp: float,
     sz = calc_sz_from_risk_okx(entry, sl, risk_usdt, inst_id)
     if sz <= 0:
         msg = f"{inst_id}: sz <= 0, сделка пропущена (risk={risk_usdt}, entry={entry}, sl={sl})"
-        print("⚠️", msg)
+        jsonlog.event(f"⚠️ {msg}", logging.WARNING)
         try:
             send_telegram("⚠️ *OKX SIZE ERROR*\n" + msg)
         except Exception:
             pass
         return {"error": "bad_size"}
 
-    print(f"\n🚀 OKX NEW TRADE {inst_id} {side} sz={sz}, entry≈{entry}, tp={tp}, sl={sl}")
+    jsonlog.event(f"🚀 OKX NEW TRADE {inst_id} {side} sz={sz}, entry≈{entry}, tp={tp}, sl={sl}")
 
     payload = {
         "instId": inst_id,
@@ -360,7 +375,7 @@ def okx_place_order_with_tp_sl(inst_id: str, side: str, entry: float, tp: float,
     # в net-режиме posSide либо 'net', либо вообще не передаётся – safer не отправлять
 
     resp = okx_private_post("/api/v5/trade/order", payload)
-    print("📨 OKX ORDER RESPONSE:", resp)
+    jsonlog.event(f"📨 OKX ORDER RESPONSE: {resp}")
 
     # разбираем детальную ошибку
     code = str(resp.get("code", ""))
@@ -403,63 +418,57 @@ def parse_payload(req):
 # =============== ВЕБХУК ПОД OKX ===============
 @app.route("/webhook_okx", methods=["POST"])
 def webhook_okx():
-    global trade_global_cooldown_until
-
     # === SECRET ===
     if WEBHOOK_SECRET and request.args.get("key", "") != WEBHOOK_SECRET:
         return "forbidden", 403
 
+    sw = metrics.Stopwatch("webhook_okx")
     payload = parse_payload(request)
+    jsonlog.log_request("webhook_okx", request, payload)
+    sw.lap("parse")
+
+    # === ПОВТОРНАЯ ДОСТАВКА (ретрай TradingView, рестарт) ===
+    if idempotency.claim("webhook_okx", request.get_json(silent=True) or request.get_data(), payload["tf"]) is None:
+        jsonlog.event(f"🔁 {payload['instId']}: duplicate delivery ignored")
+        return jsonify({"status": "duplicate_delivery"}), 200
 
+    # === INGEST_ASYNC: 202 сразу, сделка — в пуле (по очереди на инструмент) ===
+    if ingest.INGEST_ASYNC:
+        return ingest.accept("webhook_okx", payload["instId"], payload, handle_webhook_okx)
+    return handle_webhook_okx(payload, sw)
+
+def handle_webhook_okx(payload: dict, sw):
     typ        = payload["type"]
     inst_id    = payload["instId"]
     direction  = payload["direction"]
     entry      = payload["entry"]
 
-    print("\n==== OKX WEBHOOK ====")
-    print("RAW JSON:", request.get_json(silent=True))
-    print("PARSED:", payload)
-
     # === LOCAL INSTRUMENT LOCK ===
     if not acquire_instrument_lock(inst_id, ttl=60):
-        print(f"⛔ {inst_id}: local lock active, signal ignored")
+        jsonlog.event(f"⛔ {inst_id}: local lock active, signal ignored", logging.WARNING)
         return jsonify({"status": "blocked_local_lock"}), 200
 
     try:
-        # === TIME & DAY FILTERS (UTC+2) ===
-        tz_local = timezone(timedelta(hours=2))
-        now_dt   = datetime.now(timezone.utc).astimezone(tz_local)
-
-        wd   = now_dt.weekday()
-        hour = now_dt.hour
-
+        # === TIME & DAY FILTERS (TRADING_TZ) ===
         is_long = (direction == "UP")
+        side_label = "LONG" if is_long else "SHORT"
 
-        if is_long:
-            days_set    = OKX_LONG_DAYS_SET
-            hour_ranges = OKX_LONG_HOUR_RANGES
-            side_label  = "LONG"
-        else:
-            days_set    = OKX_SHORT_DAYS_SET
-            hour_ranges = OKX_SHORT_HOUR_RANGES
-            side_label  = "SHORT"
-
-        if days_set and wd not in days_set:
-            print(f"⛔ OKX {side_label} blocked by weekday (UTC+2)")
+        blocked = TRADING_SCHEDULE.check(("okx", "UP" if is_long else "DOWN"))
+        if blocked == "blocked_day":
+            jsonlog.event(f"⛔ OKX {side_label} blocked by weekday ({TRADING_TZ})", logging.WARNING)
             return jsonify({"status": "blocked_day"}), 200
 
-        if not _hour_allowed(hour, hour_ranges):
-            print(f"⛔ OKX {side_label} blocked by hour (UTC+2)")
+        if blocked == "blocked_hour":
+            jsonlog.event(f"⛔ OKX {side_label} blocked by hour ({TRADING_TZ})", logging.WARNING)
             return jsonify({"status": "blocked_hour"}), 200
 
         if typ != "SCALP":
             return jsonify({"status": "ignored"}), 200
 
         # === GLOBAL COOLDOWN ===
-        now = time.time()
-        if now < trade_global_cooldown_until:
-            remaining = int(trade_global_cooldown_until - now)
-            print(f"⛔ GLOBAL COOLDOWN {remaining}s")
+        remaining = int(STATE.ttl("okx:cooldown"))
+        if remaining > 0:
+            jsonlog.event(f"⛔ GLOBAL COOLDOWN {remaining}s", logging.WARNING)
 
             send_telegram(
                 f"⛔ *OKX TRADE BLOCKED*\n"
@@ -468,13 +477,26 @@ def webhook_okx():
             )
             return jsonify({"status": "cooldown"}), 200
 
-        # === EXISTING STATE CHECK ===
-        if (
-            okx_has_position(inst_id)
-            or okx_has_open_orders(inst_id)
-            or okx_has_algo_orders(inst_id)
-        ):
-            print(f"⛔ {inst_id}: position or orders already exist")
+        # === VENUE DEGRADED (circuit breaker): отказ сразу, без ожидания таймаутов ===
+        if resilience.is_open("okx"):
+            jsonlog.event(f"⛔ OKX degraded, {inst_id} signal rejected", logging.WARNING)
+            return jsonify({"status": "venue_unavailable"}), 503
+
+        sw.lap("filters")
+
+        # === EXISTING STATE CHECK + LEVERAGE / INSTRUMENT / POS MODE (параллельно) ===
+        plan = pretrade.Plan("webhook_okx")
+        okx_state_checks(plan, inst_id)
+        if TRADE_ENABLED:
+            plan.add("leverage", okx_leverage.ensure, inst_id, LEVERAGE)
+            plan.add("instrument", get_okx_inst_info, inst_id)
+            plan.add("pos_mode", get_okx_pos_mode)
+        try:
+            plan.run()
+        except pretrade.Abort as a:
+            if a.error is not None:
+                raise a.error
+            jsonlog.event(f"⛔ {inst_id}: position or orders already exist", logging.WARNING)
 
             send_telegram(
                 "⛔ *OKX TRADE BLOCKED*\n"
@@ -482,17 +504,18 @@ def webhook_okx():
                 f"Direction: {direction}\n"
                 f"Reason: POSITION OR ORDERS EXIST"
             )
-            return jsonify({"status": "blocked_existing_state"}), 200
+            return jsonify({"status": a.status}), 200
+        sw.lap("pretrade")
 
         # === TRADE ENABLED ===
         if not TRADE_ENABLED:
-            print("🚫 TRADE_DISABLED_OKX")
+            jsonlog.event("🚫 TRADE_DISABLED_OKX", logging.WARNING)
             return jsonify({"status": "trade_disabled"}), 200
 
         try:
             entry_f = float(entry)
         except Exception:
-            print("⚠️ bad entry:", entry)
+            jsonlog.event(f"⚠️ bad entry: {entry}", logging.WARNING)
             return jsonify({"status": "bad_entry"}), 200
 
         # === SL / TP ===
@@ -508,12 +531,12 @@ def webhook_okx():
             sl = round(entry_f + stop_size, 6)
             tp = round(entry_f - take_size, 6)
 
-        print(f"⚡ OKX SCALP {inst_id} {side} entry={entry_f} sl={sl} tp={tp}")
+        jsonlog.event(f"⚡ OKX SCALP {inst_id} {side} entry={entry_f} sl={sl} tp={tp}")
 
-        # === LEVERAGE ===
-        set_okx_leverage(inst_id, LEVERAGE)
-
-        # === PLACE ORDER ===
+        # === PLACE ORDER (кулдаун занимается атомарно: ордер отправит только один воркер) ===
+        if not STATE.claim("okx:cooldown", GLOBAL_COOLDOWN_SEC):
+            jsonlog.event(f"⛔ {inst_id}: cooldown claimed by a parallel signal", logging.WARNING)
+            return jsonify({"status": "cooldown"}), 200
         resp = okx_place_order_with_tp_sl(
             inst_id=inst_id,
             side=side,
@@ -522,6 +545,9 @@ def webhook_okx():
             sl=sl,
             risk_usdt=MAX_RISK_USDT
         )
+        if not okx_rejected(resp):
+            okx_account.mark_busy(inst_id)  # позиция открыта или могла открыться
+        sw.lap("order")
 
         send_telegram(
             "⚡ *OKX TRADE*\n"
@@ -530,14 +556,18 @@ def webhook_okx():
             f"TP: {tp}\n"
             f"SL: {sl}"
         )
+        sw.lap("telegram")
 
-        trade_global_cooldown_until = time.time() + 180
-        print("🕒 GLOBAL COOLDOWN ACTIVATED (OKX) 180s")
+        jsonlog.event(f"🕒 GLOBAL COOLDOWN ACTIVATED (OKX) {GLOBAL_COOLDOWN_SEC}s")
 
         return jsonify({"status": "ok", "okx_resp": resp}), 200
 
+    except resilience.CircuitOpen as e:
+        jsonlog.event(f"⛔ WEBHOOK: {e}", logging.WARNING)
+        return jsonify({"status": "venue_unavailable"}), 503
+
     except Exception as e:
-        print("❌ WEBHOOK ERROR:", e)
+        jsonlog.event(f"❌ WEBHOOK ERROR: {e}", logging.ERROR)
         send_telegram(f"❌ *OKX WEBHOOK ERROR*\n{inst_id}\n{e}")
         return jsonify({"status": "error"}), 500
 
@@ -552,8 +582,95 @@ def root():
 def health():
     return "OK", 200
 
+@app.route("/telegram/outbox")
+def telegram_outbox_stats():
+    return jsonify(telegram_outbox.stats()), 200
+
+@app.route("/signal/<sig_id>")
+def signal_status(sig_id):
+    return ingest.signal_status(sig_id)
+
+@app.route("/leverage")
+def leverage_status():
+    return jsonify(leverage.status()), 200
+
+@app.route("/account/cache")
+def account_cache_status():
+    return jsonify(okx_account.status()), 200
+
+@app.route("/clock")
+def clock_status():
+    return jsonify(clock_sync.status()), 200
+
+@app.route("/rate-limit")
+def rate_limit_status():
+    return jsonify(rate_limit.status()), 200
+
+@app.route("/breakers")
+def breakers_status():
+    return jsonify(resilience.status()), 200
+
+_STATUS_ROUTES = ("webhook_okx",)
+
+@app.before_request
+def _metrics_start():
+    g.t0 = time.perf_counter()
+    if request.endpoint in _STATUS_ROUTES:
+        g.trace = tracing.root(request.endpoint)
+
+@app.after_request
+def _metrics_status(resp):
+    route = request.endpoint
+    if route in _STATUS_ROUTES:
+        body = resp.get_json(silent=True) if resp.is_json else None
+        status = (body or {}).get("status") or f"http_{resp.status_code}"
+        metrics.webhook_status_total.inc(route, status)
+        metrics.stage_seconds.observe(time.perf_counter() - g.t0, route, "total")
+        sp = g.get("trace")
+        if sp:
+            sp.set(status=status, http=resp.status_code)
+            resp.headers["X-Trace-Id"] = sp.trace
+    return resp
+
+@app.teardown_request
+def _trace_end(exc):
+    sp = g.pop("trace", None)
+    if sp:
+        sp.end(**({"error": repr(exc)} if exc else {}))
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+@app.route("/debug/verbose", methods=["POST"])
+def debug_verbose():
+    # полные дампы запросов на лету: ?key=<WEBHOOK_SECRET_OKX>&on=1|0 (действует на текущий воркер)
+    if not WEBHOOK_SECRET or request.args.get("key", "") != WEBHOOK_SECRET:
+        return "forbidden", 403
+    jsonlog.set_verbose(request.args.get("on", "1").lower() in ("1", "true", "on"))
+    return jsonify({"verbose": jsonlog.is_verbose()}), 200
+
+# =============== ФОН ПРОЦЕССА ===============
+# Под gunicorn __main__ не выполняется — воркер стартует фон из post_worker_init
+# (gunicorn.conf.py), до первого запроса; повторный вызов в том же процессе ничего не делает.
+_background_pid = None
+_background_lock = threading.Lock()
+
+def start_background():
+    global _background_pid
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    instruments.start()
+    OKX_CLOCK.start()
+    if OKX_WS_ENABLED and OKX_API_KEY:
+        OkxPrivateStream(OKX_API_KEY, OKX_API_SECRET, OKX_PASSPHRASE).start()
+    okx_account.start()
+
 if __name__ == "__main__":
-    print("🚀 Starting OKX SCALP server")
+    jsonlog.event("🚀 Starting OKX SCALP server")
+    start_background()
     port = int(os.getenv("PORT", "8090"))
     app.run(host="0.0.0.0", port=port, use_reloader=False)
 
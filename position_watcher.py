@@ -0,0 +1,130 @@
+# position_watcher.py — один поток-наблюдатель за всеми открытыми позициями
+#
+# Вместо потока на каждую сделку: один цикл, один запрос «все позиции» за тик,
+# дальше раздача по символам. Число потоков и запросов не зависит от числа позиций.
+
+import os, time, logging, threading
+
+import jsonlog, rate_limit, tracing
+
+class PositionWatcher:
+    """
+    fetch_positions() -> {symbol: size} по всем позициям аккаунта, либо None при ошибке.
+    on_flat(symbol, final) вызывается на каждом тике, где позиция ~0;
+    final=True на flat_confirmations-м подряд — после этого символ снимается с наблюдения.
+    """
+
+    def __init__(self, fetch_positions, interval: float = 3.0, grace: float = 8.0,
+                 flat_confirmations: int = 3, max_age: float = 4 * 3600, name: str = "position-watcher"):
+        self.fetch_positions = fetch_positions
+        self.interval = interval
+        self.grace = grace
+        self.flat_confirmations = flat_confirmations
+        self.max_age = max_age
+        self.name = name
+        self._watched = {}  # symbol -> {"on_flat", "tiny", "since", "flat_count"}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    # =============== ПУБЛИЧНОЕ API ===============
+    def watch(self, symbol: str, on_flat, tiny: float = 0.0):
+        """Повторный watch того же символа перезапускает отсчёт (новая сделка)."""
+        on_flat = tracing.bind(on_flat)  # чистка пишет спаны в трейс сигнала
+        with self._lock:
+            self._watched[symbol] = {"on_flat": on_flat, "tiny": tiny, "since": time.time(), "flat_count": 0}
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def unwatch(self, symbol: str):
+        with self._lock:
+            self._watched.pop(symbol, None)
+
+    def _drop(self, symbol: str, st: dict):
+        """Снять символ, только если наблюдение всё ещё то же (не перезапущено новой сделкой). Под _lock."""
+        if self._watched.get(symbol) is st:
+            del self._watched[symbol]
+
+    def watched(self) -> list:
+        with self._lock:
+            return list(self._watched)
+
+    def update(self, sizes: dict, now: float = None):
+        """Один тик по готовому снимку {symbol: size} всех позиций (REST-опрос)."""
+        now = now or time.time()
+        with self._lock:
+            items = list(self._watched.items())
+        for symbol, st in items:
+            self._check(symbol, st, sizes.get(symbol, 0), now)
+
+    def on_position(self, symbol: str, size, now: float = None):
+        """
+        Событие позиции из приватного стрима. Стрим упорядочен, поэтому нулевой
+        размер сразу считается финальным — без ожидания подтверждений опросом.
+        """
+        with self._lock:
+            st = self._watched.get(symbol)
+        if st is not None:
+            self._check(symbol, st, size, now or time.time(), confirmed=True)
+
+    def _check(self, symbol: str, st: dict, size, now: float, confirmed: bool = False):
+        """
+        st — снимок наблюдения, взятый до запроса/события. Если за это время новая сделка
+        перезапустила watch того же символа, тик относится к старой позиции: новое
+        наблюдение не трогаем и чистку (она снимет ордера новой сделки) не зовём.
+        """
+        size = abs(float(size or 0))
+        with self._lock:
+            if self._watched.get(symbol) is not st:
+                return
+            if not confirmed and now - st["since"] < self.grace:
+                return  # ждём, пока биржа отразит новую позицию (стрим упорядочен — ему не нужно)
+            if now - st["since"] > self.max_age:
+                self._drop(symbol, st)
+                timed_out = True
+            else:
+                timed_out = False
+                if size > st["tiny"]:
+                    st["flat_count"] = 0  # сброс если снова есть объём
+                    return
+                st["flat_count"] = self.flat_confirmations if confirmed else st["flat_count"] + 1
+                attempt = st["flat_count"]
+                final = attempt >= self.flat_confirmations
+                if final:
+                    self._drop(symbol, st)
+        if timed_out:
+            jsonlog.event(f"⏳ {symbol}: cleanup timed out (возможно, позиция не закрыта)", logging.WARNING)
+            return
+        jsonlog.event(f"🔍 {symbol}: позиция нулевая ({size}), попытка чистки {attempt}/{self.flat_confirmations}")
+        try:
+            st["on_flat"](symbol, final)
+        except Exception as e:
+            jsonlog.event(f"⚠️ {self.name} {symbol}: cleanup callback failed: {e}", logging.WARNING)
+
+    # =============== ЦИКЛ ===============
+    def _ensure_thread(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+        threading.Thread(target=self._loop, name=self.name, daemon=True).start()
+
+    def _loop(self):
+        rate_limit.mark_background()
+        while True:
+            if not self.watched():
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            time.sleep(self.interval)
+            try:
+                sizes = self.fetch_positions()
+            except Exception as e:
+                jsonlog.event(f"⚠️ {self.name}: {e}", logging.WARNING)
+                continue
+            if sizes is None:
+                continue
+            self.update(sizes)
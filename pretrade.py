@@ -0,0 +1,115 @@
+# pretrade.py — подготовка сделки как маленький граф зависимостей на общем пуле потоков
+#
+#   plan = pretrade.Plan("webhook_okx")
+#   plan.veto_if("position", "blocked_existing_state", okx_has_position, inst_id)
+#   plan.add("leverage", set_okx_leverage, inst_id, OKX_LEVERAGE)
+#   plan.add("instrument", get_okx_inst_info, inst_id)
+#   plan.add("sizing", calc_sz_from_risk_okx, entry, sl, risk, inst_id, deps=("instrument",))
+#   res = plan.run()      # {"leverage": ..., "instrument": ..., "sizing": ...} или Abort
+#
+# Узел стартует, как только готовы его зависимости; независимые узлы идут параллельно,
+# и подготовка занимает столько, сколько самый медленный путь графа. Первый отказ
+# (Veto или исключение) отменяет всё, что ещё не запущено, и run() сразу поднимает
+# Abort; уже летящие запросы дорабатывают в фоне, их результат отбрасывается.
+# Размещение ордера — не узел: его делает вызывающий после успешного run().
+
+import os, time, threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import metrics, tracing
+
+PRETRADE_WORKERS = int(os.getenv("PRETRADE_WORKERS", "16"))
+PRETRADE_TIMEOUT_SEC = float(os.getenv("PRETRADE_TIMEOUT_SEC", "15"))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def pool() -> ThreadPoolExecutor:
+    """Общий пул на процесс (после fork gunicorn — новый: потоки родителя не наследуются)."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool_pid != pid:
+        with _pool_lock:
+            if _pool_pid != pid:
+                _pool = ThreadPoolExecutor(max_workers=PRETRADE_WORKERS, thread_name_prefix="pretrade")
+                _pool_pid = pid
+    return _pool
+
+class Veto(Exception):
+    """Узел решил, что сделки не будет; status уходит в ответ вебхука."""
+    def __init__(self, status: str):
+        super().__init__(status)
+        self.status = status
+
+class Abort(Exception):
+    """run() прерван: node — на каком узле, status — Veto.status или pretrade_error/pretrade_timeout."""
+    def __init__(self, node: str, status: str, error: Exception = None):
+        super().__init__(f"{node}: {status}" + (f" ({error})" if error else ""))
+        self.node, self.status, self.error = node, status, error
+
+def _raise_if(status: str, fn, *args):
+    if fn(*args):
+        raise Veto(status)
+
+class Plan:
+    def __init__(self, route: str):
+        self.route = route
+        self._nodes = {}  # key -> (fn, args, deps)
+
+    def add(self, key: str, fn, *args, deps=()):
+        self._nodes[key] = (fn, args, tuple(deps))
+        return self
+
+    def veto_if(self, key: str, status: str, fn, *args, deps=()):
+        """Узел-проверка: fn(*args) истинно → Veto(status)."""
+        return self.add(key, _raise_if, status, fn, *args, deps=deps)
+
+    def _node(self, key: str, fn, args):
+        t0 = time.perf_counter()
+        with tracing.span(key):
+            try:
+                return fn(*args)
+            finally:
+                metrics.stage_seconds.observe(time.perf_counter() - t0, self.route, key)
+
+    def run(self, timeout: float = None) -> dict:
+        for key, (_fn, _args, deps) in self._nodes.items():
+            missing = [d for d in deps if d not in self._nodes]
+            if missing:
+                raise ValueError(f"pretrade {self.route}: {key} зависит от неизвестных {missing}")
+        deadline = time.monotonic() + (PRETRADE_TIMEOUT_SEC if timeout is None else timeout)
+        waiting = dict(self._nodes)
+        running = {}
+        results = {}
+        ex = pool()
+
+        def launch():
+            for key, (fn, args, deps) in list(waiting.items()):
+                if all(d in results for d in deps):
+                    del waiting[key]
+                    running[ex.submit(tracing.bind(self._node), key, fn, args)] = key
+
+        def abort(node: str, status: str, error: Exception = None):
+            for f in running:
+                f.cancel()
+            waiting.clear()
+            raise Abort(node, status, error)
+
+        launch()
+        while running:
+            done, _ = wait(running, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                abort(",".join(sorted(running.values())), "pretrade_timeout", TimeoutError("pretrade deadline"))
+            for f in done:
+                key = running.pop(f)
+                try:
+                    results[key] = f.result()
+                except Veto as v:
+                    abort(key, v.status)
+                except Exception as e:
+                    abort(key, "pretrade_error", e)
+            launch()
+        if waiting:
+            raise ValueError(f"pretrade {self.route}: цикл зависимостей {sorted(waiting)}")
+        return results
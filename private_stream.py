@@ -0,0 +1,300 @@
+# private_stream.py — приватные WebSocket-стримы Bybit v5 / OKX v5
+#
+# Переподключающийся клиент: auth → subscribe → приём событий → пинги.
+# Каждое событие применяется к AccountState (позиции / ордера / алго-ордера в памяти)
+# и публикуется подписчикам (чистка ордеров, учёт закрытых сделок).
+
+import os, time, json, hmac, hashlib, base64, random, logging, threading
+from abc import ABC, abstractmethod
+
+import websocket  # websocket-client
+
+import jsonlog
+
+BYBIT_WS_PRIVATE_URL = os.getenv("BYBIT_WS_PRIVATE_URL", "wss://stream.bybit.com/v5/private")
+OKX_WS_PRIVATE_URL = os.getenv("OKX_WS_PRIVATE_URL", "wss://ws.okx.com:8443/ws/v5/private")
+
+# =============== СОСТОЯНИЕ АККАУНТА ===============
+class AccountState:
+    """
+    Позиции / открытые ордера / алго-ордера по площадкам и инструментам.
+    connected[venue] — стрим жив и подписан; connected_at[venue] — время последней подписки
+    (события до неё стрим не присылает); updated_at[venue] — время последнего события.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.positions = {}    # venue -> {inst: size}
+        self.orders = {}       # venue -> {inst: {order_id: order}}
+        self.algo_orders = {}  # venue -> {inst: {algo_id: order}}
+        self.connected = {}
+        self.connected_at = {}
+        self.updated_at = {}
+
+    def _touch(self, venue: str):
+        self.updated_at[venue] = time.time()
+
+    def set_connected(self, venue: str, ok: bool):
+        with self._lock:
+            self.connected[venue] = ok
+            self._touch(venue)
+            if ok:
+                self.connected_at[venue] = self.updated_at[venue]
+
+    def set_position(self, venue: str, inst: str, size: float):
+        with self._lock:
+            self.positions.setdefault(venue, {})[inst] = abs(size)
+            self._touch(venue)
+
+    def _set_order(self, book: dict, venue: str, inst: str, order_id: str, order: dict, live: bool):
+        per_inst = book.setdefault(venue, {}).setdefault(inst, {})
+        if live:
+            per_inst[order_id] = order
+        else:
+            per_inst.pop(order_id, None)
+        self._touch(venue)
+
+    def set_order(self, venue: str, inst: str, order_id: str, order: dict, live: bool):
+        with self._lock:
+            self._set_order(self.orders, venue, inst, order_id, order, live)
+
+    def set_algo_order(self, venue: str, inst: str, algo_id: str, order: dict, live: bool):
+        with self._lock:
+            self._set_order(self.algo_orders, venue, inst, algo_id, order, live)
+
+    def replace(self, venue: str, positions: dict, orders: dict, algo_orders: dict):
+        """Полный снимок площадки из REST (account_cache): заменяет всё, что было по venue."""
+        with self._lock:
+            self.positions[venue] = {k: abs(v) for k, v in positions.items()}
+            self.orders[venue] = orders
+            self.algo_orders[venue] = algo_orders
+            self._touch(venue)
+
+    def position_size(self, venue: str, inst: str) -> float:
+        with self._lock:
+            return self.positions.get(venue, {}).get(inst, 0.0)
+
+    def has_orders(self, venue: str, inst: str) -> bool:
+        with self._lock:
+            return bool(self.orders.get(venue, {}).get(inst))
+
+    def has_algo_orders(self, venue: str, inst: str) -> bool:
+        with self._lock:
+            return bool(self.algo_orders.get(venue, {}).get(inst))
+
+account_state = AccountState()
+
+# =============== БАЗОВЫЙ КЛИЕНТ ===============
+class _PrivateStream(ABC):
+    venue = ""
+    ping_interval = 20.0
+
+    def __init__(self, url: str, state: AccountState = None):
+        self.url = url
+        self.state = state or account_state
+        self._subscribers = []
+        self._stop = threading.Event()
+        self._ws = None
+        self._thread = None
+        self.reconnects = 0
+
+    def subscribe(self, fn):
+        """fn(event) — event = {"venue", "type": position|order|algo|execution, "inst", "data"}."""
+        self._subscribers.append(fn)
+
+    def _publish(self, typ: str, inst: str, data: dict):
+        event = {"venue": self.venue, "type": typ, "inst": inst, "data": data}
+        for fn in list(self._subscribers):
+            try:
+                fn(event)
+            except Exception as e:
+                jsonlog.event(f"⚠️ {self.venue} stream subscriber failed: {e}", logging.WARNING)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"{self.venue}-private-ws", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    # --- протокол площадки ---
+    @abstractmethod
+    def _login(self, ws):
+        """Отправить auth и дождаться подтверждения (исключение — логин не удался)."""
+
+    @abstractmethod
+    def _subscribe_topics(self, ws):
+        """Подписаться на приватные топики площадки."""
+
+    @abstractmethod
+    def _ping(self, ws):
+        """Пинг в формате площадки."""
+
+    @abstractmethod
+    def _handle(self, msg):
+        """Одно разобранное сообщение стрима → AccountState и подписчики."""
+
+    # --- цикл ---
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self._session()
+                backoff = 1.0
+            except Exception as e:
+                jsonlog.event(f"⚠️ {self.venue} private stream: {e}", logging.WARNING)
+            self.state.set_connected(self.venue, False)
+            if self._stop.is_set():
+                break
+            self.reconnects += 1
+            time.sleep(backoff + random.uniform(0, backoff / 2))
+            backoff = min(backoff * 2, 30.0)
+
+    def _session(self):
+        ws = websocket.create_connection(self.url, timeout=10)
+        self._ws = ws
+        try:
+            self._login(ws)
+            self._subscribe_topics(ws)
+            self.state.set_connected(self.venue, True)
+            jsonlog.event(f"🔌 {self.venue} private stream connected")
+            ws.settimeout(self.ping_interval)
+            while not self._stop.is_set():
+                try:
+                    raw = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    self._ping(ws)
+                    continue
+                if not raw:
+                    raise ConnectionError("stream closed")
+                if raw == "pong":
+                    continue
+                self._handle(json.loads(raw))
+        finally:
+            self._ws = None
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def _expect(self, ws, ok, what: str):
+        """Ждёт ответ на auth/login; ok(msg) -> True/False/None (None — чужое сообщение, ждём дальше)."""
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            msg = json.loads(ws.recv())
+            verdict = ok(msg)
+            if verdict is None:
+                continue
+            if not verdict:
+                raise PermissionError(f"{self.venue} {what} rejected: {msg}")
+            return msg
+        raise TimeoutError(f"{self.venue} {what} timeout")
+
+# =============== BYBIT ===============
+class BybitPrivateStream(_PrivateStream):
+    venue = "bybit"
+    topics = ("position.linear", "order.linear", "execution.linear")
+
+    def __init__(self, api_key: str, api_secret: str, url: str = None, state: AccountState = None):
+        super().__init__(url or BYBIT_WS_PRIVATE_URL, state)
+        self.api_key = api_key
+        self.api_secret = api_secret
+
+    def _login(self, ws):
+        expires = int((time.time() + 10) * 1000)
+        sign = hmac.new(self.api_secret.encode(), f"GET/realtime{expires}".encode(), hashlib.sha256).hexdigest()
+        ws.send(json.dumps({"op": "auth", "args": [self.api_key, expires, sign]}))
+        self._expect(ws, lambda m: m.get("success") if m.get("op") == "auth" else None, "auth")
+
+    def _subscribe_topics(self, ws):
+        ws.send(json.dumps({"op": "subscribe", "args": list(self.topics)}))
+
+    def _ping(self, ws):
+        ws.send(json.dumps({"op": "ping"}))
+
+    def _handle(self, msg):
+        topic = msg.get("topic") or ""
+        if not topic:
+            if msg.get("op") == "subscribe" and not msg.get("success"):
+                jsonlog.event(f"❌ bybit subscribe failed: {msg}", logging.ERROR)
+            return
+        for d in msg.get("data") or []:
+            sym = d.get("symbol", "")
+            if topic.startswith("position"):
+                size = float(d.get("size") or 0)
+                self.state.set_position(self.venue, sym, size)
+                self._publish("position", sym, d)
+            elif topic.startswith("order"):
+                live = d.get("orderStatus") in ("New", "PartiallyFilled", "Untriggered")
+                if d.get("stopOrderType"):  # TP/SL/Stop — условные ордера
+                    self.state.set_algo_order(self.venue, sym, d.get("orderId", ""), d, live)
+                else:
+                    self.state.set_order(self.venue, sym, d.get("orderId", ""), d, live)
+                self._publish("order", sym, d)
+            elif topic.startswith("execution"):
+                self._publish("execution", sym, d)
+
+# =============== OKX ===============
+class OkxPrivateStream(_PrivateStream):
+    venue = "okx"
+    ping_interval = 25.0
+    channels = ("positions", "orders", "orders-algo")
+
+    def __init__(self, api_key: str, api_secret: str, passphrase: str, url: str = None, state: AccountState = None):
+        super().__init__(url or OKX_WS_PRIVATE_URL, state)
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.passphrase = passphrase
+
+    def _login(self, ws):
+        ts = str(int(time.time()))
+        sign = base64.b64encode(
+            hmac.new(self.api_secret.encode(), f"{ts}GET/users/self/verify".encode(), digestmod="sha256").digest()
+        ).decode()
+        ws.send(json.dumps({"op": "login", "args": [{
+            "apiKey": self.api_key, "passphrase": self.passphrase, "timestamp": ts, "sign": sign,
+        }]}))
+        self._expect(
+            ws,
+            lambda m: (str(m.get("code")) == "0") if m.get("event") in ("login", "error") else None,
+            "login",
+        )
+
+    def _subscribe_topics(self, ws):
+        args = [{"channel": ch, "instType": "SWAP"} for ch in self.channels]
+        ws.send(json.dumps({"op": "subscribe", "args": args}))
+
+    def _ping(self, ws):
+        ws.send("ping")
+
+    def _handle(self, msg):
+        if msg.get("event") == "error":
+            jsonlog.event(f"❌ okx stream error: {msg}", logging.ERROR)
+            return
+        channel = (msg.get("arg") or {}).get("channel")
+        if not channel:
+            return
+        for d in msg.get("data") or []:
+            inst = d.get("instId", "")
+            if channel == "positions":
+                self.state.set_position(self.venue, inst, float(d.get("pos") or 0))
+                self._publish("position", inst, d)
+            elif channel == "orders":
+                live = d.get("state") in ("live", "partially_filled")
+                self.state.set_order(self.venue, inst, d.get("ordId", ""), d, live)
+                self._publish("order", inst, d)
+                if d.get("fillSz") not in (None, "", "0"):
+                    self._publish("execution", inst, d)
+            elif channel == "orders-algo":
+                live = d.get("state") in ("live", "partially_effective")
+                self.state.set_algo_order(self.venue, inst, d.get("algoId", ""), d, live)
+                self._publish("algo", inst, d)
@@ -0,0 +1,238 @@
+# rate_limit.py — клиентский лимит запросов к биржам: token bucket на площадку и группу эндпоинтов
+#
+# Каждый исходящий запрос (http_clients.http_request) сначала берёт токен из ведра
+# своей группы (самый длинный совпавший префикс пути в LIMITS) и, если задано, из
+# общего ведра площадки (VENUE_LIMITS: IP-лимит Bybit). Вёдра стартуют с
+# документированных лимитов и подстраиваются по ответам:
+#   Bybit X-Bapi-Limit / X-Bapi-Limit-Status / X-Bapi-Limit-Reset-Timestamp —
+#     лимит группы и сколько реально осталось в окне (общий на UID для всех воркеров);
+#   отказ по лимиту (HTTP 429, retCode 10006/10018, OKX 50011/50061) — ведро
+#     опустошается до конца окна, скорость режется вдвое и потом плавно восстанавливается.
+#
+# Приоритеты: ORDER (размещение/отмена ордеров, плечо — по группе) > NORMAL (вебхук)
+# > BACKGROUND (поток, вызвавший mark_background(): мониторы, кэш аккаунта, справочники).
+# Фоновый запрос берёт токен, только если в ведре остаётся резерв RATE_LIMIT_RESERVE
+# и никто приоритетнее не ждёт. Ждать дольше RATE_LIMIT_MAX_WAIT_SEC запрос не будет:
+# уходит как есть (rate_limit_overrun_total), решать тогда будет биржа.
+#
+# Вёдра — на процесс. Под gunicorn -w N задайте RATE_LIMIT_SCALE≈1/N (для Bybit
+# заголовки и так сообщают общий остаток).
+
+import os, time, logging, threading, contextvars
+
+import jsonlog, metrics, tracing
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_SCALE = float(os.getenv("RATE_LIMIT_SCALE", "1.0"))
+RATE_LIMIT_RESERVE = float(os.getenv("RATE_LIMIT_RESERVE", "0.3"))
+RATE_LIMIT_MAX_WAIT_SEC = float(os.getenv("RATE_LIMIT_MAX_WAIT_SEC", "5"))
+RATE_LIMIT_BACKGROUND_MAX_WAIT_SEC = float(os.getenv("RATE_LIMIT_BACKGROUND_MAX_WAIT_SEC", "30"))
+
+BACKGROUND, NORMAL, ORDER = 0, 1, 2
+_PRIORITY_NAMES = {BACKGROUND: "background", NORMAL: "normal", ORDER: "order"}
+
+# (запросов, окно в секундах[, ORDER]) по префиксу пути; "" — остальные эндпоинты площадки
+LIMITS = {
+    "bybit": {  # лимиты на UID, окно 1 с
+        "": (10, 1),
+        "/v5/order/create": (10, 1, ORDER),
+        "/v5/order/cancel-all": (10, 1, ORDER),
+        "/v5/order/realtime": (50, 1),
+        "/v5/order/history": (50, 1),
+        "/v5/position/list": (50, 1),
+        "/v5/position/set-leverage": (10, 1, ORDER),
+        "/v5/position/closed-pnl": (50, 1),
+        "/v5/execution/list": (50, 1),
+        "/v5/market/": (120, 1),
+    },
+    "okx": {  # окно 2 с
+        "": (10, 2),
+        "/api/v5/trade/order": (60, 2, ORDER),
+        "/api/v5/trade/order-algo": (20, 2, ORDER),
+        "/api/v5/trade/close-position": (20, 2, ORDER),
+        "/api/v5/trade/orders-pending": (60, 2),
+        "/api/v5/trade/orders-algo-pending": (20, 2),
+        "/api/v5/trade/fills": (60, 2),
+        "/api/v5/account/positions": (10, 2),
+        "/api/v5/account/config": (5, 2),
+        "/api/v5/account/set-leverage": (20, 2, ORDER),
+        "/api/v5/public/instruments": (20, 2),
+        "/api/v5/public/time": (10, 2),
+        "/api/v5/market/": (20, 2),
+    },
+}
+# общий лимит площадки поверх групп (Bybit: 600 запросов за 5 с с одного IP)
+VENUE_LIMITS = {"bybit": (600, 5)}
+
+_LIMIT_CODES = {"bybit": ("10006", "10018"), "okx": ("50011", "50061")}
+_RECOVER_PER_SEC = 0.05  # доля исходной скорости, возвращаемая за секунду после отказа
+
+_priority = contextvars.ContextVar("rate_limit_priority", default=NORMAL)
+
+def mark_background():
+    """Запросы текущего потока — фоновые (вызывать в начале цикла фонового потока)."""
+    _priority.set(BACKGROUND)
+
+class Bucket:
+    def __init__(self, name: str, count: float, window: float, priority: int = NORMAL):
+        self.name = name
+        self.priority = priority
+        self.window = window
+        self.base_rate = count * RATE_LIMIT_SCALE / window  # токенов в секунду
+        self.rate = self.base_rate
+        self.burst = max(1.0, count * RATE_LIMIT_SCALE)
+        self.tokens = self.burst
+        self.blocked_until = 0.0
+        self.updated = time.monotonic()
+        self.waiting = {BACKGROUND: 0, NORMAL: 0, ORDER: 0}  # кто ждёт токен этого ведра
+
+    def _refill(self, now: float):
+        dt = now - self.updated
+        self.updated = now
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * _RECOVER_PER_SEC * dt)
+        if now >= self.blocked_until:
+            self.tokens = min(self.burst, self.tokens + dt * self.rate)
+
+    def wait_for(self, now: float, priority: int) -> float:
+        """Сколько ждать токена для priority (0 — можно брать сейчас)."""
+        self._refill(now)
+        if any(n for p, n in self.waiting.items() if p > priority):
+            return 1.0 / self.rate  # первым берёт тот, кто приоритетнее
+        need = 1.0 + (self.burst * RATE_LIMIT_RESERVE if priority == BACKGROUND else 0.0)
+        need = min(need, self.burst)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1.0
+
+    def adapt(self, limit: int, remaining: int, reset_in: float):
+        """Ответ Bybit: лимит группы и остаток в текущем окне."""
+        count = limit * RATE_LIMIT_SCALE
+        if limit > 0 and abs(count - self.burst) > 1e-9:
+            self.burst = max(1.0, count)
+            self.base_rate = self.rate = count / self.window
+        self.tokens = min(self.tokens, remaining * RATE_LIMIT_SCALE)
+        if remaining <= 0:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + min(self.window, max(0.0, reset_in)))
+
+    def penalize(self):
+        """Биржа ответила «слишком часто»: до конца окна — ничего, потом вдвое медленнее."""
+        self.tokens = 0.0
+        self.blocked_until = time.monotonic() + self.window
+        self.rate = max(self.base_rate * 0.1, self.rate * 0.5)
+
+    def status(self) -> dict:
+        self._refill(time.monotonic())
+        return {"tokens": round(self.tokens, 2), "burst": self.burst, "rate": round(self.rate, 2),
+                "base_rate": round(self.base_rate, 2), "priority": _PRIORITY_NAMES[self.priority],
+                "blocked_sec": round(max(0.0, self.blocked_until - time.monotonic()), 3),
+                "waiting": {_PRIORITY_NAMES[p]: n for p, n in self.waiting.items() if n}}
+
+class VenueLimiter:
+    def __init__(self, venue: str, groups: dict, venue_limit=None):
+        self.venue = venue
+        self.groups = {prefix: Bucket(prefix or "*", *spec) for prefix, spec in groups.items()}
+        self.shared = Bucket("venue", *venue_limit) if venue_limit else None
+        self._cond = threading.Condition()
+
+    def group(self, path: str) -> Bucket:
+        best = ""
+        for prefix in self.groups:
+            if prefix and path.startswith(prefix) and len(prefix) > len(best):
+                best = prefix
+        return self.groups[best]
+
+    def acquire(self, path: str) -> float:
+        """Взять токен (ждёт при нехватке). -> сколько секунд ждали."""
+        bucket = self.group(path)
+        buckets = (bucket, self.shared) if self.shared else (bucket,)
+        priority = max(_priority.get(), bucket.priority)
+        max_wait = RATE_LIMIT_BACKGROUND_MAX_WAIT_SEC if priority == BACKGROUND else RATE_LIMIT_MAX_WAIT_SEC
+        t0 = time.monotonic()
+        deadline = t0 + max_wait
+        with self._cond:
+            queued = False
+            while True:
+                now = time.monotonic()
+                wait = max(b.wait_for(now, priority) for b in buckets)
+                if wait <= 0:
+                    break
+                if now >= deadline:
+                    overrun_total.inc(self.venue, bucket.name)
+                    break
+                if not queued:
+                    queued = True
+                    for b in buckets:
+                        b.waiting[priority] += 1
+                self._cond.wait(min(max(wait, 0.005), deadline - now))
+            if queued:
+                for b in buckets:
+                    b.waiting[priority] -= 1
+                self._cond.notify_all()
+            for b in buckets:
+                b.take()
+        waited = time.monotonic() - t0
+        if waited > 0.001:
+            throttled_total.inc(self.venue, bucket.name, _PRIORITY_NAMES[priority])
+            wait_seconds.inc(self.venue, bucket.name, n=waited)
+        return waited
+
+    def observe(self, path: str, resp):
+        bucket = self.group(path)
+        h = resp.headers
+        # код ошибки — из начала тела, без декодирования всего ответа (справочники бывают в мегабайты)
+        head = resp.content[:300].decode("utf-8", "replace")
+        limited = resp.status_code == 429 or tracing.response_codes(head).get("ret") in _LIMIT_CODES.get(self.venue, ())
+        with self._cond:
+            if h.get("X-Bapi-Limit-Status") is not None:
+                try:
+                    reset_in = (int(h.get("X-Bapi-Limit-Reset-Timestamp") or 0) / 1000) - time.time()
+                    bucket.adapt(int(h.get("X-Bapi-Limit") or 0), int(h["X-Bapi-Limit-Status"]), reset_in)
+                except ValueError:
+                    pass
+            if limited:
+                bucket.penalize()
+                hits_total.inc(self.venue, bucket.name)
+            self._cond.notify_all()
+        if limited:
+            jsonlog.event(f"🐢 {self.venue} {path}: биржа ограничила частоту запросов, группа {bucket.name} притормаживает", logging.WARNING)
+
+    def status(self) -> dict:
+        with self._cond:
+            out = {"venue": self.venue, "groups": {b.name: b.status() for b in self.groups.values()}}
+            if self.shared:
+                out["venue_bucket"] = self.shared.status()
+        return out
+
+_limiters = {v: VenueLimiter(v, groups, VENUE_LIMITS.get(v)) for v, groups in LIMITS.items()}
+
+def acquire(venue: str, path: str) -> float:
+    lim = _limiters.get(venue)
+    return lim.acquire(path) if lim and RATE_LIMIT_ENABLED else 0.0
+
+def observe(venue: str, path: str, resp):
+    lim = _limiters.get(venue)
+    if lim and RATE_LIMIT_ENABLED:
+        lim.observe(path, resp)
+
+def status() -> list:
+    return [{"enabled": RATE_LIMIT_ENABLED, **lim.status()} for lim in _limiters.values()]
+
+throttled_total = metrics.Counter(
+    "rate_limit_throttled_total", "Requests delayed by the client-side rate limiter", ("venue", "group", "priority"))
+wait_seconds = metrics.Counter(
+    "rate_limit_wait_seconds_total", "Time spent waiting for rate limit tokens", ("venue", "group"))
+overrun_total = metrics.Counter(
+    "rate_limit_overrun_total", "Requests sent without a token after the max wait", ("venue", "group"))
+hits_total = metrics.Counter(
+    "rate_limit_hits_total", "Responses where the exchange reported a rate limit", ("venue", "group"))
+
+def _tokens() -> dict:
+    return {(v, b.name): round(b.tokens, 2) for v, lim in _limiters.items() for b in lim.groups.values()}
+
+metrics.Gauge("rate_limit_tokens", "Tokens left in each rate limit bucket", _tokens, ("venue", "group"))
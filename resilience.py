@@ -0,0 +1,213 @@
+# resilience.py — повторы с джиттером и circuit breaker для вызовов бирж
+#
+# Повторы (call): политика по эндпоинту — сколько доп. попыток и общий дедлайн.
+# Повторяются только идемпотентные запросы: чтения, отмены, set-leverage (то же
+# плечо). Размещение ордера не повторяется: ответ мог потеряться после того, как
+# биржа ордер приняла. Повод для повтора — сетевая ошибка / таймаут, HTTP 5xx или
+# 429, временный код площадки (TRANSIENT_CODES). Пауза — «full jitter»:
+# uniform(0, min(RETRY_CAP_SEC, RETRY_BASE_SEC * 2^попытка)); попытка, которая не
+# успевает к дедлайну, не делается.
+#
+# Circuit breaker — на площадку, в http_clients.http_request: все запросы к ней
+# (подписанные и публичные) пишут исход. Сбой — исключение сети, HTTP 5xx или
+# серверный код площадки; бизнес-ошибки и лимиты — не сбой (площадка отвечает).
+# Если за BREAKER_WINDOW_SEC набралось ≥ BREAKER_MIN_CALLS исходов и доля сбоев
+# ≥ BREAKER_FAILURE_RATIO, breaker открывается на BREAKER_OPEN_SEC: запросы сразу
+# получают CircuitOpen, вебхук отвечает 503 venue_unavailable вместо ожидания
+# таймаутов. Потом half-open: первый исход решает — закрыть или открыть снова
+# (с удвоенной паузой, до BREAKER_OPEN_MAX_SEC).
+
+import os, time, random, logging, threading
+from collections import deque
+
+import requests
+
+import jsonlog, metrics, tracing
+
+RETRY_BASE_SEC = float(os.getenv("RETRY_BASE_SEC", "0.25"))
+RETRY_CAP_SEC = float(os.getenv("RETRY_CAP_SEC", "2"))
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "true").lower() == "true"
+BREAKER_WINDOW_SEC = float(os.getenv("BREAKER_WINDOW_SEC", "30"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "8"))
+BREAKER_FAILURE_RATIO = float(os.getenv("BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_OPEN_SEC = float(os.getenv("BREAKER_OPEN_SEC", "20"))
+BREAKER_OPEN_MAX_SEC = float(os.getenv("BREAKER_OPEN_MAX_SEC", "300"))
+
+# (доп. попыток, дедлайн в секундах) по точному пути; нет в таблице — GET: DEFAULT_READ,
+# прочие методы: без повторов
+DEFAULT_READ = (2, 6.0)
+POLICIES = {
+    "bybit": {
+        "/v5/order/create": (0, 0.0),
+        "/v5/order/cancel-all": (3, 8.0),
+        "/v5/position/set-leverage": (2, 5.0),
+    },
+    "okx": {
+        "/api/v5/trade/order": (0, 0.0),
+        "/api/v5/trade/order-algo": (0, 0.0),
+        "/api/v5/trade/cancel-order": (3, 8.0),
+        "/api/v5/trade/cancel-algos": (3, 8.0),
+        "/api/v5/trade/close-position": (2, 6.0),
+        "/api/v5/account/set-leverage": (2, 5.0),
+    },
+}
+
+# серверные коды площадки: сбой для breaker и повод для повтора
+SERVER_ERROR_CODES = {"bybit": {"10016"}, "okx": {"50001", "50004", "50013", "50026"}}
+# лимит частоты: повод для повтора (ведро rate_limit уже притормозит), но не сбой
+TRANSIENT_CODES = {
+    "bybit": SERVER_ERROR_CODES["bybit"] | {"10006", "10018"},
+    "okx": SERVER_ERROR_CODES["okx"] | {"50011", "50061"},
+}
+_CODE_FIELD = {"bybit": "retCode", "okx": "code"}
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitOpen(Exception):
+    """Площадка деградировала — запрос не отправлялся."""
+    def __init__(self, venue: str, retry_in: float):
+        super().__init__(f"{venue}: circuit open, retry in {retry_in:.1f}s")
+        self.venue, self.retry_in = venue, retry_in
+
+class Breaker:
+    def __init__(self, venue: str):
+        self.venue = venue
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.open_for = BREAKER_OPEN_SEC
+        self.stats = {"trips": 0, "rejected": 0}
+        self._outcomes = deque()  # (время, ok)
+        self._lock = threading.Lock()
+
+    def check(self):
+        """CircuitOpen, пока открыт; по истечении паузы — half-open, запросы идут."""
+        if not BREAKER_ENABLED or self.state == CLOSED:
+            return
+        with self._lock:
+            if self.state == OPEN:
+                left = self.opened_at + self.open_for - time.monotonic()
+                if left > 0:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpen(self.venue, left)
+                self.state = HALF_OPEN
+                jsonlog.event(f"🟡 breaker {self.venue}: half-open, пробуем площадку", logging.WARNING)
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if ok:
+                    self.state = CLOSED
+                    self.open_for = BREAKER_OPEN_SEC
+                    self._outcomes.clear()
+                    jsonlog.event(f"🟢 breaker {self.venue}: закрыт, площадка отвечает")
+                else:
+                    self._trip(now, min(BREAKER_OPEN_MAX_SEC, self.open_for * 2))
+                return
+            if self.state == OPEN:
+                return  # ответы запросов, ушедших до срабатывания
+            self._outcomes.append((now, ok))
+            while self._outcomes and self._outcomes[0][0] < now - BREAKER_WINDOW_SEC:
+                self._outcomes.popleft()
+            n = len(self._outcomes)
+            failed = sum(1 for _, good in self._outcomes if not good)
+            if not ok and n >= BREAKER_MIN_CALLS and failed / n >= BREAKER_FAILURE_RATIO:
+                self._trip(now, BREAKER_OPEN_SEC)
+
+    def _trip(self, now: float, open_for: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.open_for = open_for
+        self.stats["trips"] += 1
+        self._outcomes.clear()
+        jsonlog.event(f"🔴 breaker {self.venue}: открыт на {open_for:.0f}с — площадка деградировала", logging.ERROR)
+
+    def status(self) -> dict:
+        with self._lock:
+            n = len(self._outcomes)
+            failed = sum(1 for _, good in self._outcomes if not good)
+            left = max(0.0, self.opened_at + self.open_for - time.monotonic()) if self.state == OPEN else 0.0
+        return {"venue": self.venue, "enabled": BREAKER_ENABLED, "state": self.state,
+                "open_for_sec": self.open_for, "retry_in_sec": round(left, 1),
+                "window_calls": n, "window_failures": failed, **self.stats}
+
+_breakers = {v: Breaker(v) for v in POLICIES}
+
+def breaker(venue: str):
+    """Breaker площадки или None (Telegram и прочее — без breaker)."""
+    return _breakers.get(venue)
+
+def is_open(venue: str) -> bool:
+    b = _breakers.get(venue)
+    if b is None:
+        return False
+    try:
+        b.check()
+    except CircuitOpen:
+        return True
+    return False
+
+def server_failure(venue: str, resp) -> bool:
+    """Сбой площадки по ответу: 5xx или серверный код в начале тела."""
+    if resp.status_code >= 500:
+        return True
+    codes = SERVER_ERROR_CODES.get(venue)
+    if not codes:
+        return False
+    return tracing.response_codes(resp.content[:300].decode("utf-8", "replace")).get("ret") in codes
+
+# =============== ПОВТОРЫ ===============
+def policy(venue: str, method: str, path: str):
+    pol = POLICIES.get(venue, {}).get(path)
+    if pol is not None:
+        return pol
+    return DEFAULT_READ if method.upper() == "GET" else (0, 0.0)
+
+def transient_reason(venue: str, result) -> str:
+    """Почему ответ стоит повторить; "" — не стоит."""
+    if not isinstance(result, dict):
+        return ""
+    http = result.get("http")
+    if http is not None and (http >= 500 or http == 429):
+        return f"http_{http}"
+    code = str(result.get(_CODE_FIELD.get(venue, "code"), ""))
+    return f"code_{code}" if code in TRANSIENT_CODES.get(venue, ()) else ""
+
+def call(venue: str, method: str, path: str, send):
+    """
+    send() -> разобранный ответ (dict); каждая попытка заново берёт токен лимитера и
+    подписывается. Исключение сети после последней попытки пробрасывается.
+    """
+    retries, deadline_sec = policy(venue, method, path)
+    deadline = time.monotonic() + deadline_sec
+    b = _breakers.get(venue)
+    attempt = 0
+    while True:
+        if b is not None:
+            b.check()  # до токена лимитера и подписи
+        try:
+            result, exc = send(), None
+            reason = transient_reason(venue, result)
+        except requests.RequestException as e:
+            result, exc, reason = None, e, type(e).__name__
+        if not reason or attempt >= retries:
+            break
+        delay = random.uniform(0, min(RETRY_CAP_SEC, RETRY_BASE_SEC * 2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            break
+        attempt += 1
+        retries_total.inc(venue, path, reason)
+        jsonlog.event(f"🔁 {venue} {path}: {reason}, повтор {attempt}/{retries} через {delay:.2f}с", logging.WARNING)
+        time.sleep(delay)
+    if exc is not None:
+        raise exc
+    return result
+
+def status() -> list:
+    return [b.status() for b in _breakers.values()]
+
+retries_total = metrics.Counter(
+    "exchange_retries_total", "Retried exchange calls by reason", ("venue", "endpoint", "reason"))
+metrics.Gauge("circuit_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+              lambda: {(v,): _STATE_VALUE[b.state] for v, b in _breakers.items()}, ("venue",))
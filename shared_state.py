@@ -0,0 +1,204 @@
+# shared_state.py — общее для всех воркеров gunicorn состояние: кулдауны, TTL-локи, дедуп
+#
+# Раньше это были глобальные переменные модуля: под `gunicorn -w N` у каждого
+# воркера своя копия, и кулдаун/дедуп переставали работать. Бэкенд выбирается
+# STATE_BACKEND:
+#   sqlite (по умолчанию) — файл STATE_DB (WAL), общий для процессов на хосте;
+#   memory                — словарь процесса (один воркер, тесты, бенчмарки).
+#
+# Главный примитив — claim(key, ttl): атомарный compare-and-set «ключа нет или он
+# истёк → занять на ttl». Это и TTL-лок, и ключ дедупа, и кулдаун: из N воркеров,
+# одновременно пришедших с одним сигналом, claim выиграет ровно один.
+# Lease поверх claim/extend — «один процесс на хост» для фоновых задач, которым не
+# нужна копия в каждом воркере (мониторы, REST-снимки аккаунта).
+
+import os, time, socket, sqlite3, threading
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").lower()
+STATE_DB = os.getenv("STATE_DB", "/tmp/tv_state.sqlite3")
+_PURGE_EVERY_SEC = 60
+
+class MemoryState:
+    def __init__(self):
+        self._data = {}  # key -> (value, expires | None)
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, now: float):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def claim(self, key: str, ttl: float, value=None) -> bool:
+        now = time.time()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._data[key] = (value, now + ttl)
+            return True
+
+    def extend(self, key: str, value, ttl: float) -> bool:
+        """Продлить ключ на ttl, если он жив и занят именно value."""
+        now = time.time()
+        with self._lock:
+            item = self._live(key, now)
+            if item is None or item[0] != value:
+                return False
+            self._data[key] = (value, now + ttl)
+            return True
+
+    def release(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def ttl(self, key: str) -> float:
+        """Сколько секунд ключ ещё жив (0 — нет или истёк)."""
+        now = time.time()
+        with self._lock:
+            item = self._live(key, now)
+        return max(0.0, item[1] - now) if item and item[1] is not None else 0.0
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            item = self._live(key, time.time())
+        return default if item is None else item[0]
+
+    def put(self, key: str, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def incr(self, key: str, n: float = 1) -> float:
+        with self._lock:
+            item = self._live(key, time.time())
+            value = (float(item[0] or 0) if item else 0.0) + n
+            self._data[key] = (value, item[1] if item else None)
+            return value
+
+class SqliteState:
+    """Таблица kv(key, value, expires); каждая операция — один атомарный оператор SQLite."""
+
+    _SCHEMA = "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value, expires REAL)"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._purged = 0.0
+
+    def _db(self) -> sqlite3.Connection:
+        """Одно соединение на процесс (после fork — новое), доступ под _lock."""
+        pid = os.getpid()
+        if self._conn is None or self._pid != pid:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(self._SCHEMA)
+            self._conn, self._pid = conn, pid
+        return self._conn
+
+    def _purge(self, db, now: float):
+        if now - self._purged >= _PURGE_EVERY_SEC:
+            self._purged = now
+            db.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (now,))
+
+    def claim(self, key: str, ttl: float, value=None) -> bool:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            self._purge(db, now)
+            cur = db.execute(
+                "INSERT INTO kv(key, value, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value=excluded.value, expires=excluded.expires "
+                "WHERE kv.expires IS NOT NULL AND kv.expires <= ?",
+                (key, value, now + ttl, now),
+            )
+            return cur.rowcount == 1
+
+    def extend(self, key: str, value, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cur = self._db().execute(
+                "UPDATE kv SET expires=? WHERE key=? AND value=? AND expires > ?",
+                (now + ttl, key, value, now),
+            )
+            return cur.rowcount == 1
+
+    def release(self, key: str):
+        with self._lock:
+            self._db().execute("DELETE FROM kv WHERE key=?", (key,))
+
+    def ttl(self, key: str) -> float:
+        now = time.time()
+        with self._lock:
+            row = self._db().execute("SELECT expires FROM kv WHERE key=?", (key,)).fetchone()
+        return max(0.0, row[0] - now) if row and row[0] is not None else 0.0
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            row = self._db().execute(
+                "SELECT value FROM kv WHERE key=? AND (expires IS NULL OR expires > ?)", (key, time.time())
+            ).fetchone()
+        return default if row is None else row[0]
+
+    def put(self, key: str, value, ttl: float = None):
+        with self._lock:
+            self._db().execute(
+                "INSERT INTO kv(key, value, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value=excluded.value, expires=excluded.expires",
+                (key, value, time.time() + ttl if ttl else None),
+            )
+
+    def incr(self, key: str, n: float = 1) -> float:
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    "INSERT INTO kv(key, value, expires) VALUES (?, ?, NULL) "
+                    "ON CONFLICT(key) DO UPDATE SET value=COALESCE(kv.value, 0) + excluded.value",
+                    (key, n),
+                )
+                value = db.execute("SELECT value FROM kv WHERE key=?", (key,)).fetchone()[0]
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return float(value)
+
+class Lease:
+    """
+    Один держатель на хост (на store): held() продлевает аренду, если она наша, иначе
+    пробует занять свободную. Держатель упал — через ttl аренду подхватит другой процесс.
+    Вызывать чаще, чем раз в ttl.
+    """
+
+    def __init__(self, store, name: str, ttl: float):
+        self.store, self.key, self.ttl = store, f"lease:{name}", ttl
+
+    def owner(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"  # после fork — другой владелец
+
+    def held(self) -> bool:
+        me = self.owner()
+        return self.store.extend(self.key, me, self.ttl) or self.store.claim(self.key, self.ttl, me)
+
+def from_env():
+    if STATE_BACKEND == "memory":
+        return MemoryState()
+    if STATE_BACKEND == "sqlite":
+        return SqliteState(STATE_DB)
+    raise ValueError(f"STATE_BACKEND={STATE_BACKEND!r}: ожидается sqlite или memory")
+
+_default = None
+_default_lock = threading.Lock()
+
+def default():
+    """Store процесса: app.STATE, idempotency и account_cache — одно соединение и одна очистка."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = from_env()
+    return _default
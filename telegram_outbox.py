@@ -0,0 +1,172 @@
+# telegram_outbox.py — фоновая очередь отправки в Telegram
+#
+# Вебхук только кладёт сообщение в очередь и сразу идёт дальше. Фоновый поток
+# склеивает пачку сообщений в один sendMessage, соблюдает лимит чата
+# (TG_CHAT_MIN_INTERVAL_SEC между отправками) и отступает на 429 по retry_after.
+
+import os, time, queue, random, logging, threading, atexit
+
+import jsonlog, metrics, tracing
+from http_clients import http_get, http_post
+
+TG_OUTBOX_MAXSIZE = int(os.getenv("TG_OUTBOX_MAXSIZE", "1000"))
+TG_COALESCE_SEC = float(os.getenv("TG_COALESCE_SEC", "0.5"))
+TG_CHAT_MIN_INTERVAL_SEC = float(os.getenv("TG_CHAT_MIN_INTERVAL_SEC", "1.0"))
+TG_MAX_ATTEMPTS = int(os.getenv("TG_MAX_ATTEMPTS", "5"))
+TG_MAX_TEXT = 4096
+
+_q = queue.Queue(maxsize=TG_OUTBOX_MAXSIZE)
+_EVENTS = ("enqueued", "sent", "merged", "dropped", "failed", "retries")
+_last_sent = {}  # chat_id -> time.monotonic() последней отправки
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+metrics.Gauge("telegram_outbox_depth", "Messages waiting in the Telegram outbox", lambda: _q.qsize())
+events_total = metrics.Counter("telegram_outbox_events_total", "Telegram outbox events by kind", ("kind",))
+
+def _count(key: str, n: int = 1):
+    events_total.inc(key, n=n)
+
+def stats() -> dict:
+    out = {k: events_total.value(k) for k in _EVENTS}
+    out["depth"] = _q.qsize()
+    return out
+
+def _ensure_worker():
+    global _worker_pid
+    pid = os.getpid()
+    if _worker_pid == pid:
+        return
+    with _worker_lock:
+        if _worker_pid == pid:
+            return
+        _worker_pid = pid
+        threading.Thread(target=_worker_loop, name="tg-outbox", daemon=True).start()
+
+def _put(item: dict) -> bool:
+    _ensure_worker()
+    item["trace"] = tracing.current()
+    try:
+        _q.put_nowait(item)
+    except queue.Full:
+        _count("dropped")
+        jsonlog.event("⚠️ Telegram outbox full, message dropped", logging.WARNING)
+        return False
+    _count("enqueued")
+    return True
+
+# =============== ПУБЛИЧНОЕ API ===============
+def send_message(token: str, chat_id: str, text: str, parse_mode: str = None) -> bool:
+    """Неблокирующая постановка в очередь. False — очередь переполнена, сообщение отброшено."""
+    return _put({"kind": "message", "token": token, "chat_id": chat_id, "text": text, "parse_mode": parse_mode})
+
+def send_document(token: str, chat_id: str, filepath: str, caption: str = "") -> bool:
+    """Файл читается в момент отправки; документы не склеиваются."""
+    return _put({"kind": "document", "token": token, "chat_id": chat_id, "filepath": filepath, "caption": caption[:1024]})
+
+def flush(timeout: float = 10.0) -> bool:
+    """Ждёт, пока очередь опустеет и последняя пачка уйдёт (для остановки процесса)."""
+    deadline = time.monotonic() + timeout
+    while _q.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return not _q.unfinished_tasks
+
+atexit.register(flush, 5.0)
+
+# =============== ВОРКЕР ===============
+def _merge(batch: list) -> list:
+    """Склеивает подряд идущие сообщения одного чата/бота/parse_mode, пока влезают в лимит."""
+    out = []
+    for item in batch:
+        prev = out[-1] if out else None
+        if (
+            prev is not None
+            and item["kind"] == "message" and prev["kind"] == "message"
+            and (prev["token"], prev["chat_id"], prev["parse_mode"]) == (item["token"], item["chat_id"], item["parse_mode"])
+            and len(prev["text"]) + 2 + len(item["text"]) <= TG_MAX_TEXT
+        ):
+            prev["text"] = prev["text"] + "\n\n" + item["text"]
+            _count("merged")
+            continue
+        out.append(dict(item))
+    return out
+
+def _wait_chat_slot(chat_id: str):
+    last = _last_sent.get(chat_id)
+    if last is not None:
+        delay = last + TG_CHAT_MIN_INTERVAL_SEC - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+def _deliver_once(item: dict):
+    base = f"https://api.telegram.org/bot{item['token']}"
+    if item["kind"] == "document":
+        if not os.path.exists(item["filepath"]):
+            return None
+        with open(item["filepath"], "rb") as f:
+            files = {"document": (os.path.basename(item["filepath"]), f)}
+            data = {"chat_id": item["chat_id"], "caption": item["caption"]}
+            return http_post("telegram", base + "/sendDocument", data=data, files=files)
+    params = {"chat_id": item["chat_id"], "text": item["text"]}
+    if item["parse_mode"]:
+        params["parse_mode"] = item["parse_mode"]
+    return http_get("telegram", base + "/sendMessage", params=params)
+
+def _deliver(item: dict):
+    backoff = 1.0
+    for attempt in range(TG_MAX_ATTEMPTS):
+        _wait_chat_slot(item["chat_id"])
+        try:
+            r = _deliver_once(item)
+            _last_sent[item["chat_id"]] = time.monotonic()
+            if r is None:
+                jsonlog.event(f"⚠️ Telegram document missing: {item.get('filepath')}", logging.WARNING)
+                _count("failed")
+                return
+            if r.status_code == 200:
+                _count("sent")
+                return
+            if r.status_code == 429:
+                try:
+                    retry_after = float(((r.json() or {}).get("parameters") or {}).get("retry_after", backoff))
+                except Exception:
+                    retry_after = backoff
+                jsonlog.event(f"⏳ Telegram 429, retry after {retry_after}s", logging.WARNING)
+                time.sleep(retry_after)
+            elif r.status_code < 500:
+                # 4xx кроме 429 — повтор не поможет (битый markdown, неверный chat_id)
+                jsonlog.event(f"❌ Telegram error: {r.text[:300]}", logging.ERROR)
+                _count("failed")
+                return
+            else:
+                time.sleep(backoff + random.uniform(0, backoff / 2))
+        except Exception as e:
+            err = str(e).replace(item["token"], "***") if item["token"] else str(e)  # URL с /bot<token>
+            jsonlog.event(f"❌ Telegram exception: {err}", logging.ERROR)
+            time.sleep(backoff + random.uniform(0, backoff / 2))
+        backoff = min(backoff * 2, 30.0)
+        _count("retries")
+    _count("failed")
+
+def _worker_loop():
+    while True:
+        first = _q.get()
+        batch = [first]
+        deadline = time.monotonic() + TG_COALESCE_SEC
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                batch.append(_q.get(timeout=left))
+            except queue.Empty:
+                break
+        for item in _merge(batch):
+            try:
+                with tracing.attach(item["trace"]):
+                    _deliver(item)
+            except Exception as e:
+                jsonlog.event(f"💀 Telegram outbox error: {e}", logging.ERROR)
+                _count("failed")
+        for _ in batch:
+            _q.task_done()
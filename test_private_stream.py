@@ -0,0 +1,140 @@
+# test_private_stream.py — приватные стримы Bybit / OKX против локального ws_standin, без сети
+#
+#   python -m pytest -q test_private_stream.py
+
+import json, time
+
+import pytest
+
+import position_watcher
+from private_stream import AccountState, BybitPrivateStream, OkxPrivateStream
+from ws_standin import StandinServer
+
+KEY, SECRET, PASSPHRASE = "K", "S", "P"
+
+def _until(cond, timeout: float = 5.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+def _sent(server, op: str) -> list:
+    with server.lock:
+        return [m for m in map(json.loads, (t for t in server.received if t.startswith("{"))) if m.get("op") == op]
+
+def _stream(venue: str, url: str, state: AccountState, secret: str = SECRET):
+    if venue == "bybit":
+        return BybitPrivateStream(KEY, secret, url=url, state=state)
+    return OkxPrivateStream(KEY, secret, PASSPHRASE, url=url, state=state)
+
+@pytest.fixture(params=["bybit", "okx"])
+def venue(request):
+    return request.param
+
+@pytest.fixture
+def server(venue):
+    srv = StandinServer(venue, api_key=KEY, secret=SECRET, passphrase=PASSPHRASE).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+@pytest.fixture
+def connected(venue, server):
+    """Подключённый стрим со своим AccountState и списком полученных событий."""
+    state, events = AccountState(), []
+    stream = _stream(venue, server.url, state)
+    stream.subscribe(events.append)
+    stream.start()
+    assert _until(lambda: state.connected.get(venue)), "stream did not connect"
+    yield stream, state, events
+    stream.stop()
+
+# =============== AUTH / SUBSCRIBE ===============
+def test_login_and_subscribe(venue, server, connected):
+    login = _sent(server, "auth" if venue == "bybit" else "login")
+    assert len(login) == 1
+    assert _until(lambda: _sent(server, "subscribe"))
+    args = _sent(server, "subscribe")[0]["args"]
+    if venue == "bybit":
+        assert args == list(BybitPrivateStream.topics)
+    else:
+        assert [a["channel"] for a in args] == list(OkxPrivateStream.channels)
+
+def test_bad_secret_never_connects(venue, server):
+    state = AccountState()
+    stream = _stream(venue, server.url, state, secret="wrong")
+    stream.start()
+    try:
+        assert _until(lambda: _sent(server, "auth" if venue == "bybit" else "login"))
+        time.sleep(0.2)
+        assert not state.connected.get(venue)
+        assert not server.clients
+    finally:
+        stream.stop()
+
+# =============== RECONNECT ===============
+def test_reconnects_after_drop(venue, server, connected):
+    stream, state, _ = connected
+    connected_at = state.connected_at[venue]
+    server.drop_all()
+    assert _until(lambda: not state.connected.get(venue))
+    assert _until(lambda: state.connected.get(venue), timeout=5)  # бэкофф первой попытки ≤ 1.5 с
+    assert stream.reconnects == 1
+    assert state.connected_at[venue] > connected_at
+    assert len(_sent(server, "subscribe")) == 2
+
+# =============== СОБЫТИЯ ===============
+def _push_position(server, venue: str, inst: str, size: float):
+    if venue == "bybit":
+        server.push({"topic": "position.linear", "data": [{"symbol": inst, "size": str(size)}]})
+    else:
+        server.push({"arg": {"channel": "positions"}, "data": [{"instId": inst, "pos": str(size)}]})
+
+def test_events_update_account_state(venue, server, connected):
+    _, state, events = connected
+    inst = "BTCUSDT" if venue == "bybit" else "BTC-USDT-SWAP"
+    _push_position(server, venue, inst, 0.5)
+    if venue == "bybit":
+        server.push({"topic": "order.linear", "data": [
+            {"symbol": inst, "orderId": "o1", "orderStatus": "New", "stopOrderType": ""},
+            {"symbol": inst, "orderId": "o2", "orderStatus": "Untriggered", "stopOrderType": "PartialStopLoss"},
+        ]})
+        server.push({"topic": "execution.linear", "data": [{"symbol": inst, "execId": "e1", "execQty": "0.5"}]})
+    else:
+        server.push({"arg": {"channel": "orders"}, "data": [
+            {"instId": inst, "ordId": "o1", "state": "partially_filled", "fillSz": "0.1"},
+        ]})
+        server.push({"arg": {"channel": "orders-algo"}, "data": [{"instId": inst, "algoId": "a1", "state": "live"}]})
+    assert _until(lambda: len(events) >= 4)
+    assert state.position_size(venue, inst) == 0.5
+    assert state.has_orders(venue, inst) and state.has_algo_orders(venue, inst)
+    types = [e["type"] for e in events]
+    assert types[0] == "position" and "execution" in types
+    assert all(e["venue"] == venue and e["inst"] == inst for e in events)
+
+    # ордер исполнен / алго снят — пропадают из состояния
+    if venue == "bybit":
+        server.push({"topic": "order.linear", "data": [
+            {"symbol": inst, "orderId": "o1", "orderStatus": "Filled", "stopOrderType": ""},
+            {"symbol": inst, "orderId": "o2", "orderStatus": "Deactivated", "stopOrderType": "PartialStopLoss"},
+        ]})
+    else:
+        server.push({"arg": {"channel": "orders"}, "data": [{"instId": inst, "ordId": "o1", "state": "filled", "fillSz": "0.4"}]})
+        server.push({"arg": {"channel": "orders-algo"}, "data": [{"instId": inst, "algoId": "a1", "state": "canceled"}]})
+    assert _until(lambda: not state.has_orders(venue, inst) and not state.has_algo_orders(venue, inst))
+
+def test_flat_position_event_finishes_watch(venue, server, connected):
+    stream, _, _ = connected
+    inst = "ETHUSDT" if venue == "bybit" else "ETH-USDT-SWAP"
+    size_key = "size" if venue == "bybit" else "pos"
+    watcher = position_watcher.PositionWatcher(lambda: None, interval=3600, name=f"test-watcher-{venue}")
+    stream.subscribe(lambda e: e["type"] == "position" and watcher.on_position(e["inst"], e["data"].get(size_key)))
+    flats = []
+    watcher.watch(inst, lambda symbol, final: flats.append((symbol, final)))
+    _push_position(server, venue, inst, 1.0)
+    _push_position(server, venue, inst, 0)
+    assert _until(lambda: flats)
+    assert flats == [(inst, True)]  # событие стрима финально сразу, без подтверждений опросом
+    assert watcher.watched() == []
@@ -0,0 +1,63 @@
+# test_trade_journal.py — импорт старого CSV в журнал не плодит открытые дубли после рестарта
+#
+#   python -m pytest -q test_trade_journal.py
+
+import csv
+
+import pytest
+
+import trade_journal
+
+ROW = ["2026-01-05 10:00:00", "BTCUSDT", "UP", "1m", "SCALP", "60000", "59000", "61000"]
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(trade_journal, "TRADE_JOURNAL_DB", str(tmp_path / "trades.sqlite3"))
+    monkeypatch.setattr(trade_journal, "_conn", None)
+    yield tmp_path
+    if trade_journal._conn is not None:
+        trade_journal._conn.close()
+
+def _restart():
+    """Новый процесс: соединение открывается заново, файл БД тот же."""
+    trade_journal._conn.close()
+    trade_journal._conn = None
+
+def _log_signal(path, row):
+    """Как app.log_signal: строка в CSV и сделка в журнал."""
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(row)
+    trade_journal.record_trade(*row[:5], float(row[5]), float(row[6]), float(row[7]))
+
+def _open_rows() -> int:
+    return trade_journal._db().execute("SELECT COUNT(*) FROM trades WHERE result IS NULL").fetchone()[0]
+
+def test_restart_without_csv_does_not_duplicate(journal):
+    path = journal / "signals_log.csv"
+    assert trade_journal.import_csv(str(path)) == 0  # первый запуск: CSV ещё нет
+    _log_signal(path, ROW)
+    _restart()
+    assert trade_journal.import_csv(str(path)) == 0
+    assert _open_rows() == 1
+
+def test_import_skips_trades_already_in_journal(journal):
+    path = journal / "signals_log.csv"
+    _log_signal(path, ROW)  # журнал уже писался, флага импорта нет
+    _log_signal(path, ["2026-01-05 11:00:00", "ETHUSDT", "DOWN", "1m", "SCALP", "3000", "3100", "2900"])
+    trade_journal._db().execute("DELETE FROM trades WHERE ticker='ETHUSDT'")
+    _restart()
+    assert trade_journal.import_csv(str(path)) == 1
+    assert _open_rows() == 2
+    _restart()
+    assert trade_journal.import_csv(str(path)) == 0
+    assert _open_rows() == 2
+
+def test_mark_unresolved_spares_linked_trades(journal):
+    old = trade_journal.record_trade("2026-01-05 09:00:00", "BTCUSDT", "UP", "1m", "SCALP", 59000, 58000, 60000)
+    ours = trade_journal.record_trade(*ROW[:5], 60000, 59000, 61000, link="tv-1")
+    assert trade_journal.mark_unresolved("BTCUSDT", "UP", 1) == 1  # чужой выход: только строка без link
+    assert trade_journal.open_trade_by_link("tv-1")["id"] == ours
+    newer = trade_journal.record_trade(*ROW[:5], 60000, 59000, 61000, link="tv-2")
+    assert trade_journal.mark_unresolved("BTCUSDT", "UP", 2, before_id=newer) == 1  # закрылась tv-2
+    rows = {r["id"]: r["result"] for r in trade_journal._db().execute("SELECT id, result FROM trades")}
+    assert rows == {old: "unresolved", ours: "unresolved", newer: None}
@@ -0,0 +1,316 @@
+# tracing.py — трейсы сигналов: спаны этапов и исходящих запросов в JSONL
+#
+# Каждый входящий вебхук получает trace_id (заголовок X-Trace-Id в ответе).
+# Этапы (metrics.Stopwatch) и HTTP-вызовы (http_clients) пишут спаны со временем,
+# эндпоинтом, HTTP-кодом и retCode/sCode. Контекст лежит в contextvars и
+# переносится в фоновые потоки через bind()/attach() (чистка позиции, Telegram).
+# Запись — через QueueHandler в ротируемый файл, вебхук не ждёт диска.
+#
+# CLI:
+#   python tracing.py last [N]          — последние трейсы
+#   python tracing.py slow [N]          — самые медленные
+#   python tracing.py show <trace_id>   — дерево спанов, * — критический путь
+
+import os, re, sys, json, time, queue, atexit, logging, threading, contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+TRACE_FILE = os.getenv("TRACE_FILE", "/tmp/traces.jsonl")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(20 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "5"))
+
+# (trace_id, span_id) текущего спана
+_current = contextvars.ContextVar("trace_current", default=None)
+
+_logger = logging.getLogger("tv.trace")
+_logger.propagate = False
+_logger.setLevel(logging.INFO)
+_listener = None
+_listener_pid = None
+_setup_lock = threading.Lock()
+
+def _setup():
+    """Один QueueListener на процесс (после fork gunicorn — новый), как в jsonlog."""
+    global _listener, _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _setup_lock:
+        if _listener_pid == pid:
+            return
+        q = queue.Queue(maxsize=10000)
+        for h in list(_logger.handlers):
+            _logger.removeHandler(h)
+        _logger.addHandler(QueueHandler(q))
+        out = RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS, encoding="utf-8")
+        out.setFormatter(logging.Formatter("%(message)s"))
+        _listener = QueueListener(q, out, respect_handler_level=False)
+        _listener.start()
+        _listener_pid = pid
+
+def _stop():
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+atexit.register(_stop)
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+# =============== СПАНЫ ===============
+class Span:
+    __slots__ = ("trace", "id", "parent", "name", "start", "_p0", "attrs", "_token", "_done")
+
+    def __init__(self, trace: str, parent, name: str, attrs: dict):
+        self.trace, self.parent, self.name, self.attrs = trace, parent, name, attrs
+        self.id = _new_id(4)
+        self.start = time.time()
+        self._p0 = time.perf_counter()
+        self._token = _current.set((trace, self.id))
+        self._done = False
+
+    def __bool__(self):
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        self.end()
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def _restore(self):
+        try:
+            _current.reset(self._token)
+        except ValueError:  # закрыт из другого контекста
+            _current.set((self.trace, self.parent) if self.parent else None)
+
+    def discard(self):
+        """Закрыть без записи (этап не выполнялся)."""
+        if not self._done:
+            self._done = True
+            self._restore()
+
+    def end(self, **attrs):
+        if self._done:
+            return
+        self._done = True
+        dur_ms = (time.perf_counter() - self._p0) * 1000
+        self._restore()
+        if attrs:
+            self.attrs.update(attrs)
+        rec = {"trace": self.trace, "span": self.id, "parent": self.parent, "name": self.name,
+               "start": round(self.start, 6), "dur_ms": round(dur_ms, 3)}
+        rec.update(self.attrs)
+        _setup()
+        _logger.info(json.dumps(rec, ensure_ascii=False, default=str))
+
+class _NullSpan:
+    """Заглушка вне трейса: все методы — no-op, bool() == False."""
+    __slots__ = ()
+    trace = id = None
+
+    def __bool__(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        return self
+
+    def discard(self):
+        pass
+
+    def end(self, **attrs):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+# =============== API ===============
+def root(name: str, **attrs):
+    """Новый трейс (на входящий сигнал)."""
+    if not TRACE_ENABLED:
+        return NULL_SPAN
+    return Span(_new_id(8), None, name, attrs)
+
+def span(name: str, **attrs):
+    """Дочерний спан текущего; вне трейса — NULL_SPAN."""
+    cur = _current.get()
+    if cur is None:
+        return NULL_SPAN
+    return Span(cur[0], cur[1], name, attrs)
+
+def current():
+    """(trace_id, span_id) или None — для передачи в другой поток."""
+    return _current.get()
+
+def trace_id():
+    cur = _current.get()
+    return cur[0] if cur else None
+
+class attach:
+    """with attach(ctx): ... — продолжить трейс ctx (из current()) в этом потоке."""
+    __slots__ = ("ctx", "_token")
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self._token = None
+
+    def __enter__(self):
+        if self.ctx is not None:
+            self._token = _current.set(self.ctx)
+        return self
+
+    def __exit__(self, *exc):
+        if self._token is not None:
+            _current.reset(self._token)
+        return False
+
+def bind(fn):
+    """Обёртка fn, которая выполняется в трейсе, активном в момент bind()."""
+    ctx = _current.get()
+    if ctx is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        with attach(ctx):
+            return fn(*args, **kwargs)
+    return bound
+
+# retCode (Bybit), code/sCode (OKX) — без полного json.loads ответа
+_RET_RE = re.compile(r'"(retCode|code)"\s*:\s*"?(-?\d+)')
+_SCODE_RE = re.compile(r'"sCode"\s*:\s*"?(-?\d+)')
+
+def response_codes(text: str) -> dict:
+    head = text[:2000]
+    out = {}
+    m = _RET_RE.search(head)
+    if m:
+        out["ret"] = m.group(2)
+    m = _SCODE_RE.search(head)
+    if m:
+        out["scode"] = m.group(1)
+    return out
+
+# =============== CLI ===============
+def _files(path: str) -> list:
+    out = [f"{path}.{i}" for i in range(TRACE_BACKUPS, 0, -1)]
+    return [p for p in out + [path] if os.path.exists(p)]
+
+def load(path: str = None, trace: str = None) -> list:
+    spans = []
+    for p in _files(path or TRACE_FILE):
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                if trace and trace not in line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if trace is None or rec.get("trace") == trace:
+                    spans.append(rec)
+    return spans
+
+def _end(s: dict) -> float:
+    return s["start"] + s["dur_ms"] / 1000
+
+def critical_path(spans: list) -> set:
+    """
+    От корня: последний завершившийся ребёнок, затем тот, что завершился до его
+    начала, и так далее; рекурсивно внутрь. Асинхронный хвост (после конца корня) не входит.
+    """
+    by_id = {s["span"]: s for s in spans}
+    children = {}
+    root_span = None
+    for s in spans:
+        parent = s.get("parent")
+        if parent is None:
+            root_span = s
+        else:
+            children.setdefault(parent if parent in by_id else "?", []).append(s)
+    if root_span is None:
+        return set()
+    children.setdefault(root_span["span"], []).extend(children.pop("?", []))
+
+    path = set()
+
+    def walk(s, limit):
+        path.add(s["span"])
+        kids = sorted((k for k in children.get(s["span"], []) if _end(k) <= limit + 1e-4), key=_end, reverse=True)
+        t = limit
+        for k in kids:
+            if _end(k) <= t + 1e-4:
+                walk(k, _end(k))
+                t = k["start"]
+
+    walk(root_span, _end(root_span))
+    return path
+
+def _describe(s: dict) -> str:
+    skip = {"trace", "span", "parent", "name", "start", "dur_ms"}
+    extra = " ".join(f"{k}={v}" for k, v in s.items() if k not in skip)
+    return f"{s['name']} {extra}".strip()
+
+def show(trace: str, path: str = None, out=sys.stdout):
+    spans = load(path, trace)
+    if not spans:
+        print(f"trace {trace}: not found", file=out)
+        return
+    crit = critical_path(spans)
+    by_parent = {}
+    ids = {s["span"] for s in spans}
+    roots = []
+    for s in spans:
+        parent = s.get("parent")
+        if parent in ids:
+            by_parent.setdefault(parent, []).append(s)
+        else:
+            roots.append(s)
+    roots.sort(key=lambda s: (s.get("parent") is not None, s["start"]))
+    t0 = min(s["start"] for s in spans)
+    root_end = max((_end(s) for s in roots if s.get("parent") is None), default=None)
+
+    def emit(s, depth):
+        mark = "*" if s["span"] in crit else " "
+        tail = "  (async)" if root_end is not None and s["start"] > root_end else ""
+        print(f"{mark} +{(s['start'] - t0) * 1000:9.1f}ms {s['dur_ms']:9.1f}ms  {'  ' * depth}{_describe(s)}{tail}", file=out)
+        for k in sorted(by_parent.get(s["span"], []), key=lambda x: x["start"]):
+            emit(k, depth + 1)
+
+    print(f"trace {trace}", file=out)
+    for s in roots:
+        emit(s, 0)
+
+def _roots(path: str = None) -> list:
+    return [s for s in load(path) if s.get("parent") is None]
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    cmd = argv.pop(0) if argv else "last"
+    if cmd == "show" and argv:
+        show(argv[0])
+        return 0
+    if cmd in ("last", "slow"):
+        n = int(argv[0]) if argv else 20
+        roots = _roots()
+        roots.sort(key=(lambda s: s["dur_ms"]) if cmd == "slow" else (lambda s: s["start"]), reverse=True)
+        for s in roots[:n]:
+            ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(s["start"]))
+            print(f"{s['trace']}  {ts}Z  {s['dur_ms']:9.1f}ms  {_describe(s)}")
+        return 0
+    print("usage: python tracing.py last [N] | slow [N] | show <trace_id>")
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
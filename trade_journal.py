@@ -0,0 +1,268 @@
+# trade_journal.py — журнал сделок в SQLite (WAL) вместо пересканирования CSV
+#
+# Вставка — append, исход сделки — UPDATE по id. Частичный индекс по открытым
+# сделкам и индекс (ticker, direction, entry): стоимость не растёт с историей.
+# Исторический CSV импортируется один раз (флаг в таблице meta).
+# Исполнения биржи (fills) — по execId: повторно пришедшее исполнение не учтётся дважды.
+# exit_orders — id attached TP/SL ордеров сделки (у них нет своего orderLinkId).
+
+import os, csv, sqlite3, threading
+
+import jsonlog
+
+TRADE_JOURNAL_DB = os.getenv("TRADE_JOURNAL_DB", "/tmp/trades.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trades (
+    id        INTEGER PRIMARY KEY,
+    time_utc  TEXT NOT NULL,
+    ticker    TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    tf        TEXT,
+    type      TEXT,
+    entry     REAL NOT NULL,
+    stop      REAL,
+    target    REAL,
+    result    TEXT
+);
+CREATE INDEX IF NOT EXISTS trades_open ON trades(ticker) WHERE result IS NULL;
+CREATE INDEX IF NOT EXISTS trades_key ON trades(ticker, direction, entry);
+CREATE TABLE IF NOT EXISTS fills (
+    exec_id       TEXT PRIMARY KEY,
+    trade_id      INTEGER,
+    symbol        TEXT NOT NULL,
+    side          TEXT NOT NULL,
+    order_id      TEXT,
+    order_link_id TEXT,
+    price         REAL NOT NULL,
+    qty           REAL NOT NULL,
+    fee           REAL,
+    closed_size   REAL,
+    exec_time     INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fills_trade ON fills(trade_id);
+CREATE TABLE IF NOT EXISTS exit_orders (
+    order_id TEXT PRIMARY KEY,
+    link     TEXT NOT NULL,
+    kind     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS signals (
+    id       TEXT PRIMARY KEY,
+    route    TEXT NOT NULL,
+    symbol   TEXT,
+    state    TEXT NOT NULL,
+    status   TEXT,
+    received REAL NOT NULL,
+    started  REAL,
+    finished REAL,
+    trace    TEXT,
+    payload  TEXT,
+    result   TEXT
+);
+CREATE INDEX IF NOT EXISTS signals_received ON signals(received);
+"""
+
+_conn = None
+_conn_pid = None
+_lock = threading.Lock()
+
+def _db() -> sqlite3.Connection:
+    """Одно соединение на процесс (после fork — новое), доступ под _lock."""
+    global _conn, _conn_pid
+    pid = os.getpid()
+    if _conn is None or _conn_pid != pid:
+        conn = sqlite3.connect(TRADE_JOURNAL_DB, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(_SCHEMA)
+        _migrate(conn)
+        _conn, _conn_pid = conn, pid
+    return _conn
+
+# колонки исхода, добавленные к trades после первого релиза (ALTER для старых файлов)
+_TRADE_COLUMNS = {
+    "link": "TEXT",        # orderLinkId входного ордера
+    "qty": "REAL",         # исполнено на входе
+    "fill_price": "REAL",  # средняя цена входа по исполнениям
+    "open_fee": "REAL",
+    "exit_qty": "REAL",
+    "exit_price": "REAL",  # средняя цена выхода
+    "close_fee": "REAL",
+    "pnl": "REAL",         # после комиссий входа и выхода
+    "closed_ms": "INTEGER",
+}
+_TRADE_UPDATABLE = ("result",) + tuple(_TRADE_COLUMNS)
+
+def _migrate(conn: sqlite3.Connection):
+    have = {r[1] for r in conn.execute("PRAGMA table_info(trades)")}
+    for col, typ in _TRADE_COLUMNS.items():
+        if col not in have:
+            conn.execute(f"ALTER TABLE trades ADD COLUMN {col} {typ}")
+    conn.execute("CREATE INDEX IF NOT EXISTS trades_link ON trades(link) WHERE link IS NOT NULL")
+
+def record_trade(time_utc: str, ticker: str, direction: str, tf: str, typ: str,
+                 entry: float, stop: float, target: float, link: str = None) -> int:
+    with _lock:
+        cur = _db().execute(
+            "INSERT INTO trades(time_utc, ticker, direction, tf, type, entry, stop, target, link) VALUES (?,?,?,?,?,?,?,?,?)",
+            (time_utc, ticker, direction, tf, typ, float(entry), float(stop), float(target), link),
+        )
+        return cur.lastrowid
+
+def update_trade(trade_id: int, **fields):
+    cols = [k for k in fields if k in _TRADE_UPDATABLE]
+    if not cols:
+        return
+    with _lock:
+        _db().execute(
+            f"UPDATE trades SET {', '.join(c + '=?' for c in cols)} WHERE id=?",
+            [fields[c] for c in cols] + [trade_id],
+        )
+
+def open_trade_by_link(link: str):
+    with _lock:
+        row = _db().execute("SELECT * FROM trades WHERE link=? AND result IS NULL", (link,)).fetchone()
+    return dict(row) if row else None
+
+def mark_unresolved(ticker: str, direction: str, closed_ms: int, before_id: int = None) -> int:
+    """
+    Открытые сделки, исход которых по исполнениям не определить: без orderLinkId
+    (старый CSV, до журнала исполнений), либо — с before_id — все более ранние
+    (позиция на символе одна: закрылась сделка before_id — закрыты и они).
+    Цены выхода и pnl не заполняются.
+    """
+    cond = "id < ?" if before_id is not None else "link IS NULL"
+    args = (int(closed_ms), ticker, direction) + ((before_id,) if before_id is not None else ())
+    with _lock:
+        cur = _db().execute(
+            "UPDATE trades SET result='unresolved', closed_ms=? "
+            f"WHERE ticker=? AND direction=? AND result IS NULL AND {cond}",
+            args,
+        )
+        return cur.rowcount
+
+def add_exit_orders(link: str, orders: dict):
+    """orders: {orderId: "TP" | "SL"} — attached TP/SL сделки с orderLinkId link."""
+    with _lock:
+        _db().executemany(
+            "INSERT OR IGNORE INTO exit_orders(order_id, link, kind) VALUES (?,?,?)",
+            [(oid, link, kind) for oid, kind in orders.items()],
+        )
+
+def exit_order(order_id: str):
+    """-> (link, "TP" | "SL") для attached TP/SL ордера, либо None."""
+    with _lock:
+        row = _db().execute("SELECT link, kind FROM exit_orders WHERE order_id=?", (order_id,)).fetchone()
+    return (row["link"], row["kind"]) if row else None
+
+def add_fill(exec_id: str, symbol: str, side: str, order_id: str, order_link_id: str, price: float,
+             qty: float, fee: float, closed_size: float, exec_time: int) -> bool:
+    """False — исполнение уже записано (пересечение окон курсора)."""
+    with _lock:
+        cur = _db().execute(
+            "INSERT OR IGNORE INTO fills(exec_id, symbol, side, order_id, order_link_id, price, qty, fee, closed_size, exec_time) "
+            "VALUES (?,?,?,?,?,?,?,?,?,?)",
+            (exec_id, symbol, side, order_id, order_link_id, price, qty, fee, closed_size, exec_time),
+        )
+        return cur.rowcount == 1
+
+def link_fill(exec_id: str, trade_id: int):
+    with _lock:
+        _db().execute("UPDATE fills SET trade_id=? WHERE exec_id=?", (trade_id, exec_id))
+
+def unlinked_fills(order_link_id: str) -> list:
+    """Исполнения входа, пришедшие раньше строки сделки."""
+    with _lock:
+        rows = _db().execute(
+            "SELECT * FROM fills WHERE order_link_id=? AND trade_id IS NULL ORDER BY exec_time", (order_link_id,)
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+def get_meta(key: str, default=None):
+    with _lock:
+        row = _db().execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+    return row["value"] if row else default
+
+def set_meta(key: str, value):
+    with _lock:
+        _db().execute("INSERT INTO meta(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, str(value)))
+
+# =============== СИГНАЛЫ (ingest) ===============
+# Общая для воркеров gunicorn таблица: /signal/<id> отвечает любой воркер.
+_SIGNAL_FIELDS = ("state", "status", "started", "finished", "result")
+
+def record_signal(sig_id: str, route: str, symbol: str, received: float, trace: str, payload: str):
+    with _lock:
+        _db().execute(
+            "INSERT INTO signals(id, route, symbol, state, received, trace, payload) VALUES (?,?,?,'queued',?,?,?)",
+            (sig_id, route, symbol, received, trace, payload),
+        )
+
+def update_signal(sig_id: str, **fields):
+    cols = [k for k in fields if k in _SIGNAL_FIELDS]
+    if not cols:
+        return
+    with _lock:
+        _db().execute(
+            f"UPDATE signals SET {', '.join(c + '=?' for c in cols)} WHERE id=?",
+            [fields[c] for c in cols] + [sig_id],
+        )
+
+def get_signal(sig_id: str):
+    with _lock:
+        row = _db().execute("SELECT * FROM signals WHERE id=?", (sig_id,)).fetchone()
+    return dict(row) if row else None
+
+def prune_signals(before: float) -> int:
+    with _lock:
+        return _db().execute("DELETE FROM signals WHERE received < ?", (before,)).rowcount
+
+def import_csv(path: str) -> int:
+    """
+    Одноразовый импорт сделок из старого signals_log.csv (строки с entry/stop/target).
+    Повторный вызов ничего не делает. Возвращает число импортированных строк.
+    CSV ещё нет — флаг ставится сразу: дальше log_signal пишет сделки и в CSV, и в
+    журнал, и импорт после рестарта продублировал бы их открытыми строками.
+    Строки, уже лежащие в trades (тот же time_utc/ticker/direction/entry), пропускаются.
+    """
+    if get_meta("csv_imported"):
+        return 0
+    if not os.path.exists(path):
+        set_meta("csv_imported", path)
+        return 0
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for r in csv.reader(f):
+            if len(r) < 8 or r[0].lower().startswith("time_utc"):
+                continue
+            try:
+                entry, stop, target = float(r[5]), float(r[6]), float(r[7])
+            except ValueError:
+                continue  # блок-строки без цен
+            result = r[8] if len(r) >= 9 and r[8] in ("TP", "SL") else None
+            rows.append((r[0], r[1], r[2], r[3], r[4], entry, stop, target, result))
+    with _lock:
+        db = _db()
+        db.execute("BEGIN")
+        try:
+            rows = [r for r in rows if db.execute(
+                "SELECT 1 FROM trades WHERE ticker=? AND direction=? AND entry=? AND time_utc=?",
+                (r[1], r[2], r[5], r[0]),
+            ).fetchone() is None]
+            db.executemany(
+                "INSERT INTO trades(time_utc, ticker, direction, tf, type, entry, stop, target, result) VALUES (?,?,?,?,?,?,?,?,?)",
+                rows,
+            )
+            db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('csv_imported', ?)", (path,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    jsonlog.event(f"📥 trade journal: imported {len(rows)} trades from {path}")
+    return len(rows)
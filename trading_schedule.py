@@ -0,0 +1,124 @@
+# trading_schedule.py — скомпилированное расписание торговли (минута недели → разрешено?)
+#
+# Правила из env (дни + окна) компилируются один раз в таблицу на 7*1440 минут
+# в настоящей IANA-таймзоне (TRADING_TZ, с учётом перехода на летнее время).
+# Проверка на каждом сигнале — один индекс в bytes, без перебора диапазонов.
+#
+# Формат окон: "0-3,9-12" (часы, [start, end)) и/или "09:30-11:15,22:00-02:00"
+# (минуты; окно через полночь допускается).
+
+import os
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+# Etc/GMT-2 = UTC+2 без летнего времени (знак в Etc/* инвертирован) — как было раньше
+TRADING_TZ = os.getenv("TRADING_TZ", "Etc/GMT-2")
+
+MINUTES_PER_DAY = 1440
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+ALLOWED = 0
+BLOCKED_DAY = 1
+BLOCKED_HOUR = 2
+_REASONS = {BLOCKED_DAY: "blocked_day", BLOCKED_HOUR: "blocked_hour"}
+
+# =============== ПАРСИНГ ===============
+def parse_days(txt: str) -> set:
+    """'0,1,2' → {0,1,2} (0=Пн). Мусор пропускается."""
+    return {int(x) for x in (txt or "").split(",") if x.strip().isdigit() and 0 <= int(x) <= 6}
+
+def _minute_of_day(token: str) -> int:
+    token = token.strip()
+    if ":" in token:
+        h, m = token.split(":", 1)
+        h, m = int(h), int(m)
+        if not (0 <= m < 60):
+            raise ValueError(token)
+    else:
+        h, m = int(token), 0
+    value = h * 60 + m
+    if not (0 <= value <= MINUTES_PER_DAY):
+        raise ValueError(token)
+    return value
+
+def parse_windows(txt: str) -> list:
+    """'0-3,09:30-11:15,22-2' → [(0,180), (570,675), (1320,120)] в минутах суток, [start, end)."""
+    windows = []
+    for part in (txt or "").split(","):
+        part = part.strip()
+        if "-" not in part:
+            continue
+        a, b = part.split("-", 1)
+        try:
+            start, end = _minute_of_day(a), _minute_of_day(b)
+        except ValueError:
+            continue
+        if start == end:
+            continue
+        windows.append((start % MINUTES_PER_DAY, end))
+    return windows
+
+# =============== КОМПИЛЯЦИЯ ===============
+def compile_rule(days_txt: str, windows_txt: str, empty_days_allow: bool = False,
+                 empty_windows_allow: bool = False) -> bytes:
+    """
+    Таблица кодов на каждую минуту недели: ALLOWED / BLOCKED_DAY / BLOCKED_HOUR.
+    Пустой список дней/окон по умолчанию блокирует всё (как у Bybit);
+    empty_*_allow=True — «ограничений нет» (как у OKX).
+    """
+    days = parse_days(days_txt)
+    windows = parse_windows(windows_txt)
+
+    day_minutes = bytearray(MINUTES_PER_DAY)  # 1 = минута внутри окна
+    if not windows and empty_windows_allow:
+        day_minutes[:] = b"\x01" * MINUTES_PER_DAY
+    for start, end in windows:
+        if start < end:
+            day_minutes[start:end] = b"\x01" * (end - start)
+        else:  # через полночь
+            day_minutes[start:] = b"\x01" * (MINUTES_PER_DAY - start)
+            day_minutes[:end] = b"\x01" * end
+
+    table = bytearray(MINUTES_PER_WEEK)
+    for wd in range(7):
+        base = wd * MINUTES_PER_DAY
+        if (days and wd not in days) or (not days and not empty_days_allow):
+            table[base:base + MINUTES_PER_DAY] = bytes([BLOCKED_DAY]) * MINUTES_PER_DAY
+            continue
+        for m in range(MINUTES_PER_DAY):
+            if not day_minutes[m]:
+                table[base + m] = BLOCKED_HOUR
+    return bytes(table)
+
+class TradingSchedule:
+    """Набор скомпилированных правил по ключу (venue, direction) + allow-листы символов."""
+
+    def __init__(self, tz_name: str = None):
+        self.tz = ZoneInfo(tz_name or TRADING_TZ)
+        self.rules = {}
+        self.symbols = {}
+
+    def add(self, key, days_txt: str, windows_txt: str, symbols=None,
+            empty_days_allow: bool = False, empty_windows_allow: bool = False):
+        self.rules[key] = compile_rule(days_txt, windows_txt, empty_days_allow, empty_windows_allow)
+        if symbols is not None:
+            self.symbols[key] = frozenset(symbols)
+        return self
+
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc).astimezone(self.tz)
+
+    def minute_of_week(self, now: datetime = None) -> int:
+        local = (now or datetime.now(timezone.utc)).astimezone(self.tz)
+        return local.weekday() * MINUTES_PER_DAY + local.hour * 60 + local.minute
+
+    def check(self, key, now: datetime = None):
+        """None — торговать можно; иначе 'blocked_day' / 'blocked_hour'. Ключа нет — без ограничений."""
+        table = self.rules.get(key)
+        if table is None:
+            return None
+        return _REASONS.get(table[self.minute_of_week(now)])
+
+    def symbol_allowed(self, key, symbol: str) -> bool:
+        allowed = self.symbols.get(key)
+        return allowed is None or symbol in allowed
@@ -0,0 +1,227 @@
+# ws_standin.py — локальная замена приватного WebSocket Bybit / OKX для офлайн-проверки
+#
+# Минимальный RFC 6455 сервер на stdlib: отвечает на auth/login (с проверкой подписи,
+# если задан secret), подтверждает subscribe, отвечает на пинги и рассылает
+# подключённым клиентам то, что передано в push(). drop_all() рвёт соединения,
+# чтобы проверить переподключение.
+#
+#   python ws_standin.py --venue bybit --port 8765 --secret S
+#   (stdin: JSON на строку → рассылается всем клиентам)
+
+import os, sys, json, time, hmac, base64, hashlib, socket, struct, argparse, threading, socketserver
+
+_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# =============== ФРЕЙМЫ ===============
+def _recv_exact(sock, n: int) -> bytes:
+    buf = b""
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("client gone")
+        buf += chunk
+    return buf
+
+def read_frame(sock):
+    """-> (opcode, payload). Клиентские фреймы всегда замаскированы."""
+    b1, b2 = _recv_exact(sock, 2)
+    opcode = b1 & 0x0F
+    length = b2 & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", _recv_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", _recv_exact(sock, 8))[0]
+    mask = _recv_exact(sock, 4) if b2 & 0x80 else b"\x00\x00\x00\x00"
+    data = bytearray(_recv_exact(sock, length))
+    for i in range(length):
+        data[i] ^= mask[i % 4]
+    return opcode, bytes(data)
+
+def write_frame(sock, payload: bytes, opcode: int = 0x1):
+    head = bytearray([0x80 | opcode])
+    n = len(payload)
+    if n < 126:
+        head.append(n)
+    elif n < 65536:
+        head.append(126)
+        head += struct.pack(">H", n)
+    else:
+        head.append(127)
+        head += struct.pack(">Q", n)
+    sock.sendall(bytes(head) + payload)
+
+# =============== СЕРВЕР ===============
+class StandinServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, venue: str = "bybit", host: str = "127.0.0.1", port: int = 0,
+                 api_key: str = "", secret: str = "", passphrase: str = ""):
+        super().__init__((host, port), _Handler)
+        self.venue = venue
+        self.api_key = api_key
+        self.secret = secret
+        self.passphrase = passphrase
+        self.clients = set()
+        self.received = []  # все входящие текстовые сообщения (для проверки)
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"ws://{host}:{port}/"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name=f"ws-standin-{self.venue}", daemon=True).start()
+        return self
+
+    def push(self, message):
+        """Рассылает dict/str всем авторизованным клиентам."""
+        raw = message if isinstance(message, str) else json.dumps(message)
+        with self.lock:
+            clients = list(self.clients)
+        for h in clients:
+            h.send_text(raw)
+
+    def drop_all(self):
+        with self.lock:
+            clients = list(self.clients)
+            self.clients.clear()
+        for h in clients:
+            try:
+                h.request.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+
+    # --- проверка подписи ---
+    def check_bybit_auth(self, args) -> bool:
+        if not self.secret:
+            return True
+        try:
+            key, expires, sign = args
+        except Exception:
+            return False
+        want = hmac.new(self.secret.encode(), f"GET/realtime{expires}".encode(), hashlib.sha256).hexdigest()
+        return key == self.api_key and hmac.compare_digest(want, sign) and int(expires) > time.time() * 1000
+
+    def check_okx_login(self, args) -> bool:
+        if not self.secret:
+            return True
+        try:
+            a = args[0]
+            want = base64.b64encode(
+                hmac.new(self.secret.encode(), f"{a['timestamp']}GET/users/self/verify".encode(), digestmod="sha256").digest()
+            ).decode()
+        except Exception:
+            return False
+        return a.get("apiKey") == self.api_key and a.get("passphrase") == self.passphrase and hmac.compare_digest(want, a.get("sign", ""))
+
+class _Handler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.send_lock = threading.Lock()
+
+    def send_text(self, raw: str):
+        try:
+            with self.send_lock:
+                write_frame(self.request, raw.encode())
+        except Exception:
+            pass
+
+    def _handshake(self) -> bool:
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return False
+            data += chunk
+        headers = {}
+        for line in data.decode(errors="replace").split("\r\n")[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        key = headers.get("sec-websocket-key")
+        if not key:
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + _GUID).encode()).digest()).decode()
+        self.request.sendall((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode())
+        return True
+
+    def handle(self):
+        srv = self.server
+        if not self._handshake():
+            return
+        try:
+            while True:
+                opcode, payload = read_frame(self.request)
+                if opcode == 0x8:  # close
+                    return
+                if opcode == 0x9:  # ping → pong
+                    with self.send_lock:
+                        write_frame(self.request, payload, opcode=0xA)
+                    continue
+                if opcode != 0x1:
+                    continue
+                text = payload.decode()
+                with srv.lock:
+                    srv.received.append(text)
+                self._on_text(text)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with srv.lock:
+                srv.clients.discard(self)
+
+    def _on_text(self, text: str):
+        srv = self.server
+        if text == "ping":  # OKX
+            self.send_text("pong")
+            return
+        try:
+            msg = json.loads(text)
+        except Exception:
+            return
+        op = msg.get("op")
+        if srv.venue == "bybit":
+            if op == "auth":
+                ok = srv.check_bybit_auth(msg.get("args") or [])
+                self.send_text(json.dumps({"op": "auth", "success": ok, "ret_msg": "" if ok else "invalid signature"}))
+                if ok:
+                    with srv.lock:
+                        srv.clients.add(self)
+            elif op == "subscribe":
+                self.send_text(json.dumps({"op": "subscribe", "success": True, "ret_msg": ""}))
+            elif op == "ping":
+                self.send_text(json.dumps({"op": "pong", "success": True}))
+        else:
+            if op == "login":
+                ok = srv.check_okx_login(msg.get("args") or [])
+                self.send_text(json.dumps({"event": "login" if ok else "error", "code": "0" if ok else "60009", "msg": ""}))
+                if ok:
+                    with srv.lock:
+                        srv.clients.add(self)
+            elif op == "subscribe":
+                for arg in msg.get("args") or []:
+                    self.send_text(json.dumps({"event": "subscribe", "arg": arg}))
+
+def main():
+    ap = argparse.ArgumentParser(description="Local Bybit/OKX private WebSocket stand-in")
+    ap.add_argument("--venue", choices=("bybit", "okx"), default="bybit")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--api-key", default=os.getenv("BYBIT_API_KEY", ""))
+    ap.add_argument("--secret", default="")
+    ap.add_argument("--passphrase", default="")
+    a = ap.parse_args()
+    srv = StandinServer(a.venue, a.host, a.port, a.api_key, a.secret, a.passphrase).start()
+    print(f"🧪 {a.venue} private WS stand-in on {srv.url} (JSON lines from stdin are broadcast)")
+    for line in sys.stdin:
+        line = line.strip()
+        if line:
+            srv.push(line)
+
+if __name__ == "__main__":
+    main()